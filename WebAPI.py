@@ -1,5 +1,18 @@
+import re
 import requests
 import time
+import threading
+import metrics
+
+API_REQUESTS = metrics.Counter('qshp_api_requests_total', '论坛 API 请求数', ('endpoint', 'result'))
+API_SECONDS = metrics.Histogram('qshp_api_request_seconds', '论坛 API 请求耗时', ('endpoint',))
+API_BYTES = metrics.Counter('qshp_api_response_bytes_total', '论坛 API 响应字节数', ('endpoint',))
+API_RETRIES = metrics.Counter('qshp_api_retries_total', '论坛 API 失败后重新登录重试的次数', ('endpoint',))
+API_IN_FLIGHT = metrics.Gauge('qshp_api_in_flight', '正在进行的论坛 API 请求数')
+LOGINS = metrics.Counter('qshp_logins_total', '登录次数', ('result',))
+ACCOUNT_REQUESTS = metrics.Counter('qshp_account_requests_total', '账号池中各账号的请求数', ('account',))
+ACCOUNT_THROTTLED = metrics.Counter('qshp_account_throttled_total', '账号池中各账号被限流的次数', ('account',))
+ACCOUNT_AVAILABLE = metrics.Gauge('qshp_accounts_available', '账号池中未在冷却的账号数')
 
 
 class HepanException(Exception):
@@ -14,23 +27,114 @@ class HepanException(Exception):
         return self.message
 
 
-class WebAPI:
+class ThrottledException(HepanException):
+    """请求被论坛限流（HTTP 429 或“请求过于频繁”）"""
+
+
+class ForumAPI:
+    """论坛接口，子类实现 _request_api"""
+
+    def _request_api(self, method: str, short_url: str, args: dict = None, data=None):
+        raise NotImplementedError
+
+    def get_user_info(self, uid: int, user_summary: bool = False, visitors: bool = False) -> dict:
+        """
+        获取用户信息
+
+        :param uid: UID
+        :param user_summary: 是否获取摘要
+        :param visitors: 是否获取访客记录
+        """
+        short_url = f'user/{uid}/profile'
+        args = {'user_summary': int(user_summary), 'visitors': int(visitors)}
+        return self._request_api('get', short_url, args)
+
+    def get_user_threads(self, uid: int, page: int = 1, user_summary: bool = False, visitors: bool = False,
+                         additional='removevlog') -> dict:
+        """
+        获取用户帖子
+
+        :param uid: UID
+        :param page: 页码
+        :param user_summary: 是否获取摘要
+        :param visitors: 是否获取访客记录
+        :param additional:是否隐藏访问记录，可选removevlog
+        """
+        short_url = f'user/{uid}/threads'
+        args = {'page': page, 'user_summary': int(user_summary), 'visitors': int(visitors), 'additional': additional}
+        return self._request_api('get', short_url, args)
+
+    def get_user_replies(self, uid: int, page: int = 1, user_summary: bool = False, visitors: bool = False,
+                         additional='removevlog') -> dict:
+        """
+        获取用户回复
+
+        :param uid: UID
+        :param page: 页码
+        :param user_summary: 是否获取摘要
+        :param visitors: 是否获取访客记录
+        :param additional:是否隐藏访问记录，可选removevlog
+        """
+        short_url = f'user/{uid}/replies'
+        args = {'page': page, 'user_summary': int(user_summary), 'visitors': int(visitors), 'additional': additional}
+        return self._request_api('get', short_url, args)
+
+    def find_point(self, pid: int) -> tuple[int, int]:
+        """
+        :param pid: PID
+
+        :return:
+        tid, position
+        """
+        short_url = f'post/find'
+        args = {'pid': pid}
+        r = self._request_api('get', short_url, args)
+        return r['thread_id'], r['position']
+
+    def get_thread_reply_page(self, tid: int, page: int = 1, thread_details=0) -> dict:
+        """
+        获取帖子回复
+
+        :param tid: TID
+        :param page: 页码
+        :param thread_details: 主题信息
+        """
+        short_url = 'post/list'
+        args = {'thread_id': tid, 'page': page, 'thread_details': thread_details}
+        return self._request_api('get', short_url, args)
+
+
+class WebAPI(ForumAPI):
     pre = 'https://bbs.uestc.edu.cn/'
     api_pre = f'{pre}_/'
     auto_relog = 3600
     auto_update_auth = 3600
     timeout = 20
 
-    def __init__(self, username: str, password: str, loginField='username', autoLogin: bool = True):
+    def __init__(self, username: str, password: str, loginField='username', autoLogin: bool = True,
+                 pre: str = None, retry_throttled: bool = True):
+        """
+        :param pre: 论坛地址，默认 https://bbs.uestc.edu.cn/ ，可指向本地的 mock_forum.py
+        :param retry_throttled: 被限流时是否像其他错误一样重新登录后重试，
+            为 False 时直接抛出 ThrottledException（AccountPool 换用其他账号）
+        """
         if not username or not password:
             raise ValueError(f'用户名或密码为空。当前用户名: {username}，密码: {password}')
+        if pre:
+            self.pre = pre
+            self.api_pre = f'{pre}_/'
         self.username: str = username
         self.password: str = password
         self.loginField: str = loginField
+        self.retry_throttled: bool = retry_throttled
         self.lastLogin: int = 0
         self.lastUpdateAuth: int = 0
         self.user: dict = {}
         self.session = requests.session()
+        # 累计请求数与响应字节数，供 profiler.TaskStats 统计各阶段
+        self.request_count: int = 0
+        self.response_bytes: int = 0
+        self._count_lock = threading.Lock()
         if autoLogin:
             self.login()
 
@@ -42,11 +146,14 @@ class WebAPI:
             r.raise_for_status()
         except Exception as e:
             print(e)
+            LOGINS.inc(result='error')
             return False
         if '欢迎您回来' in r.text:
+            LOGINS.inc(result='ok')
             self.lastLogin = time.time()
             return True and self.update_authorization()
         else:
+            LOGINS.inc(result='rejected')
             raise HepanException(
                 f'登录失败 username={self.username}, password={self.password}, loginField={self.loginField}\n{r.text}')
 
@@ -79,81 +186,137 @@ class WebAPI:
         try:
             return self._request_once(method, url, args, data)
         except Exception as e:
+            if isinstance(e, ThrottledException) and not self.retry_throttled:
+                raise
             print(e)
+            API_RETRIES.inc(endpoint=self._endpoint_name(url))
             self.login()
             return self._request_once(method, url, args, data)
 
+    def _endpoint_name(self, full_url: str) -> str:
+        """将 url 中的数字替换掉作为指标标签，例如 user/{id}/threads"""
+        return re.sub(r'\d+', '{id}', full_url.removeprefix(self.api_pre))
+
     def _request_once(self, method: str, full_url: str, args: dict, data=None):
-        r = self.session.request(method, full_url, params=args, data=data, timeout=self.timeout)
-        r.raise_for_status()
-        j = r.json()
-        if j['code']:
-            raise HepanException(j['message'])
+        endpoint = self._endpoint_name(full_url)
+        API_IN_FLIGHT.inc()
+        try:
+            with API_SECONDS.time(endpoint=endpoint):
+                r = self.session.request(method, full_url, params=args, data=data, timeout=self.timeout)
+            API_BYTES.inc(len(r.content), endpoint=endpoint)
+            with self._count_lock:
+                self.request_count += 1
+                self.response_bytes += len(r.content)
+            if r.status_code == 429:
+                raise ThrottledException(f'HTTP 429 {full_url}')
+            r.raise_for_status()
+            j = r.json()
+            if j['code']:
+                raise (ThrottledException if '频繁' in j['message'] else HepanException)(j['message'])
+        except Exception:
+            API_REQUESTS.inc(endpoint=endpoint, result='error')
+            raise
+        finally:
+            API_IN_FLIGHT.dec()
+        API_REQUESTS.inc(endpoint=endpoint, result='ok')
         self.user = j['user'] | {'time': int(time.time())}
         return j['data']
 
-    def get_user_info(self, uid: int, user_summary: bool = False, visitors: bool = False) -> dict:
-        """
-        获取用户信息
 
-        :param uid: UID
-        :param user_summary: 是否获取摘要
-        :param visitors: 是否获取访客记录
-        """
-        short_url = f'user/{uid}/profile'
-        args = {'user_summary': int(user_summary), 'visitors': int(visitors)}
-        return self._request_api('get', short_url, args)
+class AccountPool(ForumAPI):
+    """
+    多个爬虫账号组成的池，接口与 WebAPI 相同
 
-    def get_user_threads(self, uid: int, page: int = 1, user_summary: bool = False, visitors: bool = False,
-                         additional='removevlog') -> dict:
-        """
-        获取用户帖子
+    每个账号有自己的 WebAPI（会话、登录与 authorization 刷新）和每秒 rate 个请求的令牌桶；
+    每个请求交给可用账号中进行中请求最少的一个，所有账号都没有令牌时等待。
+    账号被限流时冷却 cooldown 秒（连续被限流时加倍，至多 8 倍），请求换用其他账号重试。
+    """
 
-        :param uid: UID
-        :param page: 页码
-        :param user_summary: 是否获取摘要
-        :param visitors: 是否获取访客记录
-        :param additional:是否隐藏访问记录，可选removevlog
+    def __init__(self, accounts: list[tuple[str, str]], rate: float = 0, cooldown: float = 60,
+                 autoLogin: bool = True, pre: str = None):
         """
-        short_url = f'user/{uid}/threads'
-        args = {'page': page, 'user_summary': int(user_summary), 'visitors': int(visitors), 'additional': additional}
-        return self._request_api('get', short_url, args)
-
-    def get_user_replies(self, uid: int, page: int = 1, user_summary: bool = False, visitors: bool = False,
-                         additional='removevlog') -> dict:
+        :param accounts: [(用户名, 密码), ...]
+        :param rate: 每个账号每秒最多的请求数，0 为不限
         """
-        获取用户回复
+        if not accounts:
+            raise ValueError('账号池为空')
+        self.clients = [WebAPI(username, password, autoLogin=autoLogin, pre=pre, retry_throttled=False)
+                        for username, password in accounts]
+        self.rate = rate
+        self.cooldown = cooldown
+        self._lock = threading.Condition()
+        now = time.monotonic()
+        self._in_flight = [0] * len(self.clients)
+        # 桶容量至少为 1：rate < 1 时也能攒满一个令牌
+        self._capacity = max(float(rate), 1.0)
+        self._tokens = [self._capacity] * len(self.clients)
+        self._token_time = [now] * len(self.clients)
+        self._resume = [0.0] * len(self.clients)  # 冷却结束的时间
+        self._strikes = [0] * len(self.clients)  # 连续被限流的次数
+        ACCOUNT_AVAILABLE.set(len(self.clients))
 
-        :param uid: UID
-        :param page: 页码
-        :param user_summary: 是否获取摘要
-        :param visitors: 是否获取访客记录
-        :param additional:是否隐藏访问记录，可选removevlog
-        """
-        short_url = f'user/{uid}/replies'
-        args = {'page': page, 'user_summary': int(user_summary), 'visitors': int(visitors), 'additional': additional}
-        return self._request_api('get', short_url, args)
+    @property
+    def request_count(self) -> int:
+        return sum(client.request_count for client in self.clients)
 
-    def find_point(self, pid: int) -> tuple[int, int]:
-        """
-        :param pid: PID
+    @property
+    def response_bytes(self) -> int:
+        return sum(client.response_bytes for client in self.clients)
 
-        :return:
-        tid, position
-        """
-        short_url = f'post/find'
-        args = {'pid': pid}
-        r = self._request_api('get', short_url, args)
-        return r['thread_id'], r['position']
+    def _wait_time(self, i: int, now: float) -> float:
+        """账号 i 还需等待的秒数（冷却或令牌），调用时持有锁"""
+        if self._resume[i] > now:
+            return self._resume[i] - now
+        if not self.rate:
+            return 0
+        self._tokens[i] = min(self._capacity, self._tokens[i] + (now - self._token_time[i]) * self.rate)
+        self._token_time[i] = now
+        return 0 if self._tokens[i] >= 1 else (1 - self._tokens[i]) / self.rate
 
-    def get_thread_reply_page(self, tid: int, page: int = 1, thread_details=0) -> dict:
-        """
-        获取帖子回复
+    def _acquire(self) -> int:
+        """选择可用账号中进行中请求最少的一个，返回其下标"""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                waits = [self._wait_time(i, now) for i in range(len(self.clients))]
+                ready = [i for i, wait in enumerate(waits) if wait == 0]
+                if ready:
+                    i = min(ready, key=lambda i: self._in_flight[i])
+                    if self.rate:
+                        self._tokens[i] -= 1
+                    self._in_flight[i] += 1
+                    return i
+                self._lock.wait(min(waits))
 
-        :param tid: TID
-        :param page: 页码
-        :param thread_details: 主题信息
-        """
-        short_url = 'post/list'
-        args = {'thread_id': tid, 'page': page, 'thread_details': thread_details}
-        return self._request_api('get', short_url, args)
+    def _release(self, i: int, throttled: bool = False):
+        with self._lock:
+            self._in_flight[i] -= 1
+            if throttled:
+                self._strikes[i] += 1
+                self._resume[i] = time.monotonic() + self.cooldown * 2 ** min(self._strikes[i] - 1, 3)
+            elif self._resume[i] <= time.monotonic():
+                self._strikes[i] = 0
+            ACCOUNT_AVAILABLE.set(sum(resume <= time.monotonic() for resume in self._resume))
+            # 唤醒等待的请求：进行中请求数与冷却时间已变化
+            self._lock.notify_all()
+
+    def _request_api(self, method: str, short_url: str, args: dict = None, data=None):
+        # 被限流时换用其他账号，全部被限流时等待冷却结束后再试一次
+        for attempt in range(len(self.clients) + 1):
+            i = self._acquire()
+            client = self.clients[i]
+            try:
+                result = client._request_api(method, short_url, args, data)
+            except ThrottledException as e:
+                self._release(i, throttled=True)
+                ACCOUNT_THROTTLED.inc(account=client.username)
+                print(f'[{time.asctime()}] 账号 {client.username} 被限流，冷却: {e}')
+                if attempt == len(self.clients):
+                    raise
+                continue
+            except Exception:
+                self._release(i)
+                raise
+            self._release(i)
+            ACCOUNT_REQUESTS.inc(account=client.username)
+            return result
@@ -4,16 +4,35 @@ import json
 import time
 import shutil
 from pathlib import Path
+import notify
+import util
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python enqueue_uids.py <uid1> [uid2] [uid3] ...", file=sys.stderr)
+    args = sys.argv[1:]
+    # --profile：为这些任务记录 cProfile 与 tracemalloc（见 profiler.py）
+    profile = '--profile' in args
+    # --retry：不重新获取，只重试上次失败的列表页、定位与帖子页，然后重新生成报告
+    retry = '--retry' in args
+    args = [arg for arg in args if arg not in ('--profile', '--retry')]
+    # --years 2023-2025：一次获取这几年的帖子，为每年生成一份报告
+    years = None
+    if '--years' in args:
+        index = args.index('--years')
+        try:
+            years = util.parse_years(args[index + 1])
+        except (IndexError, ValueError) as e:
+            print(f"Invalid --years: {e}", file=sys.stderr)
+            sys.exit(1)
+        del args[index:index + 2]
+    if not args:
+        print("Usage: python add_task.py [--profile] [--retry] [--years 2023-2025] <uid1> [uid2] [uid3] ...",
+              file=sys.stderr)
         sys.exit(1)
 
     # 解析并验证 UID
     uids = []
-    for arg in sys.argv[1:]:
+    for arg in args:
         try:
             uid = int(arg)
             if uid <= 0:
@@ -41,6 +60,12 @@ def main():
             "uid": uid,
             "create_time": current_time
         }
+        if profile:
+            data["profile"] = 1
+        if retry:
+            data["retry"] = 1
+        if years:
+            data["years"] = years
 
         # 写入临时文件（覆盖已存在）
         with open(temp_path, 'w', encoding='utf-8') as f:
@@ -48,6 +73,7 @@ def main():
 
         # 移动到队列目录（覆盖目标）
         shutil.move(str(temp_path), str(queue_path))
+        notify.send('enqueue', uid, mtime=queue_path.stat().st_mtime)
 
         print(f"Enqueued UID {uid} -> {queue_path}")
 
@@ -0,0 +1,174 @@
+"""
+端到端爬取吞吐量基准测试
+
+在进程内启动 mock_forum.py 的模拟论坛，对每个线程数设置：
+  1. 将本目录的 .py 文件复制到临时目录，写入指向模拟论坛的 config.py
+     （不会读取本目录中真实的 config.py，因此不会访问真实论坛）
+  2. 将所有模拟用户加入队列，运行完整的 main.py 流程直到全部 report.json 生成
+  3. 记录 用户/小时、每个帖子的请求数、服务端 p50/p99 延迟、main.py 的峰值内存
+
+用法：
+    python bench_crawl.py --workers 5,10,20 --users 1001:100:1000,1002:20:200 --latency lognormal:-3.5,0.6
+    结果以 JSON 打印，并可用 --output 保存
+"""
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import socket
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import mock_forum
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    """读取 /proc/{pid}/status 的 VmHWM（仅 Linux）"""
+    try:
+        with open(f'/proc/{pid}/status', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def prepare_workdir(workdir: str, forum_url: str, year: int, workers: int, extra_config: dict = None):
+    """复制脚本并写入 config.py，返回工作目录"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in glob.glob(os.path.join(here, '*.py')):
+        if os.path.basename(path) != 'config.py':
+            shutil.copy(path, workdir)
+    config = {
+        'username': 'bench', 'password': 'bench', 'year': year, 'forum_url': forum_url,
+        'max_workers_thread': workers, 'max_workers_reply': workers,
+        'max_workers_position': workers, 'max_workers_posts': workers,
+        'metrics_port': 0, 'notify_port': free_port()
+    } | (extra_config or {})
+    with open(os.path.join(workdir, 'config.py'), 'w', encoding='utf-8') as f:
+        for key, value in config.items():
+            f.write(f'{key} = {value!r}\n')
+
+
+def enqueue(workdir: str, uids: list[int], task: dict = None):
+    """:param task: 附加到每个队列文件中的字段，例如 {"years": [2023, 2025]}"""
+    queue_dir = os.path.join(workdir, 'data', 'queue')
+    os.makedirs(queue_dir, exist_ok=True)
+    for i, uid in enumerate(uids):
+        path = os.path.join(queue_dir, str(uid))
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'uid': uid, 'create_time': int(time.time())} | (task or {}), f, separators=(',', ':'))
+        os.utime(path, (i + 1, i + 1))
+
+
+def run_pipeline(workdir: str, uids: list[int], timeout: float, env: dict = None, task: dict = None) -> dict:
+    """
+    在 workdir 中运行 main.py，直到所有 uid 的 report.json 生成或超时
+
+    :return:
+        {"seconds": 耗时, "peak_rss_mb": 峰值内存, "finished": 完成的用户数}
+    """
+    enqueue(workdir, uids, task)
+    reports = [os.path.join(workdir, 'data', 'user', str(uid), 'report.json') for uid in uids]
+    with open(os.path.join(workdir, 'main.log'), 'w', encoding='utf-8') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, 'main.py'], cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                                   env=os.environ | (env or {}))
+        peak = None
+        try:
+            while time.perf_counter() - start < timeout:
+                peak = peak_rss_mb(process.pid) or peak
+                if all(os.path.exists(p) for p in reports) or process.poll() is not None:
+                    break
+                time.sleep(0.2)
+            seconds = time.perf_counter() - start
+        finally:
+            process.terminate()
+            process.wait()
+    return {
+        'seconds': round(seconds, 2), 'peak_rss_mb': peak,
+        'finished': sum(os.path.exists(p) for p in reports)
+    }
+
+
+def count_posts(workdir: str, uids: list[int]) -> int:
+    total = 0
+    for uid in uids:
+        path = os.path.join(workdir, 'data', 'user', str(uid), 'post.db')
+        if os.path.exists(path):
+            conn = sqlite3.connect(path)
+            total += conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+            conn.close()
+    # post_store = 'shared' 时帖子在共享分片中
+    for path in glob.glob(os.path.join(workdir, 'data', 'store', 'posts_*.db')):
+        conn = sqlite3.connect(path)
+        total += conn.execute(f'SELECT COUNT(*) FROM store_posts WHERE uid IN ({",".join("?" * len(uids))})',
+                              uids).fetchone()[0]
+        conn.close()
+    return total
+
+
+def bench(forum: mock_forum.MockForum, forum_url: str, workers: int, timeout: float, keep: bool = False) -> dict:
+    uids = list(forum.user_specs)
+    workdir = tempfile.mkdtemp(prefix=f'qshp_bench_{workers}_')
+    try:
+        prepare_workdir(workdir, forum_url, forum.year, workers)
+        forum.reset()
+        run = run_pipeline(workdir, uids, timeout)
+        stats = forum.stats()
+        posts = count_posts(workdir, uids)
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'workers': workers,
+        'users': len(uids),
+        'finished': run['finished'],
+        'seconds': run['seconds'],
+        'users_per_hour': round(run['finished'] / run['seconds'] * 3600, 1) if run['seconds'] else None,
+        'posts': posts,
+        'requests': stats['requests'],
+        'requests_per_post': round(stats['requests'] / posts, 3) if posts else None,
+        'by_endpoint': stats['by_endpoint'],
+        'errors': stats['errors'],
+        'throttled': stats['throttled'],
+        'p50': round(stats['p50'], 4),
+        'p99': round(stats['p99'], 4),
+        'peak_rss_mb': run['peak_rss_mb'],
+        'workdir': workdir if keep else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='端到端爬取吞吐量基准测试')
+    parser.add_argument('--workers', default='5,10', help='要测试的线程数设置，逗号分隔')
+    parser.add_argument('--timeout', type=float, default=1800, help='单次运行的超时秒数')
+    parser.add_argument('--output', help='将结果保存为 JSON 文件')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录以便检查')
+    mock_forum.add_arguments(parser)
+    args = parser.parse_args()
+
+    forum = mock_forum.build_forum(args)
+    server = mock_forum.serve(forum)
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    results = []
+    for n in (int(x) for x in args.workers.split(',')):
+        print(f'[{time.asctime()}] 测试 workers={n}', file=sys.stderr)
+        results.append(bench(forum, url, n, args.timeout, args.keep))
+        print(json.dumps(results[-1], ensure_ascii=False), file=sys.stderr)
+    server.shutdown()
+    output = {'args': vars(args), 'results': results}
+    print(json.dumps(output, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
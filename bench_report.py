@@ -0,0 +1,102 @@
+"""
+报告生成基准测试
+
+用 synth_db.py 生成不同规模的 post.db，对每个规模在独立的子进程中运行 generate_report 的各部分，
+记录每部分的耗时、JSON 序列化与压缩耗时、输出大小以及子进程的峰值内存
+
+用法：
+    python bench_report.py --sizes 1000,10000,100000,1000000 --repeat 3 --output bench_report.json
+    生成的数据库缓存在 --db-dir 中，相同规模与种子的数据库不会重复生成
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import bench_crawl
+import synth_db
+
+UID = 1000001
+
+
+def run_single(db_path: str, year: int, repeat: int) -> dict:
+    """在子进程中执行：对一个数据库生成 repeat 次报告"""
+    import sqlite3
+    import util
+    import generate_report
+    runs = []
+    sizes = {}
+    for _ in range(repeat):
+        timings = {}
+        start = time.perf_counter()
+        conn = sqlite3.connect(db_path)
+        report = generate_report.build_report(conn, UID, year, timings)
+        conn.close()
+        t = time.perf_counter()
+        report_bytes, min_bytes, parts = generate_report.serialize_report(report)
+        timings['serialize'] = time.perf_counter() - t
+        t = time.perf_counter()
+        sizes = {'report.json': len(report_bytes)} | util.write_precompressed('report.min.json', min_bytes)
+        for part, part_bytes in parts.items():
+            sizes |= util.write_precompressed(f'report.{part}.min.json', part_bytes)
+        timings['compress'] = time.perf_counter() - t
+        timings['total'] = time.perf_counter() - start
+        runs.append({k: round(v, 4) for k, v in timings.items()})
+    return {'runs': runs, 'sizes': sizes, 'peak_rss_mb': bench_crawl.peak_rss_mb(os.getpid())}
+
+
+def ensure_db(db_dir: str, posts: int, year: int, seed: int) -> str:
+    path = os.path.join(db_dir, f'post_{posts}_{year}_{seed}.db')
+    if not os.path.exists(path):
+        print(f'[{time.asctime()}] 生成 {posts} 条帖子的数据库', file=sys.stderr)
+        synth_db.generate(path + '.tmp', UID, posts, year, seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def bench(db_path: str, posts: int, year: int, repeat: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f'qshp_bench_report_{posts}_')
+    try:
+        # 在临时目录中运行，使 generate_report 读取的是合成的 config.py
+        bench_crawl.prepare_workdir(workdir, None, year, 1)
+        r = subprocess.run([sys.executable, 'bench_report.py', '--single', os.path.abspath(db_path),
+                            '--year', str(year), '--repeat', str(repeat)],
+                           cwd=workdir, capture_output=True, text=True, check=True)
+        result = json.loads(r.stdout)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    runs = result.pop('runs')
+    best = {key: min(run[key] for run in runs) for key in runs[0]}
+    return {'posts': posts, 'db_bytes': os.path.getsize(db_path), 'best': best, 'runs': runs} | result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='报告生成基准测试')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='帖子数，逗号分隔')
+    parser.add_argument('--year', type=int, default=2025)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='每个规模生成报告的次数，取最小值')
+    parser.add_argument('--db-dir', default='data/bench_report', help='合成数据库的缓存目录')
+    parser.add_argument('--output', help='将结果保存为 JSON 文件')
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.year, args.repeat)))
+        exit()
+
+    os.makedirs(args.db_dir, exist_ok=True)
+    results = []
+    for n in (int(x) for x in args.sizes.split(',')):
+        path = ensure_db(args.db_dir, n, args.year, args.seed)
+        print(f'[{time.asctime()}] 测试 {n} 条帖子', file=sys.stderr)
+        results.append(bench(path, n, args.year, args.repeat))
+        print(json.dumps(results[-1]['best'] | {'peak_rss_mb': results[-1]['peak_rss_mb']}), file=sys.stderr)
+    output = {'args': vars(args), 'results': results}
+    print(json.dumps(output, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
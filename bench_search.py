@@ -0,0 +1,155 @@
+"""
+帖子搜索基准测试
+
+对 synth_db.py 生成的不同规模的 post.db：
+  - 建立全文索引 posts_fts 的耗时与索引占用的空间
+  - insert_posts 追加帖子时同步索引的额外耗时
+  - search.search 的耗时（罕见词、常见词、多词、两个字符的 LIKE 词），并与不使用索引的 LIKE 全表匹配比较
+
+用法：
+    python bench_search.py --sizes 1000,10000,100000 --queries 50 --output bench_search.json
+    数据库与 bench_report.py 共用 --db-dir 中的缓存，测试在副本上进行
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import db
+import search
+import bench_report
+
+UID = bench_report.UID
+
+
+def percentiles(values: list[float]) -> dict:
+    values = sorted(values)
+    return {
+        'p50_ms': round(values[len(values) // 2] * 1000, 2),
+        'p95_ms': round(values[min(int(len(values) * 0.95), len(values) - 1)] * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2)
+    }
+
+
+def sample_queries(conn: sqlite3.Connection, count: int, rng: random.Random) -> dict[str, list[str]]:
+    """从帖子正文中抽取各类查询"""
+    pids = [pid for pid, in conn.execute('SELECT pid FROM posts')]
+    rare, common, multi, short = [], [], [], []
+    for pid in rng.sample(pids, min(count, len(pids))):
+        message = conn.execute('SELECT message FROM posts WHERE pid = ?', (pid,)).fetchone()[0] or ''
+        text = ''.join(message.split())
+        if len(text) < 6:
+            continue
+        start = rng.randrange(len(text) - 5)
+        rare.append(str(pid))
+        common.append(text[start:start + 3])
+        multi.append(f'{text[start:start + 4]} {str(pid)[-4:]}')
+        short.append(text[start:start + 2])
+    return {'rare': rare, 'common': common, 'multi': multi, 'short': short}
+
+
+def timed_search(conn: sqlite3.Connection, queries: list[str]) -> tuple[dict, float]:
+    """返回耗时分布与平均命中数"""
+    seconds, hits = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        hits += search.search(conn, query)['total']
+        seconds.append(time.perf_counter() - start)
+    return percentiles(seconds), round(hits / len(queries), 1)
+
+
+def timed_like(conn: sqlite3.Connection, queries: list[str]) -> dict:
+    """不使用索引：LIKE 全表匹配第一页"""
+    seconds = []
+    for query in queries:
+        pattern = f'%{query}%'
+        start = time.perf_counter()
+        conn.execute('SELECT COUNT(*) FROM posts WHERE subject LIKE ? OR message LIKE ?', (pattern, pattern)).fetchone()
+        conn.execute('SELECT pid, message FROM posts WHERE subject LIKE ? OR message LIKE ? '
+                     'ORDER BY dateline DESC LIMIT 20', (pattern, pattern)).fetchall()
+        seconds.append(time.perf_counter() - start)
+    return percentiles(seconds)
+
+
+def timed_insert(path: str, posts: list[dict]) -> float:
+    conn = sqlite3.connect(path)
+    start = time.perf_counter()
+    db.insert_posts(conn, posts)
+    seconds = time.perf_counter() - start
+    conn.close()
+    return seconds
+
+
+def bench(source: str, posts: int, queries: int, seed: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f'qshp_bench_search_{posts}_')
+    try:
+        path = os.path.join(workdir, 'post.db')
+        shutil.copy(source, path)
+        conn = sqlite3.connect(path)
+        conn.execute('DROP TABLE IF EXISTS posts_fts')
+        conn.execute('VACUUM')
+        bytes_without = os.path.getsize(path)
+        start = time.perf_counter()
+        db.init_fts(conn)
+        build_seconds = time.perf_counter() - start
+        conn.execute('VACUUM')
+        bytes_with = os.path.getsize(path)
+
+        rng = random.Random(seed)
+        sampled = sample_queries(conn, queries, rng)
+        result = {
+            'posts': posts,
+            'db_bytes': bytes_without,
+            'fts_bytes': bytes_with - bytes_without,
+            'build_s': round(build_seconds, 3),
+            'search': {},
+            'like': timed_like(conn, sampled['common'])
+        }
+        for kind, kind_queries in sampled.items():
+            latency, hits = timed_search(conn, kind_queries)
+            result['search'][kind] = latency | {'avg_hits': hits}
+
+        # 追加 5000 条帖子（改写已有帖子的 pid）：有索引与无索引各一次
+        rows = conn.execute('SELECT tid, pid, fid, subject, message, dateline FROM posts LIMIT 5000').fetchall()
+        conn.close()
+        offset = 10 ** 9
+        new_posts = [{'thread_id': tid, 'post_id': pid + offset, 'forum_id': fid, 'subject': subject,
+                      'message': message, 'dateline': dateline, 'position': 2}
+                     for tid, pid, fid, subject, message, dateline in rows]
+        plain_path = os.path.join(workdir, 'plain.db')
+        shutil.copy(path, plain_path)
+        plain = sqlite3.connect(plain_path)
+        plain.execute('DROP TABLE posts_fts')
+        plain.close()
+        result['insert_5000_s'] = {'with_fts': round(timed_insert(path, new_posts), 3),
+                                   'without_fts': round(timed_insert(plain_path, new_posts), 3)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='帖子搜索基准测试')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='帖子数，逗号分隔')
+    parser.add_argument('--year', type=int, default=2025)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=50, help='每类查询的个数')
+    parser.add_argument('--db-dir', default='data/bench_report', help='合成数据库的缓存目录')
+    parser.add_argument('--output', help='将结果保存为 JSON 文件')
+    args = parser.parse_args()
+
+    os.makedirs(args.db_dir, exist_ok=True)
+    results = []
+    for n in (int(x) for x in args.sizes.split(',')):
+        path = bench_report.ensure_db(args.db_dir, n, args.year, args.seed)
+        print(f'[{time.asctime()}] 测试 {n} 条帖子', file=sys.stderr)
+        results.append(bench(path, n, args.queries, args.seed))
+    output = {'args': vars(args), 'results': results}
+    print(json.dumps(output, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
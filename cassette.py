@@ -0,0 +1,238 @@
+"""
+WebAPI / MobcentAPI 流量的录制与回放
+
+录制：将客户端的 session 换成 RecordingSession，每个请求与响应（含耗时）写入 gzip 压缩的 JSON Lines 文件；
+      请求中的密码与登录响应中的 authorization、token、secret 不写入文件
+回放：换成 ReplaySession，从文件中取出对应的响应，不访问网络，可按录制时的速度或加速回放
+
+用法：
+    recorder = cassette.install(api, 'data/user/287813/cassette.jsonl.gz', 'record')
+    ...
+    recorder.close()  # 恢复原来的 session
+
+main.py 中由环境变量 QSHP_CASSETTE=record|replay 启用，回放速度由 QSHP_REPLAY_SPEED 控制（0 为不等待）
+"""
+import gzip
+import json
+import time
+import base64
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+import requests
+
+
+# 不写入录制文件的字段（登录请求中的密码）
+REDACTED_KEYS = ('password',)
+
+
+# 登录与 authorization 刷新的响应中的凭据，录制时替换为 PLACEHOLDER；回放时客户端把占位值当作凭据使用，不影响匹配
+CREDENTIAL_KEYS = ('authorization', 'token', 'secret')
+PLACEHOLDER = 'cassette-placeholder'
+
+
+def _redact(d):
+    if isinstance(d, dict):
+        return {k: '***' if k in REDACTED_KEYS else v for k, v in d.items()}
+    return d
+
+
+def _is_auth_request(url: str, params) -> bool:
+    """WebAPI 的 auth/adoptLegacyAuth 与 Mobcent 的 user/login"""
+    return (urlsplit(url).path.endswith('/auth/adoptLegacyAuth')
+            or isinstance(params, dict) and params.get('r') == 'user/login')
+
+
+def _scrub(value):
+    if isinstance(value, dict):
+        return {k: PLACEHOLDER if k in CREDENTIAL_KEYS else _scrub(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_scrub(v) for v in value]
+    return value
+
+
+def _response_body(url: str, params, r) -> tuple[bytes, str | None]:
+    """录制的响应体与编码，登录响应中的凭据替换为占位值"""
+    if not _is_auth_request(url, params):
+        return r.content, r.encoding
+    try:
+        body = json.loads(r.content)
+    except ValueError:
+        return r.content, r.encoding
+    return json.dumps(_scrub(body), ensure_ascii=False).encode('utf-8'), 'utf-8'
+
+
+def _request_key(method: str, url: str, params, data, exact: bool) -> str:
+    """
+    请求的匹配键，只取路径而不含域名，使录制结果可以回放到任意地址
+
+    exact 为 False 时不含请求体，用于匹配带有时间戳等易变内容的请求（如 Mobcent 的 pmlist）
+    """
+    parts = urlsplit(url)
+    params, data = _redact(params), _redact(data)
+    key = [method.upper(), parts.path, parts.query, json.dumps(sorted((params or {}).items()), ensure_ascii=False)]
+    if exact:
+        key.append(json.dumps(sorted(data.items()) if isinstance(data, dict) else data, ensure_ascii=False))
+    return '\n'.join(key)
+
+
+class _SessionProxy:
+    """转发未覆盖的属性（headers、params、cookies 等）到原 session"""
+    _own = ('_session', 'cassette')
+
+    def __init__(self, session, cassette):
+        object.__setattr__(self, '_session', session)
+        object.__setattr__(self, 'cassette', cassette)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._session, name, value)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+
+class RecordingSession(_SessionProxy):
+    def request(self, method, url, params=None, data=None, **kwargs):
+        start = time.perf_counter()
+        r = self._session.request(method, url, params=params, data=data, **kwargs)
+        self.cassette.record(method, url, params, data, r, time.perf_counter() - start)
+        return r
+
+
+class ReplaySession(_SessionProxy):
+    def request(self, method, url, params=None, data=None, **kwargs):
+        return self.cassette.replay(method, url, params, data)
+
+
+class ReplayedResponse:
+    """与 requests.Response 兼容的最小实现"""
+
+    def __init__(self, entry: dict, url: str):
+        self.status_code = entry['status']
+        self.headers = entry['headers']
+        self.content = base64.b64decode(entry['body'])
+        self.encoding = entry.get('encoding') or 'utf-8'
+        self.url = url
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error (replayed) for url: {self.url}', response=self)
+
+
+class Cassette:
+    """
+    一个 gzip 压缩的 JSON Lines 文件，第一行为元信息，之后每行一个请求：
+        {"method", "url", "params", "data", "status", "headers", "encoding", "body"(base64), "elapsed", "offset"}
+    """
+
+    def __init__(self, path: str, mode: str, meta: dict = None, speed: float = 1.0):
+        """
+        :param path: 文件路径
+        :param mode: record 或 replay
+        :param meta: 录制时写入的元信息，例如 uid、year
+        :param speed: 回放速度倍数，1 为按录制时的耗时等待，0 为不等待
+        """
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        if mode == 'record':
+            self.meta = (meta or {}) | {'created': int(time.time())}
+            self.file = gzip.open(path, 'wt', encoding='utf-8')
+            self.file.write(json.dumps({'meta': self.meta}, ensure_ascii=False) + '\n')
+        elif mode == 'replay':
+            self.file = None
+            self.entries = []
+            self.exact: dict[str, deque] = {}
+            self.loose: dict[str, deque] = {}
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                self.meta = json.loads(f.readline()).get('meta', {})
+                for line in f:
+                    entry = json.loads(line)
+                    index = len(self.entries)
+                    self.entries.append(entry)
+                    args = (entry['method'], entry['url'], entry['params'], entry['data'])
+                    self.exact.setdefault(_request_key(*args, exact=True), deque()).append(index)
+                    self.loose.setdefault(_request_key(*args, exact=False), deque()).append(index)
+            self.used = [False] * len(self.entries)
+        else:
+            raise ValueError(f'未知的模式: {mode}')
+
+    def record(self, method, url, params, data, r, elapsed: float):
+        body, encoding = _response_body(url, params, r)
+        entry = {
+            'method': method.upper(), 'url': url, 'params': _redact(params), 'data': _redact(data),
+            'status': r.status_code, 'headers': {'Content-Type': r.headers.get('Content-Type', '')},
+            'encoding': encoding, 'body': base64.b64encode(body).decode(),
+            'elapsed': round(elapsed, 4), 'offset': round(time.perf_counter() - self.start, 4)
+        }
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+
+    def _take(self, index: dict, key: str) -> int | None:
+        queue = index.get(key)
+        while queue:
+            i = queue.popleft()
+            if not self.used[i]:
+                self.used[i] = True
+                return i
+        return None
+
+    def replay(self, method, url, params, data) -> ReplayedResponse:
+        with self.lock:
+            i = self._take(self.exact, _request_key(method, url, params, data, exact=True))
+            if i is None:
+                i = self._take(self.loose, _request_key(method, url, params, data, exact=False))
+        if i is None:
+            raise requests.ConnectionError(f'请求不在录制文件中: {method} {url} {params}')
+        entry = self.entries[i]
+        if self.speed > 0:
+            time.sleep(entry['elapsed'] / self.speed)
+        return ReplayedResponse(entry, url)
+
+    def close(self):
+        if self.file is not None:
+            with self.lock:
+                self.file.close()
+                self.file = None
+
+
+class Installed:
+    """install 的返回值，close 时恢复原 session 并关闭文件"""
+
+    def __init__(self, client, cassette: Cassette):
+        # 账号池（WebAPI.AccountPool）的各账号共用一个 cassette
+        self.clients = getattr(client, 'clients', [client])
+        self.cassette = cassette
+        self.originals = [c.session for c in self.clients]
+        proxy = RecordingSession if cassette.mode == 'record' else ReplaySession
+        for c in self.clients:
+            c.session = proxy(c.session, cassette)
+
+    def close(self):
+        for c, original in zip(self.clients, self.originals):
+            c.session = original
+        self.cassette.close()
+
+
+def install(client, path: str, mode: str, meta: dict = None, speed: float = 1.0) -> Installed:
+    """为带有 session 属性的客户端（WebAPI、MobcentAPI）或 WebAPI.AccountPool 启用录制或回放"""
+    return Installed(client, Cassette(path, mode, meta, speed))
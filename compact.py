@@ -0,0 +1,203 @@
+"""
+压缩已完成用户的 post.db：VACUUM 后打包为 post.db.gz 并删除 post.db
+
+    python compact.py [--min-age 7] [--interval 3600]
+    python compact.py --measure 20
+
+报告生成后 post.db 很少再被读取，只有重新生成报告或增量重新获取时才会用到。
+db.get_user_conn 打开用户的库时若只有 post.db.gz，会先解压还原（见 db.restore_archive），调用者无需区分。
+
+只归档同时满足以下条件的用户：
+  - 已有 report.json，且不在 data/queue、data/lease 中（没有排队或正在远程获取的任务）
+  - 没有 main.py 正在处理：process_task 在整个任务期间持有用户锁（见 util.user_lock），归档时不等待地获取同一把锁，
+    获取不到则跳过；归档期间开始的任务会等待归档完成，之后由 db.get_user_conn 还原
+  - post.db 至少 min_age 天未修改（避免与刚开始的重新获取竞争，打包后若 post.db 被修改则放弃本次归档）
+  - VACUUM 后不大于 archive_max_mb：还原时间与库的大小成正比，更大的库只做 VACUUM，保证还原耗时有上限
+
+每次归档的字节数与耗时记录在 task.json 的 archive 中。--measure 对已有的归档抽样解压（不修改归档），输出还原耗时。
+共享存储（post_store = "shared"）的数据在分片中，不适用本工具。
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import config
+import db
+import util
+
+USER_DIR = 'data/user'
+MIN_AGE_DAYS = getattr(config, 'archive_min_age_days', 7)
+MAX_MB = getattr(config, 'archive_max_mb', 256)
+LEVEL = getattr(config, 'archive_level', 6)
+
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def is_finished(uid: int) -> bool:
+    """已生成报告，且没有排队或租出的任务"""
+    return (os.path.exists(f'{USER_DIR}/{uid}/report.json')
+            and not os.path.exists(f'data/queue/{uid}')
+            and not os.path.exists(f'data/lease/{uid}'))
+
+
+def vacuum(path: str) -> int:
+    """有空闲页时执行 VACUUM，返回之后的字节数"""
+    conn = sqlite3.connect(path)
+    try:
+        if conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+            conn.execute('VACUUM')
+    finally:
+        conn.close()
+    return file_size(path)
+
+
+def record(uid: int, archive: dict):
+    """在 task.json 中记录归档信息"""
+    path = f'{USER_DIR}/{uid}/task.json'
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            task = json.load(f)
+    except (OSError, ValueError):
+        return
+    task['archive'] = archive
+    util.save_task_metadata(uid, task)
+
+
+def compact_user(uid: int, min_age_days: float = MIN_AGE_DAYS,
+                 max_mb: float = MAX_MB) -> tuple[int, int, bool] | None:
+    """
+    压缩一个用户的 post.db
+
+    :return: (压缩前字节数, 压缩后字节数, 是否已归档)，不满足条件或放弃时为 None
+    """
+    path = f'{USER_DIR}/{uid}/post.db'
+    if not os.path.exists(path) or not is_finished(uid):
+        return None
+    if time.time() - os.stat(path).st_mtime < min_age_days * 86400:
+        return None
+    with util.user_lock(uid, blocking=False) as locked:
+        if not locked:
+            return None
+        return _compact_locked(uid, path, max_mb)
+
+
+def _compact_locked(uid: int, path: str, max_mb: float) -> tuple[int, int, bool] | None:
+    """compact_user 持有用户锁时执行"""
+    archive_path = f'{path}.gz'
+    # 获取锁之前可能刚有任务完成
+    if not os.path.exists(path) or not is_finished(uid):
+        return None
+    start = time.perf_counter()
+    before = file_size(path)
+    vacuumed = vacuum(path)
+    if vacuumed > max_mb * 1024 * 1024:
+        return before, vacuumed, False
+    mtime = os.stat(path).st_mtime
+    temp_path = f'{archive_path}.{os.getpid()}.tmp'
+    try:
+        with open(path, 'rb') as src, gzip.open(temp_path, 'wb', compresslevel=LEVEL) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        # 打包期间 post.db 被修改（重新获取已开始）时放弃
+        if not is_finished(uid) or os.stat(path).st_mtime != mtime:
+            os.remove(temp_path)
+            return None
+        os.replace(temp_path, archive_path)
+        os.remove(path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    after = file_size(archive_path)
+    record(uid, {
+        'time': int(time.time()),
+        'db_bytes': before,
+        'vacuum_bytes': vacuumed,
+        'archive_bytes': after,
+        'seconds': round(time.perf_counter() - start, 3)
+    })
+    return before, after, True
+
+
+def compact_all(min_age_days: float = MIN_AGE_DAYS, max_mb: float = MAX_MB) -> tuple[int, int]:
+    """压缩所有满足条件的用户，返回 (处理的用户数, 释放的字节数)"""
+    count = reclaimed = 0
+    if not os.path.isdir(USER_DIR):
+        return count, reclaimed
+    for entry in os.scandir(USER_DIR):
+        if not entry.name.isdigit():
+            continue
+        uid = int(entry.name)
+        try:
+            result = compact_user(uid, min_age_days, max_mb)
+        except (OSError, sqlite3.Error) as e:
+            print(f'[{time.asctime()}] 压缩 {uid} 失败: {e}')
+            continue
+        if result is None:
+            continue
+        before, after, archived = result
+        if archived or after < before:
+            count += 1
+            reclaimed += before - after
+            action = '已归档' if archived else '已 VACUUM'
+            print(f'[{time.asctime()}] {action} {uid}: {before / 1048576:.1f}MB -> {after / 1048576:.1f}MB')
+    print(f'[{time.asctime()}] 压缩完成：{count} 个用户，释放 {reclaimed / 1048576:.1f}MB')
+    return count, reclaimed
+
+
+def measure(sample: int) -> dict:
+    """抽样解压已有的归档到临时目录（不修改归档），统计还原耗时"""
+    archives = [f'{e.path}/post.db.gz' for e in os.scandir(USER_DIR)
+                if e.name.isdigit() and os.path.exists(f'{e.path}/post.db.gz')] if os.path.isdir(USER_DIR) else []
+    archives = random.sample(archives, min(sample, len(archives)))
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for archive in archives:
+            temp_path = os.path.join(temp_dir, 'post.db')
+            start = time.perf_counter()
+            with gzip.open(archive, 'rb') as src, open(temp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            results.append((time.perf_counter() - start, file_size(temp_path), file_size(archive)))
+            os.remove(temp_path)
+    if not results:
+        return {'count': 0}
+    seconds = sorted(r[0] for r in results)
+    db_bytes = sum(r[1] for r in results)
+    return {
+        'count': len(results),
+        'db_mb': round(db_bytes / 1048576, 1),
+        'archive_mb': round(sum(r[2] for r in results) / 1048576, 1),
+        'p50_seconds': round(seconds[len(seconds) // 2], 3),
+        'max_seconds': round(seconds[-1], 3),
+        'mb_per_second': round(db_bytes / 1048576 / sum(seconds), 1) if sum(seconds) else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VACUUM 并归档已完成用户的 post.db')
+    parser.add_argument('--min-age', type=float, default=MIN_AGE_DAYS, help='post.db 至少多少天未修改')
+    parser.add_argument('--max-mb', type=float, default=MAX_MB, help='VACUUM 后大于此值的库不归档')
+    parser.add_argument('--interval', type=float, help='每隔多少秒重复一次，不指定时只运行一次')
+    parser.add_argument('--measure', type=int, metavar='N', help='抽样 N 个归档测量还原耗时')
+    args = parser.parse_args()
+
+    if db.STORE != 'user':
+        sys.exit('共享存储的数据在分片中，无需归档')
+    if args.measure:
+        print(json.dumps(measure(args.measure), ensure_ascii=False, indent=2))
+        sys.exit()
+    while True:
+        compact_all(args.min_age, args.max_mb)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
@@ -1,15 +1,233 @@
 import sqlite3
 import os
+import gzip
 import json
+import time
+import shutil
+import threading
+import config
+
+# 存储后端：user 为每个用户一个 data/user/{uid}/post.db；shared 为按 uid 分片的共享库 data/store/posts_{n}.db
+STORE = getattr(config, 'post_store', 'user')
+STORE_SHARDS = getattr(config, 'post_store_shards', 4)
+STORE_DIR = 'data/store'
+# 每个事务写入的行数，共享库中较短的写事务可让多个 main.py 实例交替写入同一分片
+INSERT_BATCH_SIZE = 5000
+
+POST_COLUMNS = ('tid', 'pid', 'fid', 'reply_pid', 'reply_user', 'position', 'subject', 'message', 'dateline',
+                'views', 'replies', 'support', 'oppose', 'favorite')
+FAILURE_COLUMNS = ('kind', 'key', 'detail', 'error', 'attempts', 'updated')
+
+
+class StoreConnection(sqlite3.Connection):
+    """
+    共享分片中某个用户的连接
+
+    posts、user_info、failures 是只包含该用户数据的临时视图（临时对象优先于主库中的同名对象），
+    写入由 INSTEAD OF 触发器转写到带 uid 的 store_* 表，因此本模块其余函数与 generate_report.py 的 SQL 无需区分后端。
+    """
+    uid: int
 
 
 def get_conn(uid: int) -> sqlite3.Connection:
+    if STORE == 'shared':
+        return get_store_conn(uid)
+    return get_user_conn(uid)
+
+
+def get_user_conn(uid: int) -> sqlite3.Connection:
+    """打开用户自己的 post.db，已被 compact.py 归档时先解压"""
     os.makedirs(f'data/user/{uid}', exist_ok=True)
+    restore_archive(uid)
     return sqlite3.connect(f'data/user/{uid}/post.db')
 
 
+def get_readonly_conn(uid: int) -> sqlite3.Connection | None:
+    """
+    只读打开用户的帖子（web.py 的搜索使用）：不还原归档、不建表、不建索引
+
+    :return: post.db 或共享分片不存在（尚未获取或已被 compact.py 归档）时为 None
+    """
+    if STORE == 'shared':
+        return get_readonly_store_conn(uid)
+    path = f'data/user/{uid}/post.db'
+    if not os.path.exists(path):
+        return None
+    return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+
+def get_readonly_store_conn(uid: int) -> StoreConnection | None:
+    """
+    只读打开 uid 所在的共享分片，只创建 posts 临时视图（临时库不受 mode=ro 限制），不建目录、不执行 init_store
+
+    :return: 分片不存在时为 None
+    """
+    path = shard_path(uid)
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=60, factory=StoreConnection)
+    conn.uid = uid = int(uid)
+    conn.execute(f'CREATE TEMP VIEW posts AS SELECT {", ".join(POST_COLUMNS)} FROM main.store_posts WHERE uid = {uid}')
+    return conn
+
+
+def restore_archive(uid: int) -> float | None:
+    """
+    将 compact.py 归档的 post.db.gz 解压为 post.db 并删除归档
+
+    解压到临时文件后用 os.link 放到 post.db：多个进程同时还原时只有第一个生效，
+    不会覆盖先还原的进程已经写入的数据。
+
+    :return: 解压耗时（秒），post.db 已存在或没有归档时为 None
+    """
+    path = f'data/user/{uid}/post.db'
+    archive = f'{path}.gz'
+    if os.path.exists(path) or not os.path.exists(archive):
+        return None
+    start = time.perf_counter()
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.restore'
+    try:
+        with gzip.open(archive, 'rb') as src, open(temp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.link(temp_path, path)
+    except FileNotFoundError:
+        # 其他进程已还原并删除了归档
+        if not os.path.exists(path):
+            raise
+    except FileExistsError:
+        pass
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    try:
+        os.remove(archive)
+    except FileNotFoundError:
+        pass
+    seconds = time.perf_counter() - start
+    print(f'[{time.asctime()}] 已还原 {uid} 的归档 post.db，耗时 {seconds:.2f}s')
+    return seconds
+
+
+def shard_path(uid: int, shards: int = None) -> str:
+    return f'{STORE_DIR}/posts_{uid % (shards or STORE_SHARDS)}.db'
+
+
+def get_store_conn(uid: int, shards: int = None) -> StoreConnection:
+    """
+    打开 uid 所在的共享分片
+
+    分片使用 WAL，读取（web.py、generate_report.py）不阻塞写入；每个分片同一时刻只有一个写事务，
+    其他实例的写入在 busy timeout 内排队。用户目录仍会创建，用于存放 task.json 与报告。
+    """
+    os.makedirs(f'data/user/{uid}', exist_ok=True)
+    os.makedirs(STORE_DIR, exist_ok=True)
+    conn = sqlite3.connect(shard_path(uid, shards), timeout=60, factory=StoreConnection)
+    conn.uid = uid
+    init_store(conn)
+    attach_user(conn, uid)
+    return conn
+
+
+def init_store(conn: sqlite3.Connection):
+    """创建共享分片的表：uid 是各表主键的第一列，帖子表按 (uid, pid) 聚簇存储，查询一个用户只读取该用户的行"""
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA journal_mode = WAL')
+    cursor.execute('PRAGMA synchronous = NORMAL')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS store_user_info (
+            uid INTEGER PRIMARY KEY,
+            info TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS store_posts (
+            uid INTEGER NOT NULL,
+            tid INTEGER NOT NULL,
+            pid INTEGER NOT NULL,
+            fid INTEGER NOT NULL,
+            reply_pid INTEGER DEFAULT 0,
+            reply_user TEXT,
+            position INTEGER NOT NULL,
+            subject TEXT,
+            message TEXT,
+            dateline INTEGER NOT NULL,
+            views INTEGER DEFAULT 0,
+            replies INTEGER DEFAULT 0,
+            support INTEGER DEFAULT 0,
+            oppose INTEGER DEFAULT 0,
+            favorite INTEGER DEFAULT 0,
+            PRIMARY KEY (uid, pid)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS store_failures (
+            uid INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            detail TEXT,
+            error TEXT,
+            attempts INTEGER DEFAULT 1,
+            updated INTEGER,
+            PRIMARY KEY (uid, kind, key)
+        )
+    ''')
+    conn.commit()
+
+
+def _posts_view_sql(uid: int, condition: str = '') -> str:
+    """共享分片中 uid 的 posts 临时视图及其写入触发器"""
+    post_columns = ', '.join(POST_COLUMNS)
+    post_values = ', '.join(f'NEW.{c}' for c in POST_COLUMNS)
+    return f'''
+        CREATE TEMP VIEW IF NOT EXISTS posts AS
+            SELECT {post_columns} FROM main.store_posts WHERE uid = {uid}{condition};
+        CREATE TEMP TRIGGER IF NOT EXISTS posts_insert INSTEAD OF INSERT ON posts BEGIN
+            INSERT OR REPLACE INTO store_posts (uid, {post_columns}) VALUES ({uid}, {post_values});
+        END;
+    '''
+
+
+def attach_user(conn: sqlite3.Connection, uid: int):
+    """在共享分片的连接上创建 uid 的临时视图与触发器"""
+    uid = int(uid)
+    failure_columns = ', '.join(FAILURE_COLUMNS)
+    failure_values = ', '.join(f'NEW.{c}' for c in FAILURE_COLUMNS)
+    # 触发器中不能用 main. 限定表名，主库的表以 store_ 开头才不会解析到同名的临时视图
+    conn.executescript(_posts_view_sql(uid) + f'''
+        CREATE TEMP VIEW IF NOT EXISTS user_info AS SELECT uid, info FROM main.store_user_info WHERE uid = {uid};
+        CREATE TEMP TRIGGER IF NOT EXISTS user_info_insert INSTEAD OF INSERT ON user_info BEGIN
+            INSERT OR REPLACE INTO store_user_info (uid, info) VALUES ({uid}, NEW.info);
+        END;
+        CREATE TEMP VIEW IF NOT EXISTS failures AS
+            SELECT {failure_columns} FROM main.store_failures WHERE uid = {uid};
+        CREATE TEMP TRIGGER IF NOT EXISTS failures_insert INSTEAD OF INSERT ON failures BEGIN
+            INSERT OR REPLACE INTO store_failures (uid, {failure_columns}) VALUES ({uid}, {failure_values});
+        END;
+        CREATE TEMP TRIGGER IF NOT EXISTS failures_delete INSTEAD OF DELETE ON failures BEGIN
+            DELETE FROM store_failures WHERE uid = {uid} AND kind = OLD.kind AND key = OLD.key;
+        END;
+    ''')
+
+
+def set_time_range(conn: sqlite3.Connection, start: int = None, stop: int = None):
+    """
+    之后对 posts 的查询只包含 dateline 在 [start, stop) 内的帖子，用于从包含多年帖子的数据库生成某一年的报告
+
+    start 与 stop 均为 None 时取消限制。通过同名的临时视图实现，查询语句无需修改
+    """
+    condition = f' AND dateline >= {int(start)} AND dateline < {int(stop)}' if start is not None else ''
+    conn.execute('DROP VIEW IF EXISTS temp.posts')
+    if isinstance(conn, StoreConnection):
+        conn.executescript(_posts_view_sql(conn.uid, condition))
+    elif condition:
+        conn.execute(f'CREATE TEMP VIEW posts AS SELECT * FROM main.posts WHERE 1{condition}')
+
+
 def init_db(conn: sqlite3.Connection):
     """初始化数据库：创建 user_info 和 posts 表"""
+    if isinstance(conn, StoreConnection):
+        # 共享分片的表与视图已在 get_store_conn 中创建
+        return
     cursor = conn.cursor()
 
     # 创建 user_info 表
@@ -40,19 +258,63 @@ def init_db(conn: sqlite3.Connection):
         )
     ''')
 
+    # 创建 failures 表：获取失败的单元（列表页、待定位的 pid、帖子页），供之后重试
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS failures (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            detail TEXT,
+            error TEXT,
+            attempts INTEGER DEFAULT 1,
+            updated INTEGER,
+            PRIMARY KEY (kind, key)
+        )
+    ''')
+
     conn.commit()
+    init_fts(conn)
+
+
+def has_fts(conn: sqlite3.Connection) -> bool:
+    """是否有 posts 的全文索引 posts_fts（共享分片与不支持 FTS5 的 SQLite 没有）"""
+    return conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'posts_fts'").fetchone() is not None
+
+
+def init_fts(conn: sqlite3.Connection):
+    """
+    创建帖子的全文索引 posts_fts，由 insert_posts 保持同步，供 search.py 使用
+
+    外部内容表：正文只在 posts 中存一份，索引以 pid 为 rowid；trigram 分词器按连续三个字符建立索引，适用于不分词的中文。
+    之前创建的库没有索引，在此由已有的帖子重建一次（也可用 python search.py --build-index 离线建立）。
+    SQLite 不支持 FTS5 或 trigram（3.34 之前）时不创建，搜索退化为 LIKE。
+    """
+    if isinstance(conn, StoreConnection) or has_fts(conn):
+        return
+    try:
+        conn.execute("CREATE VIRTUAL TABLE posts_fts USING fts5(subject, message, content = 'posts', "
+                     "content_rowid = 'pid', tokenize = 'trigram')")
+    except sqlite3.OperationalError as e:
+        print(f'[{time.asctime()}] 无法创建全文索引: {e}')
+        return
+    rebuild_fts(conn)
+
+
+def rebuild_fts(conn: sqlite3.Connection):
+    """由 posts 重建 posts_fts，用于绕过 insert_posts 直接写入 posts 之后"""
+    if has_fts(conn):
+        conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+        conn.commit()
 
 
 def insert_user_info(conn: sqlite3.Connection, uid: int, info: str):
     """插入用户摘要信息"""
     cursor = conn.cursor()
-    cursor.execute('INSERT INTO user_info (uid, info) VALUES (?, ?)'
-                   'ON CONFLICT(uid) DO UPDATE SET info = excluded.info', (uid, info))
+    cursor.execute('INSERT OR REPLACE INTO user_info (uid, info) VALUES (?, ?)', (uid, info))
     conn.commit()
 
 
 def insert_posts(conn: sqlite3.Connection, posts: list[dict]):
-    """批量插入帖子信息"""
+    """批量插入帖子信息，每 INSERT_BATCH_SIZE 行提交一次"""
     if not posts:
         return
 
@@ -61,16 +323,28 @@ def insert_posts(conn: sqlite3.Connection, posts: list[dict]):
         'views', 'replies', 'support', 'oppose', 'favorite'
     ]
 
-    data = [
-        tuple(post.get(k) for k in keys)
+    # 同一 pid 只保留最后一行（与 INSERT OR REPLACE 的结果相同），全文索引中每个 pid 只能有一条
+    data = list({
+        post.get('post_id'): tuple(post.get(k) for k in keys)
         for post in posts
-    ]
+    }.values())
+    fts = has_fts(conn)
     cursor = conn.cursor()
-    cursor.executemany(
-        'INSERT OR REPLACE INTO posts (tid, pid, fid, reply_pid, reply_user, position, subject, message, dateline,'
-        'views, replies, support, oppose, favorite) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-        data)
-    conn.commit()
+    for i in range(0, len(data), INSERT_BATCH_SIZE):
+        batch = data[i:i + INSERT_BATCH_SIZE]
+        if fts:
+            # 外部内容表需用旧内容删除索引中已有的行
+            cursor.execute("INSERT INTO posts_fts (posts_fts, rowid, subject, message) "
+                           "SELECT 'delete', pid, subject, message FROM posts "
+                           "WHERE pid IN (SELECT value FROM json_each(?))", (json.dumps([row[1] for row in batch]),))
+        cursor.executemany(
+            'INSERT OR REPLACE INTO posts (tid, pid, fid, reply_pid, reply_user, position, subject, message, dateline,'
+            'views, replies, support, oppose, favorite) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            batch)
+        if fts:
+            cursor.executemany('INSERT INTO posts_fts (rowid, subject, message) VALUES (?, ?, ?)',
+                               [(row[1], row[6], row[7]) for row in batch])
+        conn.commit()
 
 
 def get_user_info(conn: sqlite3.Connection, uid: int) -> dict:
@@ -82,3 +356,52 @@ def get_user_info(conn: sqlite3.Connection, uid: int) -> dict:
         return json.loads(result[0])
     else:
         return {}
+
+
+def insert_failures(conn: sqlite3.Connection, failures: list[tuple[str, str | int, dict | None, str]]):
+    """
+    记录获取失败的单元，已存在的记录累加尝试次数
+
+    :param failures: [(kind, key, detail, error), ...]
+    """
+    if not failures:
+        return
+    now = int(time.time())
+    data = [
+        (kind, str(key), json.dumps(detail, separators=(',', ':')) if detail is not None else None, error,
+         kind, str(key), now)
+        for kind, key, detail, error in failures
+    ]
+    cursor = conn.cursor()
+    # 视图上不能使用 ON CONFLICT，改为 REPLACE 并由子查询累加次数，两种后端通用
+    cursor.executemany(
+        'INSERT OR REPLACE INTO failures (kind, key, detail, error, attempts, updated) VALUES (?, ?, ?, ?, '
+        'COALESCE((SELECT attempts FROM failures WHERE kind = ? AND key = ?), 0) + 1, ?)', data)
+    conn.commit()
+
+
+def get_failures(conn: sqlite3.Connection) -> list[dict]:
+    """获取所有失败记录"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT kind, key, detail, error, attempts FROM failures ORDER BY kind, key')
+    return [
+        {'kind': kind, 'key': key, 'detail': json.loads(detail) if detail else None, 'error': error,
+         'attempts': attempts}
+        for kind, key, detail, error, attempts in cursor.fetchall()
+    ]
+
+
+def delete_failures(conn: sqlite3.Connection, keys: list[tuple[str, str]]):
+    """删除已重试成功的失败记录"""
+    if not keys:
+        return
+    cursor = conn.cursor()
+    cursor.executemany('DELETE FROM failures WHERE kind = ? AND key = ?', keys)
+    conn.commit()
+
+
+def count_failures(conn: sqlite3.Connection) -> dict[str, int]:
+    """按类型统计失败记录数"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT kind, COUNT(*) FROM failures GROUP BY kind')
+    return dict(cursor.fetchall())
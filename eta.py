@@ -0,0 +1,133 @@
+"""
+排队等待与获取耗时的预计（ETA）
+
+从已完成任务的 task.json 拟合：
+  - request_seconds  每个请求的平均耗时（各获取阶段耗时之和 / 请求数之和）
+  - task_overhead    每个任务不随请求数增长的耗时（中位数）
+  - report_seconds   生成报告的耗时（中位数）
+  - cost_ratio       实际请求数与调度器预计开销之比（中位数），用于校正 scheduler.estimate_cost 的偏差
+
+web.py 用它为排队中的用户估计开始与完成时间，为正在获取的用户按已发出的请求数估计剩余时间。
+直接运行可查看拟合结果，并按高峰期的到达速率估计需要的 main.py 实例数：
+    python eta.py --arrivals 300
+"""
+import os
+import json
+import math
+import time
+import argparse
+import statistics
+import scheduler
+
+
+class EtaModel:
+
+    def __init__(self, request_seconds: float = 0.02, task_overhead: float = 2.0, report_seconds: float = 1.0,
+                 cost_ratio: float = 1.0, samples: int = 0):
+        self.request_seconds = request_seconds
+        self.task_overhead = task_overhead
+        self.report_seconds = report_seconds
+        self.cost_ratio = cost_ratio
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, tasks: list[dict], recent: int = 200) -> 'EtaModel':
+        """用最近 recent 个带有 stages 的任务拟合，没有可用的任务时返回默认值"""
+        tasks = [t for t in tasks if isinstance(t.get('stages'), dict) and 'get_data_start' in t
+                 and 'get_data_stop' in t]
+        tasks = sorted(tasks, key=lambda t: t['get_data_start'])[-recent:]
+        model = cls()
+        if not tasks:
+            return model
+        request_time = total_requests = 0
+        overheads, reports, ratios = [], [], []
+        for t in tasks:
+            stages = t['stages']
+            fetch = [s for s in stages.values() if s.get('requests')]
+            seconds = sum(s['seconds'] for s in fetch)
+            requests = sum(s['requests'] for s in fetch)
+            request_time += seconds
+            total_requests += requests
+            overheads.append(max(t['get_data_stop'] - t['get_data_start'] - seconds, 0))
+            report = sum(stages.get(name, {}).get('seconds', 0) for name in ('report_sql', 'report_write'))
+            if report:
+                reports.append(report)
+            if t.get('cost') and requests:
+                ratios.append(requests / t['cost'])
+        if total_requests:
+            model.request_seconds = request_time / total_requests
+        model.task_overhead = statistics.median(overheads)
+        if reports:
+            model.report_seconds = statistics.median(reports)
+        if ratios:
+            model.cost_ratio = statistics.median(ratios)
+        model.samples = len(tasks)
+        return model
+
+    def expected_requests(self, cost: int | None) -> float:
+        return (cost if cost is not None else scheduler.DEFAULT_COST) * self.cost_ratio
+
+    def task_seconds(self, cost: int | None) -> float:
+        """一个任务从开始获取到报告生成完成的预计耗时"""
+        return self.task_overhead + self.expected_requests(cost) * self.request_seconds + self.report_seconds
+
+    def remaining_seconds(self, cost: int | None, done_requests: int = None, elapsed: float = 0) -> float:
+        """
+        正在获取的任务的预计剩余时间
+
+        :param done_requests: 已发出的请求数（来自进度事件），未知时按已经过的时间估计
+        :param elapsed: 已经过的秒数
+        """
+        if done_requests is None:
+            return max(self.task_seconds(cost) - elapsed, self.report_seconds)
+        # 实际请求数已超出预计时，假设剩余部分为已完成部分的一成
+        expected = max(self.expected_requests(cost), done_requests * 1.1)
+        return (expected - done_requests) * self.request_seconds + self.report_seconds
+
+    def as_dict(self) -> dict:
+        return {
+            'request_seconds': round(self.request_seconds, 4),
+            'task_overhead': round(self.task_overhead, 2),
+            'report_seconds': round(self.report_seconds, 2),
+            'cost_ratio': round(self.cost_ratio, 3),
+            'samples': self.samples
+        }
+
+
+def load_tasks(user_dir: str = 'data/user') -> list[dict]:
+    tasks = []
+    if os.path.isdir(user_dir):
+        for entry in os.scandir(user_dir):
+            path = os.path.join(entry.path, 'task.json')
+            if entry.name.isdigit() and os.path.exists(path):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        tasks.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+    return tasks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='拟合 ETA 模型并估计高峰期需要的 main.py 实例数')
+    parser.add_argument('--user-dir', default='data/user')
+    parser.add_argument('--recent', type=int, default=200, help='使用最近多少个任务拟合')
+    parser.add_argument('--arrivals', type=float, help='高峰期每小时新增的任务数')
+    parser.add_argument('--utilization', type=float, default=0.7, help='目标利用率，越低排队越短')
+    args = parser.parse_args()
+
+    tasks = load_tasks(args.user_dir)
+    model = EtaModel.fit(tasks, args.recent)
+    recent = sorted((t for t in tasks if 'get_data_start' in t), key=lambda t: t['get_data_start'])[-args.recent:]
+    costs = [t['cost'] for t in recent if t.get('cost')]
+    mean_cost = statistics.mean(costs) if costs else scheduler.DEFAULT_COST
+    mean_seconds = model.task_seconds(mean_cost)
+    result = model.as_dict() | {
+        'mean_cost': round(mean_cost, 1),
+        'mean_task_seconds': round(mean_seconds, 1),
+        'users_per_hour_per_instance': round(3600 / mean_seconds, 1)
+    }
+    if args.arrivals:
+        result['instances_needed'] = math.ceil(args.arrivals * mean_seconds / 3600 / args.utilization)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f'[{time.asctime()}] 基于 {model.samples} 个任务')
@@ -5,6 +5,11 @@ import json
 import util
 from datetime import datetime
 import config
+import notify
+import profiler
+import site_stats
+import static_report
+import preview
 
 
 def get_yearly_post_counts(db_conn, year: int):
@@ -55,25 +60,79 @@ def get_all_top_tied(ranked_list):
     return result
 
 
-def main():
-    report = {
-        'user': {},
-        'summary': {},
-        'first_and_last': {},
-        'support_and_oppose': {},
-        'popularity': {},
-        'personal_favorite': {},
-        'rank': {}
-    }
-    db_conn = db.get_conn(uid)
-    cursor = db_conn.cursor()
-    user_info = db.get_user_info(db_conn, uid)
+# 排行与首末帖中 message 的摘要长度（字符）
+EXCERPT_LENGTH = 60
+# 各排行中 message 所在的下标
+MESSAGE_INDEX = {
+    'thread_support': 3, 'thread_oppose': 3, 'reply_support': 4, 'reply_oppose': 4,
+    'thread_most_support': 3, 'thread_most_oppose': 3, 'reply_most_support': 4, 'reply_most_oppose': 4,
+}
+# 分段加载时首先发送的部分中 task 保留的字段（report.js 用到的）
+CORE_TASK_FIELDS = ('create_time', 'get_data_start', 'get_data_stop', 'tid_count', 'generate_report')
+
+
+def excerpt(message: str | None) -> str | None:
+    """正文摘要：合并空白，截取前 EXCERPT_LENGTH 个字符"""
+    if message is None:
+        return None
+    text = ' '.join(message.split())
+    return text if len(text) <= EXCERPT_LENGTH else text[:EXCERPT_LENGTH] + '…'
+
+
+def message_rows(report: dict):
+    """报告中带 message 的行及 (pid 下标, message 下标)"""
+    for group in ('rank', 'support_and_oppose'):
+        for key, rows in report[group].items():
+            if key in MESSAGE_INDEX:
+                for row in rows:
+                    yield row, 1, MESSAGE_INDEX[key]
+    for row in report['first_and_last'].values():
+        if row:
+            yield row, 3, 5
+
+
+def compact_report(report: dict) -> dict:
+    """
+    生成供前端使用的精简报告：排行与首末帖中的 message 正文替换为摘要，全文由 /api/get_post 获取
+
+    为保持下标不变，替换而不是删除
+    """
+    compact = json.loads(json.dumps(report))
+    for row, _, message_index in message_rows(compact):
+        row[message_index] = excerpt(row[message_index])
+    return compact
+
+
+def report_messages(report: dict) -> dict[str, str]:
+    """报告中各帖子的全文 {pid: message}，写入 report.messages.json"""
+    return {str(row[pid_index]): row[message_index] for row, pid_index, message_index in message_rows(report)}
+
+
+def report_parts(compact: dict) -> dict[str, dict]:
+    """
+    将精简报告分为两部分，供 /api/get_report?part= 分段发送：
+      - core：摘要、每日发帖（热力图）等首屏内容，task 只保留 report.js 用到的字段
+      - rank：各排行榜，展开时再加载
+    """
+    core = {k: v for k, v in compact.items() if k != 'rank'}
+    if 'task' in core:
+        core['task'] = {k: core['task'][k] for k in CORE_TASK_FIELDS if k in core['task']}
+    return {'core': core, 'rank': {'rank': compact['rank'], 'year': compact['year']}}
+
+
+def section_user(cursor, report: dict, uid: int, year: int):
+    """用户信息"""
+    user_info = db.get_user_info(cursor.connection, uid)
     user_summary = user_info['user_summary']
     report['user']['uid'] = uid
     report['user']['username'] = user_summary['username']
     report['user']['group_title'] = user_summary['group_title']
     report['user']['group_subtitle'] = user_summary['group_subtitle']
     report['user']['register_time'] = user_info['register_time']
+
+
+def section_summary(cursor, report: dict, uid: int, year: int):
+    """主题总数，回复总数，沙发数"""
     # 主题总数，回复总数
     cursor.execute("""
             SELECT 
@@ -92,6 +151,10 @@ def main():
          FROM posts
     """)
     report['summary']['sofa_count'] = cursor.fetchone()[0]
+
+
+def section_first_and_last(cursor, report: dict, uid: int, year: int):
+    """最早/最晚的主题帖与回复"""
     # 最早的主题帖
     cursor.execute("""
             SELECT position, dateline, tid, pid, subject, message
@@ -128,6 +191,10 @@ def main():
             LIMIT 1
         """)
     report['first_and_last']['last_reply'] = cursor.fetchone()
+
+
+def section_support_and_oppose(cursor, report: dict, uid: int, year: int):
+    """点赞/点踩总计与排行"""
     # 点赞总计/点踩总计
     cursor.execute("""
             SELECT 
@@ -179,6 +246,10 @@ def main():
     report['support_and_oppose']['thread_most_oppose'] = get_all_top_tied(report['rank']['thread_oppose'])
     report['support_and_oppose']['reply_most_support'] = get_all_top_tied(report['rank']['reply_support'])
     report['support_and_oppose']['reply_most_oppose'] = get_all_top_tied(report['rank']['reply_oppose'])
+
+
+def section_popularity(cursor, report: dict, uid: int, year: int):
+    """回复、浏览、收藏排行"""
     # 回复主题帖排行
     cursor.execute("""
             SELECT tid, subject, COUNT(*) AS reply_count
@@ -224,7 +295,10 @@ def main():
     report['popularity']['thread_views_most'] = get_all_top_tied(report['rank']['thread_views'])
     # 被收藏最多的帖子
     report['popularity']['thread_favorite_most'] = get_all_top_tied(report['rank']['thread_favorite'])
-    # 版块发帖排行
+
+
+def section_forum(cursor, report: dict, uid: int, year: int):
+    """版块发帖排行"""
     cursor.execute("""
             SELECT fid, COUNT(*) AS post_count
             FROM posts
@@ -241,7 +315,10 @@ def main():
     report['rank']['forum_post'] = new_forum_post
     # 最喜欢的分区（发表主题帖和回复总和）
     report['personal_favorite']['forum_most_favorite'] = get_all_top_tied(report['rank']['forum_post'])
-    # 回复的人排行
+
+
+def section_reply_user(cursor, report: dict, uid: int, year: int):
+    """回复的人排行"""
     cursor.execute("""
             SELECT reply_user, COUNT(*) AS reply_count
             FROM posts
@@ -255,8 +332,11 @@ def main():
     report['rank']['reply_user'] = cursor.fetchall()
     # 回复最多的人
     report['personal_favorite']['reply_user_most'] = get_all_top_tied(report['rank']['reply_user'])
-    # 每天发帖量
-    report['summary']['post_count_per_day'] = get_yearly_post_counts(db_conn, config.year)
+
+
+def section_daily(cursor, report: dict, uid: int, year: int):
+    """每天发帖量"""
+    report['summary']['post_count_per_day'] = get_yearly_post_counts(cursor.connection, year)
     # 发帖天数
     report['summary']['post_days'] = len(report['summary']['post_count_per_day'])
     # 发帖量排行
@@ -265,30 +345,147 @@ def main():
         for date, count in
         sorted(report['summary']['post_count_per_day'].items(), key=lambda x: x[1], reverse=True)[:20]
     ]
-    # 发帖最多的日期
-    post_max_count = max(report['summary']['post_count_per_day'].values())
+    # 发帖最多的日期（多年任务中可能有没有发帖的年份）
+    post_max_count = max(report['summary']['post_count_per_day'].values(), default=0)
     report['summary']['post_most_days'] = [
         {"d": date, "c": count}
         for date, count in report['summary']['post_count_per_day'].items()
-        if count == post_max_count
+        if count == post_max_count > 0
     ]
     report['summary']['post_most_days'].sort(key=lambda x: x["d"])
+
+
+# 报告各部分，按顺序执行
+SECTIONS = [
+    ('user', section_user),
+    ('summary', section_summary),
+    ('first_and_last', section_first_and_last),
+    ('support_and_oppose', section_support_and_oppose),
+    ('popularity', section_popularity),
+    ('forum', section_forum),
+    ('reply_user', section_reply_user),
+    ('daily', section_daily),
+]
+
+
+def build_report(db_conn, uid: int, year: int, timings: dict = None) -> dict:
+    """
+    从数据库生成报告（不含 task）
+
+    :param timings: 若传入 dict，则写入各部分的耗时（秒）
+    """
+    report = {
+        'user': {},
+        'summary': {},
+        'first_and_last': {},
+        'support_and_oppose': {},
+        'popularity': {},
+        'personal_favorite': {},
+        'rank': {}
+    }
+    cursor = db_conn.cursor()
+    for name, section in SECTIONS:
+        start = time.perf_counter()
+        section(cursor, report, uid, year)
+        if timings is not None:
+            timings[name] = time.perf_counter() - start
     # 添加年
-    report['year'] = config.year
+    report['year'] = year
+    return report
+
+
+def serialize_report(report: dict) -> tuple[bytes, bytes, dict[str, bytes]]:
+    """
+    :return:
+        (report.json 的内容, report.min.json 的内容, {part: report.{part}.min.json 的内容})
+    """
+    report_bytes = json.dumps(report, ensure_ascii=False, indent=4).encode()
+    # 精简版：直接是 /api/get_report 的完整响应体，web.py 或 nginx 可原样发送
+    compact = compact_report(report)
+    min_bytes = json.dumps({"code": 0, "message": "成功", "data": compact},
+                           ensure_ascii=False, separators=(',', ':')).encode()
+    parts = {
+        part: json.dumps({"code": 0, "message": "成功", "data": data}, ensure_ascii=False,
+                         separators=(',', ':')).encode()
+        for part, data in report_parts(compact).items()
+    }
+    return report_bytes, min_bytes, parts
+
+
+def add_deltas(reports: dict[int, dict]):
+    """为每年的报告写入与上一年相比的变化量（指标同 site_stats.METRICS）"""
+    for year, report in reports.items():
+        previous = reports.get(year - 1)
+        if previous:
+            current, before = site_stats.extract(report), site_stats.extract(previous)
+            report['delta'] = {'year': year - 1, 'values': {k: current[k] - before[k] for k in current}}
+
+
+def main():
     with open(f'data/user/{uid}/task.json', 'r', encoding='utf-8') as f:
         task = json.load(f)
+    # 多年任务（task.json 中的 years）从同一个数据库为每年生成一份报告
+    first, last = task.get('years') or [config.year, config.year]
+    years = list(range(first, last + 1))
+    primary = config.year if config.year in years else last
+    sql_start = time.perf_counter()
+    db_conn = db.get_conn(uid)
+    reports = {}
+    for year in years:
+        # 数据库中可能有其他年份的帖子（之前的多年任务），按年份限定查询范围
+        db.set_time_range(db_conn, *util.year_range(year))
+        reports[year] = build_report(db_conn, uid, year)
+    add_deltas(reports)
+    for report in reports.values():
+        if len(years) > 1:
+            report['years'] = years
+        # 各指标超过的用户百分比（按计入全站汇总之后计算，报告写入后再计入）
+        report['site'] = site_stats.peek(uid, report)
     # 写入元信息
     task['generate_report'] = int(time.time())
-    report['task'] = task
+    task.pop('report_error', None)
+    stages = task.setdefault('stages', {})
+    stages['report_sql'] = {'seconds': round(time.perf_counter() - sql_start, 3)}
+    write_start = time.perf_counter()
 
-    # 写入文件
-    with open(f'data/user/{uid}/report.json', 'w', encoding='utf-8') as f:
-        # json.dump(report, f, ensure_ascii=False, separators=(',', ':'))
-        json.dump(report, f, ensure_ascii=False, indent=4)
+    # 写入文件：多年任务每年写入 report.{year}.json，主年份另写一份 report.json，并最后写入（其存在表示已完成）
+    user_dir = f'data/user/{uid}'
+    payload = {}
+    for year in sorted(years, key=lambda y: y == primary):
+        report = reports[year]
+        report['task'] = task
+        report_bytes, min_bytes, parts = serialize_report(report)
+        messages_bytes = json.dumps(report_messages(report), ensure_ascii=False, separators=(',', ':')).encode()
+        names = [f'report.{year}'] if len(years) > 1 else []
+        if year == primary:
+            names.append('report')
+        for name in names:
+            # 分段、全文与 min.json 先于 {name}.json 写入：web.py 与 nginx 优先读取 min.json，{name}.json 最后写入表示已完成
+            for part, part_bytes in parts.items():
+                payload |= util.write_precompressed(f'{user_dir}/{name}.{part}.min.json', part_bytes)
+            util.write_atomic(f'{user_dir}/{name}.messages.json', messages_bytes)
+            payload[f'{name}.messages.json'] = len(messages_bytes)
+            if static_report.STATIC_REPORT_DIR:
+                # 静态页面：主年份为 index.html，其他年份为 {year}.html
+                compact = compact_report(report)
+                page_data = report_parts(compact)['core'] | {'rank': compact['rank']}
+                payload |= static_report.write(uid, 'index' if name == 'report' else str(year), page_data)
+            payload |= util.write_precompressed(f'{user_dir}/{name}.min.json', min_bytes)
+            util.write_atomic(f'{user_dir}/{name}.json', report_bytes)
+            payload[f'{name}.json'] = len(report_bytes)
+    # 完整报告已写入，删除列表阶段写入的预览（见 preview.py）
+    preview.remove(uid)
+    # 计入全站汇总
+    for report in reports.values():
+        try:
+            site_stats.record(uid, report)
+        except OSError as e:
+            print(f'[{time.asctime()}] 更新全站汇总失败: {e}')
     # 更新task文件
-
-    with open(f'data/user/{uid}/task.json', 'w', encoding='utf-8') as f:
-        json.dump(task, f, ensure_ascii=False, separators=(',', ':'))
+    task['payload'] = payload
+    stages['report_write'] = {'seconds': round(time.perf_counter() - write_start, 3)}
+    util.save_task_metadata(uid, task)
+    notify.send('report_done', uid)
 
 
 if __name__ == '__main__':
@@ -301,4 +498,12 @@ if __name__ == '__main__':
     except ValueError:
         print('Invalid uid')
         exit()
-    main()
+    if profiler.profiling_enabled({}):
+        report_profiler = profiler.TaskProfiler(uid, 'report_profile')
+        report_profiler.start()
+        try:
+            main()
+        finally:
+            report_profiler.stop()
+    else:
+        main()
@@ -0,0 +1,203 @@
+"""
+远程爬虫节点的租约：web.py 的 /AnnualReport/api/lease/* 接口使用，节点端见 remote_worker.py
+
+  - claim：从 data/queue 原子地取出一个任务（util.get_next_task 的 os.rename），移入 data/lease/{uid}，
+    记录租约 id、节点名、到期时间与任务在队列中的修改时间
+  - heartbeat：节点定期续期并附带进度，进度作为 progress 事件转发给 SSE 订阅者与 ETA
+  - complete：节点上传 post.db 与 task.json，写入 data/user/{uid}/（共享存储时导入分片），删除租约后生成报告
+  - reap：到期未续期的租约放回 data/queue，保持原来的修改时间（排队顺序），由其他节点或本机 main.py 重新获取
+
+租约文件的格式：
+    {
+        "id": str,          # 租约 id，续期与上传时校验
+        "uid": int,
+        "worker": str,      # 节点名
+        "task": dict,       # 队列文件的内容
+        "queued": float,    # 队列文件的修改时间，放回队列时恢复
+        "expires": float    # 到期时间
+    }
+"""
+import os
+import json
+import time
+import secrets
+import subprocess
+import threading
+import db
+import util
+import notify
+import metrics
+import migrate_store
+
+LEASE_DIR = 'data/lease'
+
+LEASES = metrics.Counter('qshp_leases_total', '远程节点的租约数', ('result',))
+
+# 心跳中转发的进度字段，见 main.report_progress
+PROGRESS_FIELDS = ('stage', 'requests', 'pages', 'tid_count', 'done', 'total')
+
+
+class LeaseError(Exception):
+    """租约不存在、已过期或 id 不符"""
+
+
+class LeaseManager:
+    def __init__(self, ttl: float = 300, policy: str = 'hrrn', request_seconds: float = 0.02):
+        """
+        :param ttl: 租约时长（秒），节点应每 ttl/3 秒发送一次心跳
+        :param policy: 与 main.py 使用相同的排序（见 scheduler.py）
+        """
+        self.ttl = ttl
+        self.policy = policy
+        self.request_seconds = request_seconds
+        self.lock = threading.Lock()
+        os.makedirs(LEASE_DIR, exist_ok=True)
+
+    @staticmethod
+    def _path(uid: int) -> str:
+        return f'{LEASE_DIR}/{uid}'
+
+    def _load(self, uid: int, lease_id: str) -> dict:
+        """读取并校验租约（调用者需持有锁）"""
+        try:
+            with open(self._path(uid), 'r', encoding='utf-8') as f:
+                lease = json.load(f)
+        except (OSError, ValueError):
+            raise LeaseError('租约不存在或已过期')
+        if lease.get('id') != lease_id:
+            raise LeaseError('租约 id 不符')
+        if lease['expires'] < time.time():
+            raise LeaseError('租约已过期')
+        return lease
+
+    @staticmethod
+    def _save(lease: dict):
+        util.write_atomic(LeaseManager._path(lease['uid']),
+                          json.dumps(lease, ensure_ascii=False, separators=(',', ':')).encode())
+
+    def claim(self, worker: str) -> dict | None:
+        """取出下一个任务，没有任务时返回 None"""
+        with self.lock:
+            task = util.get_next_task(self.policy, self.request_seconds, LEASE_DIR)
+            if task is None:
+                return None
+            uid = task['uid']
+            lease = {
+                'id': secrets.token_hex(16),
+                'uid': uid,
+                'worker': worker,
+                'task': task,
+                # rename 保留了队列文件的修改时间
+                'queued': os.stat(self._path(uid)).st_mtime,
+                'expires': time.time() + self.ttl
+            }
+            self._save(lease)
+        LEASES.inc(result='claim')
+        print(f'[{time.asctime()}] 租约: {worker} 获取 {uid}')
+        notify.send('start', uid, cost=task.get('cost'), worker=worker)
+        return lease
+
+    def heartbeat(self, uid: int, lease_id: str, progress: dict = None) -> float:
+        """
+        续期，返回新的到期时间
+
+        :raise LeaseError:
+        """
+        with self.lock:
+            lease = self._load(uid, lease_id)
+            lease['expires'] = time.time() + self.ttl
+            self._save(lease)
+        if progress and isinstance(progress.get('stage'), str):
+            data = {k: v for k, v in progress.items() if k in PROGRESS_FIELDS and isinstance(v, (int, str))}
+            notify.send('progress', uid, **data)
+        return lease['expires']
+
+    def complete(self, uid: int, lease_id: str, post_db, task_json: bytes):
+        """
+        保存节点上传的数据并在后台生成报告
+
+        :param post_db: 有 save(path) 方法的上传文件（werkzeug.FileStorage）
+        :raise LeaseError:
+        """
+        task = json.loads(task_json)
+        if not isinstance(task, dict) or task.get('uid') != uid:
+            raise LeaseError('task.json 与租约不符')
+        user_dir = f'data/user/{uid}'
+        # 先校验再保存上传的文件；保存时不持有锁，不阻塞其他节点的心跳
+        with self.lock:
+            self._load(uid, lease_id)
+        os.makedirs(user_dir, exist_ok=True)
+        temp_path = f'{user_dir}/post.db.{threading.get_ident()}.upload'
+        post_db.save(temp_path)
+        with self.lock:
+            try:
+                lease = self._load(uid, lease_id)
+            except LeaseError:
+                os.remove(temp_path)
+                raise
+            os.replace(temp_path, f'{user_dir}/post.db')
+            # 上传的库取代之前由 compact.py 归档的库
+            if os.path.exists(f'{user_dir}/post.db.gz'):
+                os.remove(f'{user_dir}/post.db.gz')
+            if db.STORE == 'shared':
+                migrate_store.to_shared(uid, db.STORE_SHARDS, remove=True)
+            task['worker'] = lease['worker']
+            util.save_task_metadata(uid, task)
+            os.remove(self._path(uid))
+        LEASES.inc(result='complete')
+        print(f'[{time.asctime()}] 租约: {lease["worker"]} 完成 {uid}')
+        notify.send('data_done', uid)
+        notify.send('report_start', uid)
+        threading.Thread(target=self._generate_report, args=(uid, task), name=f'report-{uid}', daemon=True).start()
+
+    @staticmethod
+    def _generate_report(uid: int, task: dict):
+        result = subprocess.run(['python3', 'generate_report.py', str(uid)])
+        if result.returncode:
+            util.mark_report_failed(uid, task, result.returncode)
+
+    def reap(self) -> list[int]:
+        """将过期的租约放回队列，返回放回的 uid"""
+        requeued = []
+        with self.lock:
+            for entry in os.scandir(LEASE_DIR):
+                if not entry.name.isdigit():
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        lease = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if 'id' not in lease:
+                    # 取出任务后、写入租约前中断，文件内容仍是任务本身
+                    lease = {'worker': None, 'task': lease, 'queued': entry.stat().st_mtime, 'expires': 0}
+                if lease['expires'] >= time.time():
+                    continue
+                uid = int(entry.name)
+                queue_path = f'data/queue/{uid}'
+                # 期间用户重新申请时队列中已有新任务，直接丢弃租约
+                if not os.path.exists(queue_path):
+                    util.write_atomic(queue_path, json.dumps(lease['task'], ensure_ascii=False,
+                                                             separators=(',', ':')).encode())
+                    os.utime(queue_path, (lease['queued'], lease['queued']))
+                os.remove(entry.path)
+                requeued.append((uid, lease))
+        for uid, lease in requeued:
+            LEASES.inc(result='expired')
+            print(f'[{time.asctime()}] 租约: {lease["worker"]} 的 {uid} 已过期，放回队列')
+            notify.send('enqueue', uid, mtime=lease['queued'], cost=lease['task'].get('cost'))
+        return [uid for uid, _ in requeued]
+
+    def reap_loop(self):
+        while True:
+            time.sleep(max(self.ttl / 4, 1))
+            try:
+                self.reap()
+            except Exception as e:
+                print(f'[{time.asctime()}] 租约回收失败: {e}')
+
+    def start(self) -> threading.Thread:
+        """启动定期回收过期租约的守护线程"""
+        thread = threading.Thread(target=self.reap_loop, name='lease-reaper', daemon=True)
+        thread.start()
+        return thread
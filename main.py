@@ -7,9 +7,101 @@ import time
 import db
 import json
 from collections import defaultdict
-from typing import Dict, List, Tuple
-import datetime
+from typing import Dict, List
 import sys
+import notify
+import metrics
+import profiler
+import cassette
+import scheduler
+import planner
+import preview
+import split
+import subprocess
+
+TASKS = metrics.Counter('qshp_tasks_total', '完成的任务数')
+POSTS = metrics.Counter('qshp_posts_fetched_total', '获取并写入的帖子数')
+TASK_SECONDS = metrics.Histogram('qshp_task_seconds', '单个任务获取数据的耗时', buckets=(10, 30, 60, 120, 300, 600, 1800, 3600))
+REPORT_SECONDS = metrics.Histogram('qshp_report_seconds', '生成报告的耗时', buckets=(0.5, 1, 2, 5, 10, 30, 60, 120))
+QUEUE_DEPTH = metrics.Gauge('qshp_queue_depth', '队列中等待的任务数',
+                            func=lambda: sum(1 for f in os.scandir('data/queue') if f.name.isdigit()))
+QUEUE_WAIT = metrics.Histogram('qshp_queue_wait_seconds', '任务在队列中的等待时间',
+                               buckets=(10, 60, 300, 600, 1800, 3600, 7200, 21600, 86400))
+MAX_WORKERS = metrics.Gauge('qshp_max_workers', '各阶段的线程数设置', ('stage',))
+
+
+def report_progress(uid: int, stage: str, force: bool = False, **data):
+    """发送进度事件，附带本任务已发出的请求数，供 web.py 估计剩余时间（见 eta.py）"""
+    data['requests'] = task_requests()
+    # 最新进度，remote_worker.py 随心跳发给协调端
+    progress_state.clear()
+    progress_state.update(data, stage=stage)
+    notify.progress(uid, stage, force, **data)
+
+
+def task_requests() -> int:
+    """本任务已发出的请求数（含拆分到子进程的请求）"""
+    return api.request_count - task_request_start + (split_pool.request_count if split_pool else 0)
+
+
+def set_time_range(first_year: int, last_year: int):
+    """
+    只获取 first_year 年初至 last_year 年末的帖子
+
+    列表按时间倒序，遇到早于 first_year 的帖子即停止，因此多年的任务也只遍历一次列表
+    """
+    global start_time, stop_time
+    stop_time = util.year_range(first_year)[0]
+    start_time = util.year_range(last_year)[1] - 1
+
+
+def record_page_failures(kind: str, failed: dict[int, str], page_end: int, all_failed: bool):
+    """
+    记录获取失败的列表页
+
+    失败页不再视为空页（空页表示已到末页）。整批都失败时无法判断是否已到末页，
+    将最后一页标记为 resume，重试时从该页继续向后获取
+    """
+    for page, error in sorted(failed.items()):
+        detail = {'resume': True} if all_failed and page == page_end else None
+        failures.append((kind, page, detail, error))
+
+
+def unit_worker(kind: str, uid: int):
+    """
+    各类单元的请求函数与线程数
+
+    :param kind: thread_list、reply_list（单元为页码）、find_point（pid）、posts（planner.plan 的一项）
+    """
+    match kind:
+        case 'thread_list':
+            return (lambda page: api.get_user_threads(uid, page).get('rows', [])), max_workers_thread
+        case 'reply_list':
+            return (lambda page: api.get_user_replies(uid, page).get('rows', [])), max_workers_reply
+        case 'find_point':
+            return api.find_point, max_workers_position
+        case 'posts':
+            return (lambda unit: _fetch_tid_page_posts(*unit)), max_workers_posts
+    raise ValueError(kind)
+
+
+def run_units(kind: str, units, uid: int):
+    """
+    并发执行一组单元，按完成顺序逐个产生 (单元, 结果, 错误)，失败时结果为 None、错误为 repr(异常)
+
+    本任务启用拆分（见 split.py）时按块分给子进程，子进程内同样使用 unit_worker 的线程数
+    """
+    if split_pool:
+        yield from split_pool.run(kind, list(units), uid)
+        return
+    func, workers = unit_worker(kind, uid)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(func, unit): unit for unit in units}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, repr(e)
 
 
 def fetch_valid_thread_tids_in_pages(uid: int, page_start: int, page_end: int):
@@ -19,20 +111,18 @@ def fetch_valid_thread_tids_in_pages(uid: int, page_start: int, page_end: int):
     tids = []
     should_stop = False
 
-    with ThreadPoolExecutor(max_workers=max_workers_thread) as executor:
-        futures = {
-            executor.submit(api.get_user_threads, uid, p): p
-            for p in range(page_start, page_end + 1)
-        }
-        page_results = {}
-        for future in as_completed(futures):
-            try:
-                resp = future.result()
-                page_results[future] = resp.get('rows', [])
-            except Exception as e:
-                print(f"[Thread] Page error: {e}")
-                page_results[future] = []
+    page_results = {}
+    failed = {}
+    for page, rows, error in run_units('thread_list', range(page_start, page_end + 1), uid):
+        if error:
+            print(f"[Thread] Page {page} error: {error}")
+            failed[page] = error
+        else:
+            page_results[page] = rows
 
+    record_page_failures('thread_page', failed, page_end, not page_results)
+    if not page_results:
+        should_stop = True
     for rows in page_results.values():
         if not rows:
             should_stop = True
@@ -46,32 +136,38 @@ def fetch_valid_thread_tids_in_pages(uid: int, page_start: int, page_end: int):
                 break
             else:
                 tids.append(th['thread_id'])
+                listed_rows.append((True, th))
+                # 主题列表的行已带主题信息，获取帖子页时无需再请求 thread_details
+                thread_metas[th['thread_id']] = planner.thread_meta(th)
+                if post := planner.listed_post(th, 1):
+                    listed_posts.setdefault(th['thread_id'], {})[1] = post
     return tids, should_stop
 
 
-def fetch_valid_reply_positions_in_pages(uid: int, page_start: int, page_end: int):
+def fetch_valid_reply_positions_in_pages(uid: int, page_start: int, page_end: int, post_ids: List[int] = None):
     """
     返回 (tid_positions: Dict[tid, List[position]], should_stop: bool)
-    内部对 find_point 使用多线程加速
+    内部对 find_point 使用多线程加速；传入 post_ids 时不调用 find_point，需定位的 pid 追加到 post_ids，
+    tid_positions 中只有行中已带楼层的回复
     """
     valid_post_ids = []
+    known_positions = defaultdict(list)
     should_stop = False
 
     # === 第一阶段：拉取 pages，收集有效 post_id ===
-    with ThreadPoolExecutor(max_workers=max_workers_reply) as executor:
-        futures = {
-            executor.submit(api.get_user_replies, uid, p): p
-            for p in range(page_start, page_end + 1)
-        }
-        page_results = {}
-        for future in as_completed(futures):
-            try:
-                resp = future.result()
-                page_results[future] = resp.get('rows', [])
-            except Exception as e:
-                print(f"[Reply] Page error: {e}")
-                page_results[future] = []
+    page_results = {}
+    failed = {}
+    with stats.stage('reply_list'):
+        for page, rows, error in run_units('reply_list', range(page_start, page_end + 1), uid):
+            if error:
+                print(f"[Reply] Page {page} error: {error}")
+                failed[page] = error
+            else:
+                page_results[page] = rows
 
+    record_page_failures('reply_page', failed, page_end, not page_results)
+    if not page_results:
+        should_stop = True
     for rows in page_results.values():
         if not rows:
             should_stop = True
@@ -84,61 +180,133 @@ def fetch_valid_reply_positions_in_pages(uid: int, page_start: int, page_end: in
                 should_stop = True
                 break
             else:
-                valid_post_ids.append(reply['post_id'])
+                listed_rows.append((False, reply))
+                if reply.get('thread_id') and reply.get('subject') is not None:
+                    thread_metas.setdefault(reply['thread_id'], {}).setdefault('subject', reply['subject'])
+                # 行中已带楼层时无需 find_point
+                if reply.get('thread_id') and reply.get('position'):
+                    known_positions[reply['thread_id']].append(reply['position'])
+                    if post := planner.listed_post(reply):
+                        listed_posts.setdefault(reply['thread_id'], {})[reply['position']] = post
+                else:
+                    valid_post_ids.append(reply['post_id'])
+    global_info['find_point_skipped'] = global_info.get('find_point_skipped', 0) + \
+        sum(len(positions) for positions in known_positions.values())
 
     # === 第二阶段：并发调用 find_point 获取 (tid, pos) ===
+    if post_ids is not None:
+        post_ids.extend(valid_post_ids)
+        valid_post_ids = []
+    tid_positions = find_positions(uid, valid_post_ids, page_end)
+    for tid, positions in known_positions.items():
+        tid_positions.setdefault(tid, []).extend(positions)
+    return tid_positions, should_stop
+
+
+def find_positions(uid: int, post_ids: List[int], pages: int = None) -> Dict[int, List[int]]:
+    """
+    并发调用 find_point，返回 {tid: [position, ...]}，失败的 pid 记入 failures
+    """
     tid_positions = defaultdict(list)
+    global_info['find_point_total'] = global_info.get('find_point_total', 0) + len(post_ids)
 
-    if valid_post_ids:
-        with ThreadPoolExecutor(max_workers=max_workers_position) as executor:  # 可更高，视 API 限流而定
-            future_to_pid = {
-                executor.submit(api.find_point, pid): pid
-                for pid in valid_post_ids
-            }
-            for future in as_completed(future_to_pid):
-                try:
-                    tid, pos = future.result()
-                    if tid and pos:  # 防御性检查
-                        tid_positions[tid].append(pos)
-                except Exception as e:
-                    pid = future_to_pid[future]
-                    print(f"[find_point] post_id={pid} failed: {e}")
-                    # 可选：记录失败或跳过
-
-    return dict(tid_positions), should_stop
-
-
-def get_user_thread_position_dict(uid) -> dict[int, list[int]]:
-    result = defaultdict(list)
-    BATCH_SIZE = 10
+    if post_ids:
+        with stats.stage('find_point'):
+            for done, (pid, point, error) in enumerate(run_units('find_point', post_ids, uid), start=1):
+                report_progress(uid, 'find_point', force=done == len(post_ids), done=done,
+                                total=len(post_ids), pages=pages)
+                if error:
+                    print(f"[find_point] post_id={pid} failed: {error}")
+                    failures.append(('find_point', pid, None, error))
+                    continue
+                tid, pos = point
+                if tid and pos:  # 防御性检查
+                    tid_positions[tid].append(pos)
 
-    # --- Threads: position = 1 ---
-    page = 1
+    return dict(tid_positions)
+
+
+LIST_BATCH_SIZE = 10
+
+
+def list_batch_size() -> int:
+    """每批获取的列表页数，拆分时每个子进程一批"""
+    return LIST_BATCH_SIZE * (split_pool.processes if split_pool else 1)
+
+
+def crawl_thread_list(uid: int, result: dict[int, list[int]], page: int = 1, last_page: int = None) -> int:
+    """
+    从 page 开始按批获取主题列表，直到遇到空页或早于目标年份的主题，tid 写入 result
+    指定 last_page 时只获取到该页（用于重试单个失败页）
+
+    返回: 终止页
+    """
     while True:
-        end_page = page + BATCH_SIZE - 1
-        tids, stop = fetch_valid_thread_tids_in_pages(uid, page, end_page)
+        end_page = last_page or page + list_batch_size() - 1
+        with stats.stage('thread_list'):
+            tids, stop = fetch_valid_thread_tids_in_pages(uid, page, end_page)
         for tid in tids:
             result[tid].append(1)
-        if stop:
-            global_info['thread_end_page'] = end_page
-            break
+        report_progress(uid, 'thread_list', force=stop, pages=end_page, tid_count=len(result))
+        if stop or last_page:
+            return end_page
         page = end_page + 1
 
-    # --- Replies: 并发获取 position ---
-    page = 1
+
+def crawl_reply_list(uid: int, result: dict[int, list[int]], page: int = 1, last_page: int = None,
+                     post_ids: List[int] = None) -> int:
+    """
+    从 page 开始按批获取回复列表并定位，(tid, position) 写入 result，参数同 crawl_thread_list
+    传入 post_ids 时推迟定位，需 find_point 的 pid 追加到 post_ids（见 fetch_valid_reply_positions_in_pages）
+
+    返回: 终止页
+    """
     while True:
-        end_page = page + BATCH_SIZE - 1
-        tid_pos_dict, stop = fetch_valid_reply_positions_in_pages(uid, page, end_page)
+        end_page = last_page or page + list_batch_size() - 1
+        tid_pos_dict, stop = fetch_valid_reply_positions_in_pages(uid, page, end_page, post_ids)
         for tid, positions in tid_pos_dict.items():
             result[tid].extend(positions)
-        if stop:
-            global_info['reply_end_page'] = end_page
-            break
+        report_progress(uid, 'reply_list', force=stop, pages=end_page, tid_count=len(result))
+        if stop or last_page:
+            return end_page
         page = end_page + 1
 
+
+def get_user_thread_position_dict(uid, on_listed=None) -> dict[int, list[int]]:
+    """
+    :param on_listed: 主题列表与回复列表读取完毕、调用 find_point 之前调用（用于写入预览报告）
+    """
+    result = defaultdict(list)
+
+    # --- Threads: position = 1 ---
+    global_info['thread_end_page'] = crawl_thread_list(uid, result)
+
+    # --- Replies: 先读完列表，再并发获取 position ---
+    post_ids = []
+    global_info['reply_end_page'] = crawl_reply_list(uid, result, post_ids=post_ids)
+    if on_listed:
+        on_listed()
+    for tid, positions in find_positions(uid, post_ids, global_info['reply_end_page']).items():
+        result[tid].extend(positions)
+
     return dict(result)
 
 
+def write_preview(uid: int, user_info: dict, task: dict, years: list[int]):
+    """由列表行生成预览报告（见 preview.py），失败不影响任务"""
+    if not preview.ENABLED:
+        return
+    try:
+        with stats.stage('preview'):
+            report = preview.build(uid, user_info, listed_rows, task, preview.primary_year(years))
+            preview.write(uid, report)
+    except Exception as e:
+        print(f'[{time.asctime()}] 写入预览报告失败: {e}')
+        return
+    print(f'[{time.asctime()}] 已写入预览报告: {report["summary"]["all"]} 条帖子')
+    notify.send('preview', uid)
+
+
 # def get_user_thread_position_dict_old(uid) -> dict[int, list[int]]:
 #     """
 #     获取指定uid在本年的主题帖tid列表
@@ -224,87 +392,320 @@ def get_user_thread_position_dict(uid) -> dict[int, list[int]]:
 #     return result
 
 
-def fetch_all_posts_parallel(tid_page_position_dict: Dict[int, Dict[int, List[int]]]) -> List[dict]:
+def fetch_all_posts_parallel(uid: int, tid_page_position_dict: Dict[int, Dict[int, List[int]]]) -> List[dict]:
     """
-    并发拉取所有需要的帖子内容，每个 (tid, page) 作为独立任务。
+    按 planner.plan 的请求计划并发拉取所有需要的帖子内容，每个 (tid, page) 作为独立任务。
+    主题信息每个 tid 至多请求一次，全部页返回后再注入到帖子中。
     """
-    # 扁平化任务
-    tasks: List[Tuple[int, int, List[int]]] = []
-    for tid, page_pos in tid_page_position_dict.items():
-        for page, positions in page_pos.items():
-            tasks.append((tid, page, positions))
-
-    all_posts = []
+    tasks = planner.plan(tid_page_position_dict, thread_metas,
+                         {tid: posts.keys() for tid, posts in listed_posts.items()})
+    plan_info['posts'] = plan_info.get('posts', 0) + len(tasks)
+    plan_info['thread_details'] = plan_info.get('thread_details', 0) + sum(1 for task in tasks if task[3])
+
+    pages = []  # [(tid, page, posts, main_post_id), ...]
+    failed_pages = set()
+    failed_details = set()
+
+    for done, ((tid, page, _, details), result, error) in enumerate(run_units('posts', tasks, uid), start=1):
+        report_progress(uid, 'posts', force=done == len(tasks), done=done, total=len(tasks))
+        if error:
+            print(f"[ERROR] Failed to fetch tid={tid}, page={page}: {error}")
+            failures.append(('posts', f'{tid}:{page}', {'positions': tid_page_position_dict[tid][page]}, error))
+            failed_pages.add((tid, page))
+            if details:
+                failed_details.add(tid)
+            continue
+        posts, main_post_id, thread_info = result
+        if details:
+            thread_metas.setdefault(tid, {}).update(planner.thread_meta(thread_info))
+        pages.append((tid, page, posts, main_post_id))
 
-    with ThreadPoolExecutor(max_workers=max_workers_posts) as executor:
-        # 提交所有任务
-        future_to_task = {
-            executor.submit(_fetch_tid_page_posts, tid, page, positions): (tid, page)
-            for (tid, page, positions) in tasks
-        }
+    # 主题信息未取到的主题，其余页（包括已在手的楼层）一并留待重试，以免写入缺少标题与楼主的帖子
+    for tid in failed_details:
+        for page, positions in tid_page_position_dict[tid].items():
+            if (tid, page) not in failed_pages:
+                failures.append(('posts', f'{tid}:{page}', {'positions': positions}, 'thread_details failed'))
 
-        # 收集结果
-        for future in as_completed(future_to_task):
-            tid, page = future_to_task[future]
-            try:
-                posts = future.result()
-                all_posts.extend(posts)
-            except Exception as e:
-                print(f"[ERROR] Failed to fetch tid={tid}, page={page}: {e}")
+    all_posts = []
+    for tid, page, posts, main_post_id in pages:
+        if tid not in failed_details:
+            all_posts.extend(planner.fill(posts, main_post_id, thread_metas.get(tid, {})))
+    for tid, page_positions in tid_page_position_dict.items():
+        listed = listed_posts.get(tid, {})
+        if listed and tid not in failed_details:
+            posts = [listed[p] for positions in page_positions.values() for p in positions if p in listed]
+            all_posts.extend(planner.fill(posts, None, thread_metas.get(tid, {})))
 
     return all_posts
 
 
-def _fetch_tid_page_posts(tid: int, page: int, positions: List[int]) -> List[dict]:
+def _fetch_tid_page_posts(tid: int, page: int, positions: List[int], details: bool) -> tuple[list[dict], int | None, dict]:
     """
-    拉取指定 tid 的某一页，并筛选出 positions 中的帖子，注入必要字段。
+    拉取指定 tid 的某一页，筛选出 positions 中的帖子
+
+    返回: (帖子, 本页主帖的 post_id, 主题信息)，主题信息只在 details 为 True 时请求
     """
-    # 关键：thread_details=1 → 任意页都能拿到 thread 信息！
-    resp = api.get_thread_reply_page(tid, page=page, thread_details=1)
+    resp = api.get_thread_reply_page(tid, page=page, thread_details=int(details))
 
     thread_info = resp.get('thread', {})
     rows = resp.get('rows', [])
 
-    # 找到主帖（position=1）的 post_id 和 author
+    # 找到主帖（position=1）的 post_id
     main_post_id = None
     for post in rows:
         if post.get('position') == 1:
             main_post_id = post['post_id']
             break
 
-    main_author = thread_info.get('author')
-    subject = thread_info.get('subject', '')
+    # 复制以避免副作用
+    result = [post.copy() for post in rows if post.get('position') in positions]
+    return result, main_post_id, thread_info
 
-    result = []
-    for post in rows:
-        pos = post.get('position')
-        if pos not in positions:
-            continue
 
-        post = post.copy()  # 避免副作用
+def retry_failures(uid: int, db_conn) -> int:
+    """
+    只重试 failures 表中记录的单元：列表页、待定位的 pid、帖子页
+    成功的记录删除，仍失败的累加尝试次数
 
-        if pos == 1:
-            # 主帖：注入统计信息
-            post['views'] = thread_info.get('views')
-            post['replies'] = thread_info.get('replies')
-            post['favorite'] = thread_info.get('favorite_times')  # 如果 API 不返回，就是 None
-        else:
-            # 回复：注入引用信息
-            _ = util.get_reply_pid_and_username(post)
-            post['reply_pid'], post['reply_user'] = (
-                (main_post_id, main_author) if _ is None else _
-            )
-            post['subject'] = subject
+    返回: 获取到的帖子数
+    """
+    global failures
+    previous = db.get_failures(db_conn)
+    if not previous:
+        return 0
+    print(f'[{time.asctime()}] 重试失败单元: {len(previous)}')
+    failures = []
+    tid_positions = defaultdict(list)
+    post_ids = []
+    tid_page_position_dict = defaultdict(dict)
+    for item in previous:
+        kind, key, detail = item['kind'], item['key'], item['detail'] or {}
+        match kind:
+            case 'thread_page' | 'reply_page':
+                crawl = crawl_thread_list if kind == 'thread_page' else crawl_reply_list
+                page = int(key)
+                crawl(uid, tid_positions, page, None if detail.get('resume') else page)
+            case 'find_point':
+                post_ids.append(int(key))
+            case 'posts':
+                tid, page = map(int, key.split(':'))
+                tid_page_position_dict[tid][page] = detail['positions']
+    for tid, positions in find_positions(uid, post_ids).items():
+        tid_positions[tid].extend(positions)
+    for tid, page_pos in util.set_page(tid_positions).items():
+        for page, positions in page_pos.items():
+            merged = set(tid_page_position_dict[tid].get(page, [])) | set(positions)
+            tid_page_position_dict[tid][page] = sorted(merged)
+    with stats.stage('posts'):
+        posts = fetch_all_posts_parallel(uid, dict(tid_page_position_dict))
+    with stats.stage('db_insert'):
+        db.insert_posts(db_conn, posts)
+    still_failed = {(kind, str(key)) for kind, key, _, _ in failures}
+    db.delete_failures(db_conn, [(i['kind'], i['key']) for i in previous if (i['kind'], i['key']) not in still_failed])
+    db.insert_failures(db_conn, failures)
+    print(f'[{time.asctime()}] 重试获取帖子数: {len(posts)}，仍失败: {len(still_failed)}')
+    return len(posts)
+
+
+def request_plan(stages: dict) -> dict:
+    """
+    本任务计划的请求数与实际请求数（实际请求数含 WebAPI 的重试）
 
-        result.append(post)
+    列表页数在遍历前未知，按实际遍历的页数计入计划
+    """
+    listing = sum(stages.get(name, {}).get('requests', 0) for name in ('profile', 'thread_list', 'reply_list'))
+    find_point = stages.get('find_point', {}).get('requests', 0)
+    expected = {
+        'listing': listing,
+        'find_point': global_info.get('find_point_total', 0),
+        'find_point_skipped': global_info.get('find_point_skipped', 0),
+        'posts': plan_info.get('posts', 0),
+        'thread_details': plan_info.get('thread_details', 0),
+        'listed_posts': sum(len(posts) for posts in listed_posts.values()),
+    }
+    return {
+        'expected': listing + expected['find_point'] + expected['posts'],
+        'actual': task_requests(),
+        'detail': expected | {'find_point_actual': find_point,
+                              'posts_actual': stages.get('posts', {}).get('requests', 0)}
+    }
+
+
+def estimate_task_cost(uid: int, task: dict) -> int:
+    """估计一个任务的请求数（见 scheduler.estimate_cost），之前获取过的用户使用上次的实际请求数"""
+    previous = {}
+    if os.path.exists(f'data/user/{uid}/task.json'):
+        with open(f'data/user/{uid}/task.json', 'r', encoding='utf-8') as fp:
+            previous = json.load(fp)
+    if task.get('retry'):
+        return 1 + sum((previous.get('failures') or {}).values()) * 2
+    return scheduler.estimate_cost(api.get_user_info(uid, True), previous)
+
+
+def estimate_queue():
+    """
+    为队列中尚未估计开销的任务获取用户信息并估计请求数，写回队列文件（保持修改时间不变），见 scheduler.py
+    """
+    if queue_policy == 'fifo' or cassette_mode:
+        return
+    pending = {}
+    for f in os.scandir('data/queue'):
+        if f.name.isdigit() and util.get_queue_cost(f.path) is None:
+            try:
+                with open(f.path, 'r', encoding='utf-8') as fp:
+                    pending[int(f.name)] = (json.load(fp), f.stat().st_mtime)
+            except (OSError, ValueError):
+                continue
+    if not pending:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers_thread) as executor:
+        futures = {executor.submit(estimate_task_cost, uid, task): uid for uid, (task, _) in pending.items()}
+        for future in as_completed(futures):
+            uid = futures[future]
+            try:
+                cost = future.result()
+            except Exception as e:
+                print(f'[{time.asctime()}] 估计开销失败 uid: {uid}: {e}')
+                continue
+            task, mtime = pending[uid]
+            path = f'data/queue/{uid}'
+            if not os.path.exists(path):
+                continue
+            task['cost'] = cost
+            util.write_atomic(path, json.dumps(task, ensure_ascii=False, separators=(',', ':')).encode())
+            os.utime(path, (mtime, mtime))
+            notify.send('estimate', uid, cost=cost)
 
-    return result
+
+def process_task(task: dict, report: bool = True):
+    """
+    获取一个用户的数据并生成报告
+
+    task 带有 retry=1 时不重新获取，只重试上次失败的单元后重新生成报告
+    :param report: 为 False 时只获取数据、写入 task.json，不生成报告（remote_worker.py 将数据上传给协调端生成）
+    """
+    # 整个任务期间持有用户锁，compact.py 不会归档正在使用的 post.db
+    with util.user_lock(task['uid']):
+        run_task(task, report)
+
+
+def run_task(task: dict, report: bool):
+    """process_task 持有用户锁时执行"""
+    global stats, failures, task_request_start, split_pool
+    uid = task['uid']
+    print(f'[{time.asctime()}] 开始处理uid: {uid}')
+    if task.get('cost') is None and split.PROCESSES > 1 and not task.get('retry') and not cassette_mode:
+        # fifo 时队列中的任务没有估计开销（estimate_queue 不运行），在此估计以决定是否拆分（不计入本任务的请求数）
+        try:
+            task['cost'] = estimate_task_cost(uid, task)
+        except Exception as e:
+            print(f'[{time.asctime()}] 估计开销失败 uid: {uid}: {e}')
+    task_request_start = api.request_count
+    notify.send('start', uid, cost=task.get('cost'))
+    retry = bool(task.get('retry'))
+    if retry and os.path.exists(f'data/user/{uid}/task.json'):
+        with open(f'data/user/{uid}/task.json', 'r', encoding='utf-8') as f:
+            task = json.load(f) | task
+    task.pop('retry', None)
+    # 预计开销大的用户拆分到多个进程获取（见 split.py），录制/回放时不拆分
+    split_pool = None if cassette_mode else split.SplitPool.for_task(task)
+    if split_pool:
+        print(f'[{time.asctime()}] 拆分到 {split_pool.processes} 个进程')
+    # years：[起始年, 结束年]，一次获取多年的帖子，generate_report.py 为每年生成一份报告
+    years = task.get('years') or [target_year, target_year]
+    set_time_range(*years)
+    if years[0] != years[1]:
+        print(f'[{time.asctime()}] 获取年份: {years[0]}-{years[1]}')
+    task['get_data_start'] = int(time.time())
+    if 'create_time' in task:
+        task['queue_wait'] = max(task['get_data_start'] - task['create_time'], 0)
+        QUEUE_WAIT.observe(task['queue_wait'])
+    global_info.clear()
+    thread_metas.clear()
+    listed_posts.clear()
+    listed_rows.clear()
+    plan_info.clear()
+    progress_state.clear()
+    failures = []
+    stats = profiler.TaskStats(api, *([split_pool] if split_pool else []))
+    task_profiler = profiler.TaskProfiler(uid) if profiler.profiling_enabled(task) else None
+    db_conn = db.get_conn(uid)
+    recorder = None
+    if cassette_mode:
+        recorder = cassette.install(api, f'data/user/{uid}/cassette.jsonl.gz', cassette_mode,
+                                    {'uid': uid, 'year': target_year, 'years': years},
+                                    float(os.environ.get('QSHP_REPLAY_SPEED', 1)))
+    if task_profiler:
+        task_profiler.start()
+    try:
+        db.init_db(db_conn)
+        post_count = 0
+        if not retry:
+            with stats.stage('profile'):
+                user_info = api.get_user_info(uid, True)
+            db.insert_user_info(db_conn, uid, json.dumps(user_info, ensure_ascii=False, separators=(',', ':')))
+            tid_position_dict = get_user_thread_position_dict(
+                uid, lambda: write_preview(uid, user_info, task, years))
+            tid_count = len(tid_position_dict)
+            print(f'[{time.asctime()}] 获取到相关tid数: {tid_count}')
+            global_info['tid_count'] = tid_count
+            report_progress(uid, 'tid_count', force=True, tid_count=tid_count)
+            tid_page_position_dict = util.set_page(tid_position_dict)
+            with stats.stage('posts'):
+                all_posts = fetch_all_posts_parallel(uid, tid_page_position_dict)
+            with stats.stage('db_insert'):
+                db.insert_posts(db_conn, all_posts)
+            db.insert_failures(db_conn, failures)
+            post_count = len(all_posts)
+        for attempt in range(max(retry_passes, 1) if retry else retry_passes):
+            if not db.count_failures(db_conn):
+                break
+            if not retry or attempt:
+                time.sleep(retry_delay)
+            post_count += retry_failures(uid, db_conn)
+        remaining = db.count_failures(db_conn)
+    finally:
+        if task_profiler:
+            task_profiler.stop()
+        if recorder:
+            recorder.close()
+        if split_pool:
+            split_pool.close()
+        db_conn.close()
+    task['get_data_stop'] = int(time.time())
+    task['stages'] = stats.result()
+    task['plan'] = request_plan(task['stages'])
+    print(f'[{time.asctime()}] 请求数: 计划 {task["plan"]["expected"]}，实际 {task["plan"]["actual"]}')
+    # 是否所有单元都已成功获取；否则可用 add_task.py --retry 只重试失败的部分
+    task['complete'] = not remaining
+    task['failures'] = remaining
+    if remaining:
+        print(f'[{time.asctime()}] 仍有失败单元: {remaining}')
+    POSTS.inc(post_count)
+    TASK_SECONDS.observe(task['get_data_stop'] - task['get_data_start'])
+    task |= global_info
+    print(f'[{time.asctime()}] 完成uid: {uid}')
+    util.save_task_metadata(uid, task)
+    notify.send('data_done', uid, posts=post_count)
+    if not report:
+        return
+    notify.send('report_start', uid)
+    env = os.environ | ({'QSHP_PROFILE': '1'} if task_profiler else {})
+    with REPORT_SECONDS.time():
+        result = subprocess.run(['python3', 'generate_report.py', str(uid)], env=env)
+    if result.returncode:
+        util.mark_report_failed(uid, task, result.returncode)
+        return
+    TASKS.inc()
+    print(f'[{time.asctime()}] \033[32;1m报告生成完成: {uid}\033[m')
 
 
 def main():
     need_restart = False
     while True:
-        task = util.get_next_task()
+        estimate_queue()
+        task = util.get_next_task(queue_policy, queue_request_seconds)
         if task is None:
             print(f'[{time.asctime()}] 无事', end='\r')
             need_restart = True
@@ -317,39 +718,70 @@ def main():
             os.utime(filename, (1, 1))
             print(f"[{time.asctime()}] Restarting...")
             os.execv(sys.executable, [sys.executable] + sys.argv)
-        uid = task['uid']
-        print(f'[{time.asctime()}] 开始处理uid: {uid}')
-        task['get_data_start'] = int(time.time())
-        db_conn = db.get_conn(uid)
-        db.init_db(db_conn)
-        user_info = api.get_user_info(uid, True)
-        db.insert_user_info(db_conn, uid, json.dumps(user_info, ensure_ascii=False, separators=(',', ':')))
-        tid_position_dict = get_user_thread_position_dict(uid)
-        tid_count = len(tid_position_dict)
-        print(f'[{time.asctime()}] 获取到相关tid数: {tid_count}')
-        global_info['tid_count'] = tid_count
-        tid_page_position_dict = util.set_page(tid_position_dict)
-        all_posts = fetch_all_posts_parallel(tid_page_position_dict)
-        db.insert_posts(db_conn, all_posts)
-        db_conn.close()
-        task['get_data_stop'] = int(time.time())
-        task |= global_info
-        print(f'[{time.asctime()}] 完成uid: {uid}')
-        util.save_task_metadata(uid, task)
-        os.system(f'python3 generate_report.py {uid}')
-        print(f'[{time.asctime()}] \033[32;1m报告生成完成: {uid}\033[m')
+        process_task(task)
 
 
-if __name__ == '__main__':
-    max_workers_thread = 10
-    max_workers_reply = 10
-    max_workers_position = 10
-    max_workers_posts = 10
+def init(login: bool = True, worker: tuple[int, int] = None):
+    """
+    初始化模块级配置与 API 实例
+
+    main.py 直接运行时调用；其他脚本（基准测试、回放等）import main 后也可调用，再使用 process_task
+    :param worker: (i, n)，作为 split.py 的第 i 个子进程（共 n 个）时传入，配置了 accounts 时只使用 accounts[i::n]
+    """
+    global max_workers_thread, max_workers_reply, max_workers_position, max_workers_posts
+    global target_year, api, global_info, stats, cassette_mode
+    global retry_passes, retry_delay, failures, queue_policy, queue_request_seconds, task_request_start
+    global thread_metas, listed_posts, listed_rows, plan_info, progress_state, split_pool
+    max_workers_thread = getattr(config, 'max_workers_thread', 10)
+    max_workers_reply = getattr(config, 'max_workers_reply', 10)
+    max_workers_position = getattr(config, 'max_workers_position', 10)
+    max_workers_posts = getattr(config, 'max_workers_posts', 10)
+    # 获取完成后自动重试失败单元的轮数与每轮之前等待的秒数
+    retry_passes = getattr(config, 'retry_passes', 1)
+    retry_delay = getattr(config, 'retry_delay', 5)
+    # 队列调度策略（hrrn 或 fifo）与换算预计耗时用的平均请求耗时，见 scheduler.py
+    queue_policy = getattr(config, 'queue_policy', 'hrrn')
+    queue_request_seconds = getattr(config, 'queue_request_seconds', 0.02)
     target_year = config.year
-    tz_utc8 = datetime.timezone(datetime.timedelta(hours=8))
-    start_time = int(datetime.datetime(target_year, 12, 31, 23, 59, 59, tzinfo=tz_utc8).timestamp())
-    stop_time = int(datetime.datetime(target_year, 1, 1, 0, 0, 0, tzinfo=tz_utc8).timestamp())
-    api: WebAPI.WebAPI = WebAPI.WebAPI(config.username, config.password)
+    set_time_range(target_year, target_year)
+    # record：录制每个任务的请求到 data/user/{uid}/cassette.jsonl.gz；replay：从该文件回放，不访问网络
+    cassette_mode = os.environ.get('QSHP_CASSETTE')
+    if cassette_mode == 'replay':
+        login = False
+    # accounts：多个爬虫账号 [(用户名, 密码), ...]，请求分散到各账号，见 WebAPI.AccountPool
+    accounts = getattr(config, 'accounts', None)
+    if accounts and worker and len(accounts) >= worker[1]:
+        accounts = accounts[worker[0]::worker[1]]
+    if accounts:
+        api = WebAPI.AccountPool(accounts, getattr(config, 'account_rate', 0), getattr(config, 'account_cooldown', 60),
+                                 autoLogin=login, pre=getattr(config, 'forum_url', None))
+    else:
+        api = WebAPI.WebAPI(config.username, config.password, autoLogin=login, pre=getattr(config, 'forum_url', None))
+    if cassette_mode == 'replay':
+        # 回放时不需要登录，避免自动重新登录访问网络
+        for client in getattr(api, 'clients', [api]):
+            client.lastLogin = client.lastUpdateAuth = float('inf')
     util.init_folder()
+    for stage, value in (('thread', max_workers_thread), ('reply', max_workers_reply),
+                         ('position', max_workers_position), ('posts', max_workers_posts)):
+        MAX_WORKERS.set(value, stage=stage)
     global_info = {}
+    stats = profiler.TaskStats()
+    # 获取失败的单元 [(kind, key, detail, error), ...]，任务结束时写入 failures 表
+    failures = []
+    task_request_start = 0
+    # 列表阶段得到的主题信息 {tid: {...}}、已带全部字段的帖子 {tid: {position: post}} 与请求计划的统计，见 planner.py
+    thread_metas = {}
+    listed_posts = {}
+    plan_info = {}
+    # 列表阶段得到的目标时间范围内的行 [(是否为主题列表的行, 行), ...]，用于预览报告
+    listed_rows = []
+    progress_state = {}
+    # 本任务的拆分进程池，不拆分时为 None
+    split_pool = None
+
+
+if __name__ == '__main__':
+    init()
+    metrics.serve(getattr(config, 'metrics_port', 9597))
     main()
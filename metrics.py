@@ -0,0 +1,179 @@
+"""
+Prometheus 文本格式的简易指标库，只依赖标准库
+
+用法：
+    REQUESTS = metrics.Counter('qshp_api_requests_total', 'API 请求数', ('endpoint',))
+    REQUESTS.inc(endpoint='post/find')
+    metrics.serve(9597)  # http://127.0.0.1:9597/metrics
+"""
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: dict = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(k, '') for k in self.labels)
+
+    def _header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+    def render(self) -> list[str]:
+        with _lock:
+            items = list(self.values.items())
+        return self._header() + [f'{self.name}{_format_labels(self.labels, k)} {v}' for k, v in items]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), func=None):
+        """
+        :param func: 可选，无标签时在每次抓取时调用以获取当前值，例如队列长度
+        """
+        super().__init__(name, documentation, labels)
+        self.func = func
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> list[str]:
+        if self.func is not None:
+            try:
+                self.set(self.func())
+            except Exception as e:
+                print(f'[metrics] {self.name} 取值失败: {e}')
+        return super().render()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+    default_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 60)
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = None):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets or self.default_buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            # [各桶计数..., 总和, 总数]
+            state = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels):
+        """计时上下文管理器，例如 with HIST.time(endpoint='x'): ..."""
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        with _lock:
+            items = [(k, list(v)) for k, v in self.values.items()]
+        lines = self._header()
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, {"le": bound})} {count}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, {"le": "+Inf"})} {state[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {state[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {state[-1]}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def render() -> str:
+    """返回所有已注册指标的 Prometheus 文本格式"""
+    with _lock:
+        registry = list(_registry)
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer | None:
+    """
+    在后台线程中以 http://host:port/metrics 提供指标
+
+    :return:
+        服务器对象，端口被占用时返回 None（不影响主程序）
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f'[metrics] 无法监听 {host}:{port}: {e}')
+        return None
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
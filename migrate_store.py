@@ -0,0 +1,177 @@
+"""
+在两种存储后端之间迁移帖子数据，并比较磁盘占用与报告查询延迟
+
+    python migrate_store.py to-shared [--remove]      将 data/user/{uid}/post.db 导入共享分片
+    python migrate_store.py to-user [--remove]        将共享分片中的数据导出为每个用户一个 post.db
+    python migrate_store.py compare --sample 50      对同时存在于两种后端的用户比较磁盘占用与 build_report 耗时
+
+分片数取 config.py 中的 post_store_shards（默认 4），可用 --shards 覆盖；迁移完成后在 config.py 中设置 post_store 切换后端。
+--remove 在每个用户导入成功后删除源数据；共享分片删除行后不会自动缩小，需要时执行 VACUUM。
+"""
+import os
+import json
+import time
+import random
+import argparse
+import sqlite3
+import statistics
+import config
+import db
+
+POST_COLUMNS = ', '.join(db.POST_COLUMNS)
+FAILURE_COLUMNS = ', '.join(db.FAILURE_COLUMNS)
+
+
+def user_db_uids(user_dir: str = 'data/user') -> list[int]:
+    """拥有 post.db（或其归档 post.db.gz）的用户"""
+    if not os.path.isdir(user_dir):
+        return []
+    return sorted(int(e.name) for e in os.scandir(user_dir)
+                  if e.name.isdigit() and (os.path.exists(os.path.join(e.path, 'post.db'))
+                                           or os.path.exists(os.path.join(e.path, 'post.db.gz'))))
+
+
+def store_uids(shards: int) -> list[int]:
+    """共享分片中有数据的用户"""
+    uids = set()
+    for n in range(shards):
+        path = f'{db.STORE_DIR}/posts_{n}.db'
+        if os.path.exists(path):
+            conn = sqlite3.connect(path)
+            db.init_store(conn)
+            rows = conn.execute('SELECT uid FROM store_user_info UNION SELECT uid FROM store_posts')
+            uids.update(uid for uid, in rows)
+            conn.close()
+    return sorted(uids)
+
+
+def has_table(conn, schema: str, name: str) -> bool:
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                        (name,)).fetchone() is not None
+
+
+def to_shared(uid: int, shards: int, remove: bool = False) -> int:
+    """导入一个用户，返回帖子数"""
+    src = f'data/user/{uid}/post.db'
+    db.restore_archive(uid)
+    conn = db.get_store_conn(uid, shards)
+    conn.execute('ATTACH DATABASE ? AS src', (src,))
+    try:
+        with conn:
+            conn.execute('DELETE FROM main.store_posts WHERE uid = ?', (uid,))
+            conn.execute('DELETE FROM main.store_failures WHERE uid = ?', (uid,))
+            conn.execute(f'INSERT INTO main.store_posts (uid, {POST_COLUMNS}) SELECT ?, {POST_COLUMNS} FROM src.posts',
+                         (uid,))
+            count = conn.execute('SELECT changes()').fetchone()[0]
+            if has_table(conn, 'src', 'user_info'):
+                conn.execute('INSERT OR REPLACE INTO main.store_user_info (uid, info) '
+                             'SELECT uid, info FROM src.user_info WHERE uid = ?', (uid,))
+            if has_table(conn, 'src', 'failures'):
+                conn.execute(f'INSERT INTO main.store_failures (uid, {FAILURE_COLUMNS}) '
+                             f'SELECT ?, {FAILURE_COLUMNS} FROM src.failures', (uid,))
+    finally:
+        conn.execute('DETACH DATABASE src')
+        conn.close()
+    if remove:
+        os.remove(src)
+    return count
+
+
+def to_user(uid: int, shards: int, remove: bool = False) -> int:
+    """导出一个用户，返回帖子数"""
+    conn = db.get_user_conn(uid)
+    db.init_db(conn)
+    conn.execute('ATTACH DATABASE ? AS store', (db.shard_path(uid, shards),))
+    try:
+        with conn:
+            conn.execute('DELETE FROM posts')
+            conn.execute('DELETE FROM failures')
+            conn.execute(f'INSERT INTO posts ({POST_COLUMNS}) SELECT {POST_COLUMNS} FROM store.store_posts '
+                         f'WHERE uid = ?', (uid,))
+            count = conn.execute('SELECT changes()').fetchone()[0]
+            conn.execute('INSERT OR REPLACE INTO user_info (uid, info) '
+                         'SELECT uid, info FROM store.store_user_info WHERE uid = ?', (uid,))
+            conn.execute(f'INSERT INTO failures ({FAILURE_COLUMNS}) SELECT {FAILURE_COLUMNS} '
+                         f'FROM store.store_failures WHERE uid = ?', (uid,))
+            if remove:
+                for table in ('store_posts', 'store_user_info', 'store_failures'):
+                    conn.execute(f'DELETE FROM store.{table} WHERE uid = ?', (uid,))
+        # 直接写入了 posts，全文索引需重建
+        db.rebuild_fts(conn)
+    finally:
+        conn.execute('DETACH DATABASE store')
+        conn.close()
+    return count
+
+
+def file_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def timed_report(conn, uid: int, year: int) -> float:
+    import generate_report
+    start = time.perf_counter()
+    generate_report.build_report(conn, uid, year)
+    return time.perf_counter() - start
+
+
+def summarize(values: list[float]) -> dict:
+    values = sorted(values)
+    return {
+        'median_ms': round(statistics.median(values) * 1000, 2),
+        'p95_ms': round(values[min(int(len(values) * 0.95), len(values) - 1)] * 1000, 2),
+        'total_s': round(sum(values), 3)
+    }
+
+
+def compare(shards: int, sample: int, year: int, seed: int = 0) -> dict:
+    """对两种后端中都存在的用户比较磁盘占用，并在其中抽样比较打开连接与 build_report 的耗时"""
+    both = sorted(set(user_db_uids()) & set(store_uids(shards)))
+    if not both:
+        raise SystemExit('没有同时存在于两种后端的用户，请先执行 to-shared（不加 --remove）')
+    user_bytes = sum(file_size(f'data/user/{uid}/post.db') for uid in both)
+    store_bytes = sum(file_size(f'{db.STORE_DIR}/posts_{n}.db') for n in range(shards))
+    uids = random.Random(seed).sample(both, min(sample, len(both)))
+    timings = {'user': [], 'shared': []}
+    # 交替执行，减少页缓存预热对某一方的偏向
+    for uid in uids:
+        for backend, connect in (('user', db.get_user_conn), ('shared', lambda u: db.get_store_conn(u, shards))):
+            start = time.perf_counter()
+            conn = connect(uid)
+            elapsed = time.perf_counter() - start
+            timings[backend].append(elapsed + timed_report(conn, uid, year))
+            conn.close()
+    return {
+        'users': len(both),
+        'sampled': len(uids),
+        'disk': {
+            'user_bytes': user_bytes,
+            'user_files': len(both),
+            'shared_bytes': store_bytes,
+            'shared_files': shards,
+        },
+        'report_latency': {backend: summarize(values) for backend, values in timings.items()}
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='在每用户 post.db 与共享分片之间迁移，并比较两者')
+    parser.add_argument('command', choices=('to-shared', 'to-user', 'compare'))
+    parser.add_argument('--shards', type=int, default=db.STORE_SHARDS)
+    parser.add_argument('--remove', action='store_true', help='迁移成功后删除源数据')
+    parser.add_argument('--sample', type=int, default=50, help='compare 抽样的用户数')
+    parser.add_argument('--year', type=int, default=config.year)
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        print(json.dumps(compare(args.shards, args.sample, args.year), ensure_ascii=False, indent=2))
+    else:
+        migrate = to_shared if args.command == 'to-shared' else to_user
+        uids = user_db_uids() if args.command == 'to-shared' else store_uids(args.shards)
+        total = 0
+        start = time.time()
+        for i, uid in enumerate(uids, start=1):
+            total += migrate(uid, args.shards, args.remove)
+            if i % 100 == 0:
+                print(f'[{time.asctime()}] 已迁移 {i}/{len(uids)} 个用户')
+        print(f'[{time.asctime()}] 迁移完成：{len(uids)} 个用户，{total} 条帖子，耗时 {time.time() - start:.1f}s')
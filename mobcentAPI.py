@@ -1,7 +1,17 @@
 import requests
 import json
 import time
+import threading
+from itertools import islice
+from concurrent.futures import Future, TimeoutError
 from urllib.parse import quote
+import metrics
+
+PM_REQUESTS = metrics.Counter('qshp_pm_requests_total', '私信验证的 pmlist 请求数', ('result',))
+PM_CHECKS = metrics.Counter('qshp_pm_checks_total', '私信验证次数')
+PM_POLLS = metrics.Counter('qshp_pm_polls_total', '私信轮询次数', ('result',))
+PM_BATCH_SIZE = metrics.Histogram('qshp_pm_batch_size', '每次 pmlist 请求合并的用户数',
+                                  buckets=(1, 2, 5, 10, 20, 50, 100))
 
 
 class HepanException(Exception):
@@ -194,7 +204,13 @@ class MobcentAPI:
         s, e = self.get_last_pm_text(list(d.keys()), time_limit)
         if not s:
             return s, e
+        return s, {k: self.pm_matches(v, d[k]) for k, v in e.items()}
+
+    @staticmethod
+    def pm_matches(text: str | None, auth: str) -> bool:
         """
+        私信文本是否与认证字符串匹配
+
         对判断中使用 endswith 而不是 == 的解释：
         当用户在旧版网页浏览帖子时，通过左边的“发消息”按钮发送到私信会默认带上一个标识来源的前缀，干扰判断。
         并且，判断后缀其实已经足够了。
@@ -205,7 +221,36 @@ class MobcentAPI:
             "287814": null
         }
         """
-        return s, {k: v.endswith(d[k]) if v else False for k, v in e.items()}
+        return text.endswith(auth) if text else False
+
+    def get_heart(self) -> tuple[bool, str | dict]:
+        """
+        心跳接口，返回未读提醒，其中 pmInfos 为有未读私信的会话
+
+        :return:
+            (是否成功，错误信息或body)
+        :note:
+            body 示例：
+            {
+                "pmInfos": [{"fromUid": 287813, "plid": 123, "pmid": 456, "time": "1764411289000"}],
+                "replyInfo": {...}, "atMeInfo": {...}, "heartPeriod": "120000", "pmPeriod": "20000"
+            }
+        """
+        params = {'r': 'message/heart'}
+        r = self.session.post(self.base_url, params=params, timeout=self.timeout)
+        try:
+            r.raise_for_status()
+            j: dict = r.json()
+            if j['rs']:
+                return True, j['body']
+            else:
+                return False, j['head']['errInfo']
+        except requests.HTTPError as e:
+            return False, f"HTTP错误: {str(e)}"
+        except requests.JSONDecodeError as e:
+            return False, f"JSON解析错误: {str(e)}"
+        except Exception as e:
+            return False, f"错误: {e}"
 
     def get_user_info(self, uid: int) -> tuple[bool, str | dict]:
         """
@@ -239,3 +284,162 @@ class MobcentAPI:
             return True, 'uid与用户名验证通过'
         else:
             return False, 'uid与用户名验证不通过'
+
+
+class PmBatcher:
+    """
+    将短时间内并发的私信验证合并为一次 pmlist 请求（多个 pmInfos），再把结果分发给各个等待的请求
+
+    第一个请求到达后等待 window 秒收集其他请求，或凑满 max_batch 个用户后立即发出。
+    同一时间只有一个 pmlist 请求在进行，期间到达的请求会进入下一批，因此 Mobcent 变慢时批次会自动变大。
+
+    示例：
+        batcher = PmBatcher(m_api)
+        success, result = batcher.check(287813, 'auth string')
+        # (True, True) / (True, False) / (False, '错误信息')
+    """
+
+    def __init__(self, api: MobcentAPI, window: float = 0.2, max_batch: int = 50, time_limit: int = 600):
+        self.api = api
+        self.window = window
+        self.max_batch = max_batch
+        self.time_limit = time_limit
+        self.cond = threading.Condition()
+        # uid -> [(auth, Future), ...]
+        self.pending: dict[int, list[tuple[str, Future]]] = {}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def check(self, uid: int, auth: str, timeout: float = 30) -> tuple[bool, str | bool]:
+        """
+        :return:
+            (是否成功，错误信息或是否匹配)
+        """
+        PM_CHECKS.inc()
+        future = Future()
+        with self.cond:
+            self.pending.setdefault(uid, []).append((auth, future))
+            self.cond.notify()
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            return False, '私信验证超时'
+
+    def _next_batch(self) -> dict[int, list[tuple[str, Future]]]:
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = dict(islice(self.pending.items(), self.max_batch))
+            for uid in batch:
+                del self.pending[uid]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            PM_BATCH_SIZE.observe(len(batch))
+            try:
+                s, e = self.api.get_last_pm_text(list(batch), self.time_limit)
+            except Exception as ex:
+                s, e = False, f"错误: {ex}"
+            PM_REQUESTS.inc(result='ok' if s else 'error')
+            for uid, waiters in batch.items():
+                for auth, future in waiters:
+                    future.set_result((True, MobcentAPI.pm_matches(e.get(uid), auth)) if s else (False, e))
+
+
+class PmInbox:
+    """
+    后台轮询收到的私信，在内存中保存每个发送者最新的一条，私信验证直接在本地完成
+
+    每隔 interval 秒调用一次心跳接口获取有未读私信的发送者，再用一次 pmlist 请求（startTime 为上次轮询的时间）
+    取回这些发送者的新私信。超过 retention 秒的私信从索引中删除。
+    对 Mobcent 的请求频率只取决于 interval，与提交验证的人数无关。
+    索引中没有匹配的私信时，check 等待开始于请求之后的下一次轮询（至多 timeout 秒）再判断，
+    刚发送私信就提交验证的用户不会因为索引尚未更新而失败。
+
+    check 的参数与返回值与 PmBatcher 相同，可以互换使用。
+    """
+
+    def __init__(self, api: MobcentAPI, interval: float = 5, retention: int = 600, max_batch: int = 50):
+        self.api = api
+        self.interval = interval
+        self.retention = retention
+        self.max_batch = max_batch
+        # 轮询完成时 notify_all，唤醒等待新索引的 check
+        self.lock = threading.Condition()
+        # uid -> (私信内容, 时间戳)
+        self.latest: dict[int, tuple[str, float]] = {}
+        # 上次成功轮询的时间，下次从这个时间减去 overlap 秒开始获取（余量用于容忍两端的时钟误差）
+        self.overlap = max(interval, 60)
+        self.last_poll = time.time() - retention
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def check(self, uid: int, auth: str, timeout: float = None) -> tuple[bool, str | bool]:
+        """
+        :param timeout: 没有匹配时最多等待下一次轮询的秒数，默认 interval * 2 + api.timeout
+        :return:
+            (是否成功，错误信息或是否匹配)
+        """
+        PM_CHECKS.inc()
+        requested = time.time()
+        if requested - self.last_poll > self.interval * 3 + self.api.timeout:
+            return False, '私信服务暂不可用，请稍后再试'
+        deadline = requested + (self.interval * 2 + self.api.timeout if timeout is None else timeout)
+        with self.lock:
+            while True:
+                matched = self._matches(uid, auth)
+                # last_poll 是轮询开始的时间，不早于请求时间的轮询一定已包含请求前发送的私信
+                remaining = deadline - time.time()
+                if matched or self.last_poll >= requested or remaining <= 0:
+                    return True, matched
+                self.lock.wait(remaining)
+
+    def _matches(self, uid: int, auth: str) -> bool:
+        """索引中 uid 的私信是否匹配（调用时持有锁）"""
+        text, t = self.latest.get(uid, (None, 0))
+        if time.time() - t > self.retention:
+            text = None
+        return MobcentAPI.pm_matches(text, auth)
+
+    def poll(self):
+        """轮询一次，更新索引"""
+        start = time.time()
+        s, body = self.api.get_heart()
+        if not s:
+            raise HepanException(body)
+        senders = list(dict.fromkeys(int(i['fromUid']) for i in body.get('pmInfos') or []))
+        since = min(start - self.last_poll + self.overlap, self.retention)
+        for i in range(0, len(senders), self.max_batch):
+            batch = senders[i:i + self.max_batch]
+            PM_BATCH_SIZE.observe(len(batch))
+            s, e = self.api.get_last_pm_dict(batch, int(since) + 1)
+            PM_REQUESTS.inc(result='ok' if s else 'error')
+            if not s:
+                raise HepanException(e)
+            with self.lock:
+                for uid, msg in e.items():
+                    if msg:
+                        self.latest[uid] = (msg['content'], int(msg['time']) / 1000)
+        with self.lock:
+            for uid in [uid for uid, (_, t) in self.latest.items() if start - t > self.retention]:
+                del self.latest[uid]
+            self.last_poll = start
+            self.lock.notify_all()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+                PM_POLLS.inc(result='ok')
+            except Exception as e:
+                PM_POLLS.inc(result='error')
+                print(f'[{time.asctime()}] 私信轮询失败: {e}')
+            time.sleep(self.interval)
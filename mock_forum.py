@@ -0,0 +1,417 @@
+"""
+本地模拟论坛，实现 WebAPI 用到的接口，用于在不访问 bbs.uestc.edu.cn 的情况下测试爬虫性能
+
+实现的接口：
+    POST member.php?mod=logging&action=login   登录
+    POST _/auth/adoptLegacyAuth                 获取 authorization
+    GET  _/user/{uid}/profile                   用户信息（含 user_summary）
+    GET  _/user/{uid}/threads                   用户主题列表
+    GET  _/user/{uid}/replies                   用户回复列表
+    GET  _/post/find                            pid -> (tid, position)
+    GET  _/post/list                            主题帖的一页回复
+    GET  _bench/stats                           服务端统计（请求数、延迟分位数）
+    POST _bench/reset                           清空统计
+
+用法：
+    python mock_forum.py --port 9700 --users 1001:200:3000,1002:10:100 --latency lognormal:-3,0.5 \\
+        --error-rate 0.01 --throttle-rate 0.01 --rate-limit 100
+
+然后在 config.py 中设置 forum_url = 'http://127.0.0.1:9700/'
+"""
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote
+from http.cookies import SimpleCookie
+
+PAGE_SIZE = 20
+TZ_UTC8 = timezone(timedelta(hours=8))
+FORUM_IDS = [25, 61, 70, 45, 199, 66, 17, 236, 309, 370]
+# 每个用户占用 tid 区间 [uid * 100000, uid * 100000 + 100000)，后一半为该用户回复过的他人主题帖
+TID_BLOCK = 100_000
+OTHER_TID_OFFSET = 50_000
+
+
+def parse_latency(spec: str):
+    """
+    解析延迟分布，返回无参数的采样函数（秒）
+
+    支持 fixed:0.05、uniform:0.02,0.2、lognormal:mu,sigma（参数为 ln 秒）、none
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(x) for x in args.split(',')] if args else []
+    match kind:
+        case 'none':
+            return lambda: 0
+        case 'fixed':
+            return lambda: values[0]
+        case 'uniform':
+            return lambda: random.uniform(values[0], values[1])
+        case 'lognormal':
+            return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f'未知的延迟分布: {spec}')
+
+
+def parse_users(spec: str) -> dict[int, tuple[int, int]]:
+    """'1001:200:3000,1002:10:100' -> {1001: (200, 3000), 1002: (10, 100)}，即 uid:主题数:回复数"""
+    users = {}
+    for item in spec.split(','):
+        uid, threads, replies = (int(x) for x in item.split(':'))
+        users[uid] = (threads, replies)
+    return users
+
+
+class SyntheticUser:
+    """
+    一个合成用户的全部帖子
+
+    in_year 比例的帖子均匀分布在 year 年内，其余在更早的年份，使爬虫能够按时间截止。
+    回复分散在若干个他人的主题帖中，部分带有 format 2 的引用。
+    full_rows 为 True 时，主题列表与回复列表的行带有帖子的全部字段（楼层、正文等），用于测试 planner.py
+    """
+
+    def __init__(self, uid: int, n_threads: int, n_replies: int, year: int, in_year: float = 0.7,
+                 full_rows: bool = False):
+        rng = random.Random(uid)
+        self.uid = uid
+        self.username = f'user{uid}'
+        start = datetime(year, 1, 1, tzinfo=TZ_UTC8).timestamp()
+        end = datetime(year + 1, 1, 1, tzinfo=TZ_UTC8).timestamp() - 1
+
+        def datelines(n):
+            n_in = int(n * in_year)
+            result = [int(rng.uniform(start, end)) for _ in range(n_in)]
+            result += [int(start - rng.uniform(1, 3 * 365 * 86400)) for _ in range(n - n_in)]
+            return sorted(result, reverse=True)
+
+        self.threads = {}  # tid -> 主题信息
+        self.posts = {}  # pid -> 帖子
+        self.by_position = {}  # tid -> {position: pid}
+        pid = uid * 1_000_000
+        for i, dl in enumerate(datelines(min(n_threads, OTHER_TID_OFFSET - 1))):
+            tid = uid * TID_BLOCK + i + 1
+            pid += 1
+            self.threads[tid] = {
+                'thread_id': tid, 'subject': f'主题 {tid}', 'author': self.username, 'author_id': uid,
+                'forum_id': rng.choice(FORUM_IDS), 'dateline': dl, 'views': rng.randint(10, 5000),
+                'replies': rng.randint(0, 60), 'favorite_times': rng.randint(0, 20)
+            }
+            self._add_post(pid, tid, 1, dl, f'主题帖正文 {tid}\n' * rng.randint(1, 20), 0, rng)
+
+        n_targets = min(max(1, n_replies // 5), TID_BLOCK - OTHER_TID_OFFSET)
+        next_position = {}
+        for dl in sorted(datelines(n_replies)):
+            tid = uid * TID_BLOCK + OTHER_TID_OFFSET + rng.randrange(n_targets)
+            if tid not in self.threads:
+                self.threads[tid] = {
+                    'thread_id': tid, 'subject': f'他人主题 {tid}', 'author': 'other', 'author_id': 1,
+                    'forum_id': rng.choice(FORUM_IDS), 'dateline': dl, 'views': rng.randint(10, 5000),
+                    'replies': 0, 'favorite_times': 0
+                }
+            position = next_position.get(tid, 1) + rng.randint(1, 4)
+            next_position[tid] = position
+            self.threads[tid]['replies'] = position
+            pid += 1
+            if rng.random() < 0.3:
+                quoted = pid - rng.randint(1, 100)
+                message = f'> other 发表于 [2025-01-01 00:00](/goto/{quoted})\n> 引用\n\n回复正文 {pid}'
+                self._add_post(pid, tid, position, dl, message, 2, rng)
+            else:
+                self._add_post(pid, tid, position, dl, f'回复正文 {pid}', 0, rng)
+
+        self.thread_rows = sorted(((p if full_rows else {}) | self.threads[p['thread_id']] | {'dateline': p['dateline']}
+                                   for p in self.posts.values() if p['position'] == 1),
+                                  key=lambda x: x['dateline'], reverse=True)
+        self.reply_rows = sorted(((p if full_rows else {}) |
+                                  {'post_id': p['post_id'], 'thread_id': p['thread_id'], 'dateline': p['dateline'],
+                                   'subject': self.threads[p['thread_id']]['subject'],
+                                   'forum_id': p['forum_id']}
+                                  for p in self.posts.values() if p['position'] != 1),
+                                 key=lambda x: x['dateline'], reverse=True)
+
+    def _add_post(self, pid: int, tid: int, position: int, dateline: int, message: str, form: int, rng):
+        self.posts[pid] = {
+            'post_id': pid, 'thread_id': tid, 'forum_id': self.threads[tid]['forum_id'], 'position': position,
+            'author': self.username, 'author_id': self.uid,
+            'subject': self.threads[tid]['subject'] if position == 1 else '',
+            'message': message, 'format': form, 'dateline': dateline,
+            'support': rng.randint(0, 10), 'oppose': rng.randint(0, 3)
+        }
+        self.by_position.setdefault(tid, {})[position] = pid
+
+    def page_rows(self, tid: int, page: int) -> list[dict]:
+        """主题帖 tid 第 page 页的 20 个楼层，非本用户的楼层用占位帖子填充"""
+        thread = self.threads[tid]
+        total = thread['replies'] + 1
+        rows = []
+        positions = self.by_position.get(tid, {})
+        for position in range((page - 1) * PAGE_SIZE + 1, min(page * PAGE_SIZE, total) + 1):
+            if position in positions:
+                rows.append(self.posts[positions[position]])
+            else:
+                rows.append({
+                    'post_id': 10 ** 15 + tid * 10_000 + position, 'thread_id': tid, 'forum_id': thread['forum_id'],
+                    'position': position, 'author': thread['author'] if position == 1 else 'other',
+                    'author_id': 1, 'subject': thread['subject'] if position == 1 else '',
+                    'message': f'其他人的帖子 {position}', 'format': 0, 'dateline': thread['dateline'] + position,
+                    'support': 0, 'oppose': 0
+                })
+        return rows
+
+
+class MockForum:
+    def __init__(self, users: dict[int, tuple[int, int]], year: int, latency, error_rate: float = 0,
+                 throttle_rate: float = 0, rate_limit: float = 0, in_year: float = 0.7, full_rows: bool = False,
+                 account_rate_limit: float = 0):
+        self.user_specs = users
+        self.year = year
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.in_year = in_year
+        self.full_rows = full_rows
+        self.users: dict[int, SyntheticUser] = {}
+        self.pid_owner: dict[int, int] = {}
+        self.lock = threading.Lock()
+        self.tokens = rate_limit
+        self.token_time = time.monotonic()
+        # 每个账号（Authorization）的令牌桶 {authorization: (令牌数, 时间)}
+        self.account_rate_limit = account_rate_limit
+        self.account_tokens: dict[str, tuple[float, float]] = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts: dict[str, int] = {}
+            self.latencies: list[float] = []
+            self.errors = 0
+            self.throttled = 0
+
+    def user(self, uid: int) -> SyntheticUser | None:
+        with self.lock:
+            if uid not in self.users and uid in self.user_specs:
+                n_threads, n_replies = self.user_specs[uid]
+                self.users[uid] = SyntheticUser(uid, n_threads, n_replies, self.year, self.in_year,
+                                               self.full_rows)
+            return self.users.get(uid)
+
+    def owner_of_tid(self, tid: int) -> SyntheticUser | None:
+        return self.user(tid // TID_BLOCK)
+
+    def take_token(self) -> bool:
+        """每秒 rate_limit 个请求的令牌桶，为 0 时不限速"""
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.token_time) * self.rate_limit)
+            self.token_time = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def take_account_token(self, authorization: str) -> bool:
+        """每个账号每秒 account_rate_limit 个请求的令牌桶，为 0 时不限速"""
+        if not self.account_rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            tokens, last = self.account_tokens.get(authorization, (self.account_rate_limit, now))
+            tokens = min(self.account_rate_limit, tokens + (now - last) * self.account_rate_limit)
+            allowed = tokens >= 1
+            self.account_tokens[authorization] = (tokens - allowed, now)
+            return allowed
+
+    def record(self, endpoint: str, seconds: float):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            self.latencies.append(seconds)
+
+    def stats(self) -> dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            counts = dict(self.counts)
+
+        def percentile(p):
+            if not latencies:
+                return 0
+            return latencies[min(len(latencies) - 1, math.ceil(p * len(latencies)) - 1)]
+
+        return {
+            'requests': sum(counts.values()), 'by_endpoint': counts, 'errors': self.errors,
+            'throttled': self.throttled, 'p50': percentile(0.5), 'p99': percentile(0.99)
+        }
+
+    def handle_api(self, path: str, args: dict) -> tuple[str, dict]:
+        """返回 (指标用的接口名, 响应 data)，找不到时抛出 KeyError"""
+        parts = path.split('/')
+        if parts[0] == 'user' and len(parts) == 3:
+            user = self.user(int(parts[1]))
+            if user is None:
+                raise KeyError(path)
+            page = int(args.get('page', 1))
+            match parts[2]:
+                case 'profile':
+                    summary = {'username': user.username, 'group_title': '河畔机器人', 'group_subtitle': '',
+                               'threads': len(user.thread_rows), 'replies': len(user.reply_rows)}
+                    return 'user/profile', {'uid': user.uid, 'register_time': 1500000000, 'user_summary': summary}
+                case 'threads' | 'replies':
+                    rows = user.thread_rows if parts[2] == 'threads' else user.reply_rows
+                    return f'user/{parts[2]}', {
+                        'page': page, 'total': len(rows), 'rows': rows[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+                    }
+        if path == 'post/find':
+            pid = int(args['pid'])
+            user = self.user(pid // 1_000_000)
+            post = user.posts[pid] if user else None
+            if post is None:
+                raise KeyError(path)
+            return 'post/find', {'thread_id': post['thread_id'], 'position': post['position']}
+        if path == 'post/list':
+            tid = int(args['thread_id'])
+            page = int(args.get('page', 1))
+            user = self.owner_of_tid(tid)
+            if user is None or tid not in user.threads:
+                raise KeyError(path)
+            data = {'rows': user.page_rows(tid, page), 'total': user.threads[tid]['replies'] + 1}
+            if int(args.get('thread_details', 0)):
+                data['thread'] = user.threads[tid]
+            return 'post/list', data
+        raise KeyError(path)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    forum: MockForum = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, obj, status: int = 200):
+        self._send(status, json.dumps(obj, ensure_ascii=False).encode())
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_POST(self):
+        body = self._read_body()
+        url = urlparse(self.path)
+        if url.path == '/member.php':
+            # 登录的用户名写入 cookie，adoptLegacyAuth 据此为每个账号返回不同的 authorization
+            username = parse_qs(body.decode()).get('username', ['bench'])[0]
+            body = '<root>欢迎您回来，河畔机器人</root>'.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Set-Cookie', f'mock_user={quote(username)}; Path=/')
+            self.end_headers()
+            self.wfile.write(body)
+        elif url.path == '/_/auth/adoptLegacyAuth':
+            cookie = SimpleCookie(self.headers.get('Cookie', ''))
+            username = cookie['mock_user'].value if 'mock_user' in cookie else 'bench'
+            self._send_json({'code': 0, 'message': '', 'user': {},
+                             'data': {'authorization': f'mock-token-{username}'}})
+        elif url.path == '/_bench/reset':
+            self.forum.reset()
+            self._send_json({'code': 0})
+        else:
+            self._send_json({'code': 404, 'message': 'not found'}, 404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/_bench/stats':
+            self._send_json(self.forum.stats())
+            return
+        if not url.path.startswith('/_/'):
+            self._send_json({'code': 404, 'message': 'not found'}, 404)
+            return
+        start = time.perf_counter()
+        forum = self.forum
+        args = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            endpoint, data = forum.handle_api(url.path[3:], args)
+        except (KeyError, ValueError):
+            self._send_json({'code': 1, 'message': '主题不存在或已被删除', 'user': {}, 'data': None})
+            return
+        time.sleep(forum.latency())
+        if not forum.take_token():
+            with forum.lock:
+                forum.throttled += 1
+            forum.record(endpoint, time.perf_counter() - start)
+            self._send_json({'code': 429, 'message': 'Too Many Requests'}, 429)
+            return
+        roll = random.random()
+        if roll < forum.error_rate:
+            with forum.lock:
+                forum.errors += 1
+            forum.record(endpoint, time.perf_counter() - start)
+            self._send_json({'code': 500, 'message': 'Internal Server Error'}, 500)
+            return
+        if roll < forum.error_rate + forum.throttle_rate or \
+                not forum.take_account_token(self.headers.get('Authorization', '')):
+            with forum.lock:
+                forum.throttled += 1
+            forum.record(endpoint, time.perf_counter() - start)
+            self._send_json({'code': 1, 'message': '您的请求过于频繁，请稍后再试', 'user': {}, 'data': None})
+            return
+        forum.record(endpoint, time.perf_counter() - start)
+        self._send_json({'code': 0, 'message': '', 'user': {'uid': 1, 'username': '河畔机器人'}, 'data': data})
+
+
+def serve(forum: MockForum, port: int = 0, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """在后台线程中启动模拟论坛，port 为 0 时随机选择端口（server.server_address[1]）"""
+    handler = type('BoundHandler', (Handler,), {'forum': forum})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-forum', daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--users', default='1001:100:1000,1002:20:200,1003:5:40',
+                        help='uid:主题数:回复数，逗号分隔')
+    parser.add_argument('--year', type=int, default=2025)
+    parser.add_argument('--in-year', type=float, default=0.7, help='落在 year 年内的帖子比例')
+    parser.add_argument('--latency', default='lognormal:-3.5,0.6', help='none / fixed:s / uniform:a,b / lognormal:mu,sigma')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回 HTTP 500 的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='返回“请求过于频繁”的比例')
+    parser.add_argument('--rate-limit', type=float, default=0, help='每秒最多处理的请求数，超过返回 429，0 为不限')
+    parser.add_argument('--account-rate-limit', type=float, default=0,
+                        help='每个账号每秒最多处理的请求数，超过返回“请求过于频繁”，0 为不限')
+    parser.add_argument('--full-rows', action='store_true', help='列表行带有帖子的全部字段（楼层、正文等）')
+
+
+def build_forum(args) -> MockForum:
+    return MockForum(parse_users(args.users), args.year, parse_latency(args.latency), args.error_rate,
+                     args.throttle_rate, args.rate_limit, args.in_year, args.full_rows, args.account_rate_limit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地模拟论坛')
+    parser.add_argument('--port', type=int, default=9700)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = serve(build_forum(args), args.port)
+    print(f'[{time.asctime()}] 模拟论坛已启动: http://127.0.0.1:{args.port}/')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
@@ -0,0 +1,65 @@
+import json
+import socket
+import threading
+import time
+import config
+
+# web.py 监听的本机 UDP 地址，main.py / add_task.py / generate_report.py 向其发送事件
+ADDRESS = ('127.0.0.1', getattr(config, 'notify_port', 9596))
+
+_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+_last_progress: dict[tuple[int, str], float] = {}
+
+
+def send(event: str, uid: int, **data):
+    """
+    发送一条事件，例如 send('start', 287813)
+
+    UDP 发送不会阻塞，web.py 未运行时静默忽略，不影响爬虫
+    """
+    message = json.dumps({'event': event, 'uid': uid} | data, ensure_ascii=False, separators=(',', ':'))
+    try:
+        _sock.sendto(message.encode(), ADDRESS)
+    except OSError:
+        pass
+
+
+def progress(uid: int, stage: str, force: bool = False, interval: float = 1.0, **data):
+    """
+    发送进度事件，例如 progress(287813, 'posts', done=10, total=200)
+
+    同一 uid 的同一 stage 在 interval 秒内最多发送一次，避免并发任务逐条完成时刷屏；
+    阶段结束时传入 force=True 保证最后一条一定发出
+    """
+    key = (uid, stage)
+    now = time.time()
+    if not force and now - _last_progress.get(key, 0) < interval:
+        return
+    _last_progress[key] = now
+    send('progress', uid, stage=stage, **data)
+
+
+def listen(callback) -> threading.Thread:
+    """
+    在后台线程中接收事件，每收到一条调用一次 callback(event: dict)
+
+    :return:
+        已启动的守护线程
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind(ADDRESS)
+
+    def loop():
+        while True:
+            data, _ = sock.recvfrom(65536)
+            try:
+                event = json.loads(data)
+                if isinstance(event, dict) and isinstance(event.get('uid'), int):
+                    callback(event)
+            except Exception as e:
+                print(f'[notify] 无效事件 {data[:100]}: {e}')
+
+    thread = threading.Thread(target=loop, name='notify-listener', daemon=True)
+    thread.start()
+    return thread
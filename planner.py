@@ -0,0 +1,92 @@
+"""
+请求计划：由列表阶段已得到的信息，计算获取帖子内容所需的最少 post/list 请求
+
+  - 只请求包含所需楼层的页（由 util.set_page 分页）
+  - 主题信息（主题帖的浏览/回复/收藏数，回复所需的主题标题与楼主）已在主题列表、回复列表的行中时不再请求，
+    否则每个 tid 只在其第一个需要的页上带 thread_details=1，而不是每页都带
+  - 回复列表的行已带楼层（position）时不调用 find_point
+  - 列表行已带帖子的全部字段（见 POST_FIELDS）时直接使用，该楼层不再请求其所在的页
+
+main.py 在任务结束时将计划的请求数与实际请求数写入 task.json 的 plan。
+"""
+import util
+
+# 主题帖需要的主题信息
+THREAD_FIELDS = ('views', 'replies', 'favorite_times')
+# 回复需要的主题信息
+REPLY_FIELDS = ('subject', 'author')
+# 不请求帖子页而直接使用列表行时，行中需要有的字段
+POST_FIELDS = ('post_id', 'thread_id', 'forum_id', 'position', 'message', 'format', 'dateline', 'support', 'oppose')
+
+
+def thread_meta(row: dict, fields: tuple[str, ...] = THREAD_FIELDS + REPLY_FIELDS) -> dict:
+    """从列表行中取出已有的主题信息（值为 None 视为没有）"""
+    return {k: row[k] for k in fields if row.get(k) is not None}
+
+
+def listed_post(row: dict, position: int = None) -> dict | None:
+    """
+    列表行已带帖子的全部字段时返回帖子（副本），否则返回 None
+
+    没有引用的回复需要主题帖的 pid 作为 reply_pid，只能从帖子页得到，因此不直接使用
+    :param position: 行中没有楼层时使用，例如主题列表的行为 1
+    """
+    post = row | {'position': row.get('position') or position}
+    if any(post.get(k) is None for k in POST_FIELDS):
+        return None
+    if post['position'] != 1 and util.get_reply_pid_and_username(post) is None:
+        return None
+    return post
+
+
+def missing_fields(positions: list[int], meta: dict) -> set[str]:
+    needed = set()
+    if 1 in positions:
+        needed.update(THREAD_FIELDS)
+    if any(p != 1 for p in positions):
+        needed.update(REPLY_FIELDS)
+    return needed - meta.keys()
+
+
+def plan(tid_page_positions: dict[int, dict[int, list[int]]], metas: dict[int, dict],
+         listed: dict[int, set[int]] = None) -> list[tuple[int, int, list[int], bool]]:
+    """
+    :param tid_page_positions: util.set_page 的结果 {tid: {page: [position, ...]}}
+    :param metas: {tid: 已有的主题信息}
+    :param listed: {tid: 已从列表行得到的楼层}，这些楼层不再请求
+    :return:
+        需要请求的页 [(tid, page, positions, 是否带 thread_details=1), ...]
+    """
+    listed = listed or {}
+    requests = []
+    for tid, page_positions in tid_page_positions.items():
+        all_positions = [p for positions in page_positions.values() for p in positions]
+        details = bool(missing_fields(all_positions, metas.get(tid, {})))
+        pages = {page: [p for p in positions if p not in listed.get(tid, ())]
+                 for page, positions in sorted(page_positions.items())}
+        pages = {page: positions for page, positions in pages.items() if positions}
+        if details and not pages and page_positions:
+            # 楼层都已在手但缺主题信息，仍请求一页以取得主题信息
+            pages = {min(page_positions): []}
+        for page, positions in pages.items():
+            requests.append((tid, page, positions, details))
+            details = False
+    return requests
+
+
+def fill(posts: list[dict], main_post_id: int | None, meta: dict) -> list[dict]:
+    """
+    为一页中选出的帖子注入主题信息：主题帖的统计，回复的引用与标题
+
+    :param main_post_id: 本页中主题帖（1 楼）的 pid，不在本页时为 None
+    """
+    for post in posts:
+        if post.get('position') == 1:
+            post['views'] = meta.get('views')
+            post['replies'] = meta.get('replies')
+            post['favorite'] = meta.get('favorite_times')  # 如果 API 不返回，就是 None
+        else:
+            _ = util.get_reply_pid_and_username(post)
+            post['reply_pid'], post['reply_user'] = (main_post_id, meta.get('author')) if _ is None else _
+            post['subject'] = meta.get('subject', '')
+    return posts
@@ -0,0 +1,115 @@
+"""
+预览报告：列表阶段结束后，仅由主题列表与回复列表的行生成的部分报告
+
+main.py 在读取完列表、调用 find_point 与获取帖子页之前写入 data/user/{uid}/report.preview.min.json（及预压缩版本），
+内容与 /api/get_report 的响应相同，data 带 "preview": true。列表行能给出的部分：
+  - 主题帖数、回复数、发帖天数与每日发帖（热力图）
+  - 最早/最晚的主题帖
+  - 版块分布（行带 forum_id 时）
+其余部分（沙发、赞踩、热度、回复的人等）与完整报告形状相同但为空，report.js 在预览中隐藏这些部分。
+完整报告另写 report.json，不覆盖预览；generate_report.py 写入完整报告后调用 remove 删除预览文件。
+"""
+import os
+import json
+from collections import Counter
+from datetime import datetime
+import config
+import util
+
+ENABLED = getattr(config, 'preview_report', True)
+PREVIEW_NAME = 'report.preview.min.json'
+
+
+def preview_path(uid: int) -> str:
+    return f'data/user/{uid}/{PREVIEW_NAME}'
+
+
+def primary_year(years: list[int]) -> int:
+    """多年任务中写入 report.json 的年份，与 generate_report.py 相同"""
+    return config.year if years[0] <= config.year <= years[1] else years[1]
+
+
+def build(uid: int, user_info: dict, rows: list[tuple[bool, dict]], task: dict, year: int) -> dict:
+    """
+    :param rows: 列表阶段得到的行 [(是否为主题列表的行, 行), ...]
+    :param task: 任务信息，只使用 report.js 用到的 create_time、get_data_start
+    """
+    start, stop = util.year_range(year)
+    rows = [(is_thread, row) for is_thread, row in rows if start <= row['dateline'] < stop]
+    threads = sorted((row for is_thread, row in rows if is_thread), key=lambda row: row['dateline'])
+    reply_count = len(rows) - len(threads)
+
+    def thread_row(row: dict) -> list | None:
+        # 与 section_first_and_last 的行相同：position, dateline, tid, pid, subject, message
+        return [1, row['dateline'], row['thread_id'], row.get('post_id'), row.get('subject'), None] if row else None
+
+    post_count_per_day = dict(sorted(Counter(
+        datetime.fromtimestamp(row['dateline']).strftime('%m-%d') for _, row in rows).items()))
+    ranked_days = sorted(post_count_per_day.items(), key=lambda x: x[1], reverse=True)
+    post_max_count = ranked_days[0][1] if ranked_days else 0
+    forum_post = [(fid, count, util.get_fid_name(fid)) for fid, count in Counter(
+        row['forum_id'] for _, row in rows if row.get('forum_id')).most_common(20)]
+
+    user_summary = user_info.get('user_summary', {})
+    return {
+        'user': {
+            'uid': uid,
+            'username': user_summary.get('username'),
+            'group_title': user_summary.get('group_title'),
+            'group_subtitle': user_summary.get('group_subtitle'),
+            'register_time': user_info.get('register_time'),
+        },
+        'summary': {
+            'thread': len(threads),
+            'reply': reply_count,
+            'all': len(rows),
+            'sofa_count': None,
+            'post_count_per_day': post_count_per_day,
+            'post_days': len(post_count_per_day),
+            'post_most_days': sorted(({'d': d, 'c': c} for d, c in ranked_days if c == post_max_count),
+                                     key=lambda x: x['d']),
+        },
+        'first_and_last': {
+            'first_thread': thread_row(threads[0] if threads else None),
+            'last_thread': thread_row(threads[-1] if threads else None),
+            'first_reply': None,
+            'last_reply': None,
+        },
+        'support_and_oppose': {
+            'total_support': 0, 'total_oppose': 0,
+            'thread_most_support': [], 'thread_most_oppose': [], 'reply_most_support': [], 'reply_most_oppose': [],
+        },
+        'popularity': {
+            'reply_thread_most': [], 'thread_replies_most': [], 'thread_views_most': [], 'thread_favorite_most': [],
+        },
+        'personal_favorite': {
+            'forum_most_favorite': [item for item in forum_post if item[1] == forum_post[0][1]],
+            'reply_user_most': [],
+        },
+        'rank': {
+            'thread_support': [], 'thread_oppose': [], 'reply_support': [], 'reply_oppose': [],
+            'reply_thread': [], 'thread_replies': [], 'thread_views': [], 'thread_favorite': [],
+            'forum_post': forum_post,
+            'reply_user': [],
+            'post_count_per_days': [{'d': d, 'c': c} for d, c in ranked_days[:20]],
+        },
+        'year': year,
+        'task': {k: task[k] for k in ('create_time', 'get_data_start') if k in task},
+        'preview': True,
+    }
+
+
+def write(uid: int, report: dict) -> dict[str, int]:
+    """写入预览文件，返回值同 util.write_precompressed"""
+    data = json.dumps({"code": 0, "message": "成功", "data": report},
+                      ensure_ascii=False, separators=(',', ':')).encode()
+    return util.write_precompressed(preview_path(uid), data)
+
+
+def remove(uid: int):
+    """删除预览文件及其预压缩版本"""
+    for suffix in ('', '.gz', '.br'):
+        try:
+            os.remove(preview_path(uid) + suffix)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+def profiling_enabled(task: dict) -> bool:
+    """任务中带有 profile=1，或设置了环境变量 QSHP_PROFILE=1 时启用性能分析"""
+    return bool(task.get('profile')) or os.environ.get('QSHP_PROFILE') == '1'
+
+
+class TaskStats:
+    """
+    记录一个任务各阶段的耗时、请求数与响应字节数，结果写入 task.json 的 stages
+
+    示例：
+        stats = TaskStats(api)
+        with stats.stage('posts'):
+            ...
+        task['stages'] = stats.result()
+        # {"posts": {"seconds": 12.3, "requests": 456, "bytes": 7890}}
+
+    同名阶段多次进入时累加。请求数与字节数取自 api 的累计计数，因此各阶段不能并行进行。
+    传入多个计数来源时取其和（例如 main.py 的 api 与 split.SplitPool）。
+    """
+
+    def __init__(self, *apis):
+        self.apis = apis
+        self.stages: dict[str, dict] = {}
+
+    def _counters(self) -> tuple[int, int]:
+        return sum(api.request_count for api in self.apis), sum(api.response_bytes for api in self.apis)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        requests_before, bytes_before = self._counters()
+        try:
+            yield
+        finally:
+            requests_after, bytes_after = self._counters()
+            s = self.stages.setdefault(name, {'seconds': 0.0, 'requests': 0, 'bytes': 0})
+            s['seconds'] += time.perf_counter() - start
+            s['requests'] += requests_after - requests_before
+            s['bytes'] += bytes_after - bytes_before
+
+    def result(self) -> dict[str, dict]:
+        return {name: s | {'seconds': round(s['seconds'], 3)} for name, s in self.stages.items()}
+
+
+class TaskProfiler:
+    """
+    对单个任务进行 cProfile 与 tracemalloc 分析
+
+    主线程与分析期间新建的线程（线程池）各用一个 cProfile，结束时合并为一个文件：
+        data/user/{uid}/{name}.prof         可用 snakeviz 或 python -m pstats 查看
+        data/user/{uid}/{name}.memory.txt   tracemalloc 峰值与占用最多的代码行
+    """
+
+    def __init__(self, uid: int, name: str = 'profile'):
+        self.prefix = f'data/user/{uid}/{name}'
+        self.main_profile = cProfile.Profile()
+        self.thread_profiles: list[cProfile.Profile] = []
+        self.lock = threading.Lock()
+
+    def _thread_hook(self, frame, event, arg):
+        # 新线程启动后第一次触发时，换成该线程自己的 cProfile
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        tracemalloc.start(10)
+        threading.setprofile(self._thread_hook)
+        self.main_profile.enable()
+
+    def stop(self):
+        self.main_profile.disable()
+        threading.setprofile(None)
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = pstats.Stats(self.main_profile)
+        with self.lock:
+            for profile in self.thread_profiles:
+                stats.add(profile)
+        stats.dump_stats(f'{self.prefix}.prof')
+
+        with open(f'{self.prefix}.memory.txt', 'w', encoding='utf-8') as f:
+            f.write(f'current: {current} bytes\npeak: {peak} bytes\n\n')
+            for stat in snapshot.statistics('lineno')[:50]:
+                f.write(f'{stat}\n')
@@ -0,0 +1,101 @@
+import json
+import queue
+import threading
+
+
+class ProgressHub:
+    """
+    将 worker 发来的进度事件分发给订阅了对应 uid 的 SSE 连接
+
+    每个连接持有一个 SimpleQueue，发布一条事件只需向该 uid 的订阅者逐个 put，
+    空闲连接不占用 CPU。同时保存每个 uid 的最新进度，供新连接立即获得当前状态。
+    """
+
+    # 这些事件会作为该 uid 的最新进度保存，新连接建立时立即发送
+    snapshot_events = ('start', 'progress', 'data_done', 'report_start')
+
+    def __init__(self, status_index=None, eta=None):
+        """
+        :param status_index: 用于在队列变化时查询排名
+        :param eta: eta(uid) -> dict，附加到排名与进度事件中的预计时间
+        """
+        self.status_index = status_index
+        self.eta = eta
+        self.lock = threading.Lock()
+        self.subscribers: dict[int, set[queue.SimpleQueue]] = {}
+        self.latest: dict[int, dict] = {}
+
+    def subscribe(self, uid: int) -> queue.SimpleQueue:
+        q = queue.SimpleQueue()
+        with self.lock:
+            self.subscribers.setdefault(uid, set()).add(q)
+        return q
+
+    def unsubscribe(self, uid: int, q: queue.SimpleQueue):
+        with self.lock:
+            subs = self.subscribers.get(uid)
+            if subs:
+                subs.discard(q)
+                if not subs:
+                    del self.subscribers[uid]
+
+    def snapshot(self, uid: int) -> dict | None:
+        with self.lock:
+            return self.latest.get(uid)
+
+    def publish(self, event: dict):
+        """处理一条 notify 事件"""
+        uid = event['uid']
+        name = event.get('event')
+        with self.lock:
+            if name in self.snapshot_events:
+                self.latest[uid] = event
+            elif name in ('report_done', 'report_failed'):
+                self.latest.pop(uid, None)
+            targets = list(self.subscribers.get(uid, ()))
+            # 队列变化时，所有排队中的订阅者都需要得知新的排名
+            queued = [(u, list(subs)) for u, subs in self.subscribers.items()] \
+                if name in ('start', 'enqueue', 'estimate') and self.status_index else []
+        if targets and name == 'progress' and self.eta:
+            event = event | {'eta': self.eta(uid)}
+        for q in targets:
+            q.put(event)
+        for other_uid, subs in queued:
+            # 开始处理的用户已不在队列中，排名为 None，会被跳过
+            _, rank = self.status_index.get(other_uid)
+            if rank is not None:
+                update = {'event': 'queue', 'uid': other_uid, 'queue': rank}
+                if self.eta:
+                    update['eta'] = self.eta(other_uid)
+                for q in subs:
+                    q.put(update)
+
+    def stream(self, uid: int, initial: dict, follow: bool = True, keepalive: int = 15):
+        """
+        生成 text/event-stream 数据，直到报告生成完成或失败
+
+        :param uid: UID
+        :param initial: 首先发送的状态（来自 user_status_api 的同款数据）
+        :param follow: 为 False 时只发送 initial（报告已完成或未申请时无需保持连接）
+        :param keepalive: 无事件时发送注释行的间隔秒数，防止代理断开空闲连接
+        """
+        if not follow:
+            yield f'data: {json.dumps(initial, ensure_ascii=False)}\n\n'
+            return
+        q = self.subscribe(uid)
+        try:
+            yield f'data: {json.dumps(initial, ensure_ascii=False)}\n\n'
+            latest = self.snapshot(uid)
+            if latest:
+                yield f'data: {json.dumps(latest, ensure_ascii=False)}\n\n'
+            while True:
+                try:
+                    event = q.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'data: {json.dumps(event, ensure_ascii=False)}\n\n'
+                if event.get('event') in ('report_done', 'report_failed'):
+                    break
+        finally:
+            self.unsubscribe(uid, q)
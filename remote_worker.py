@@ -0,0 +1,120 @@
+"""
+远程爬虫节点：从协调端（web.py 的租约接口，见 lease.py）领取任务，在本机获取数据后上传 post.db 与 task.json
+
+    python remote_worker.py --coordinator https://example.com/AnnualReport --token xxx --worker node1
+
+每个节点使用自己的 config.py（论坛账号、线程数等，post_store 须为 user）与出口 IP，可任意增加节点。
+获取期间每 ttl/3 秒发送一次心跳并附带进度；心跳失败（租约已过期并被放回队列）时丢弃本次结果。
+报告由协调端在收到数据后生成，节点不生成报告。--once 在队列为空时退出，便于在本机用多个进程测试。
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import argparse
+import threading
+import requests
+import config
+import db
+import main
+
+
+class Coordinator:
+    """协调端租约接口的客户端"""
+
+    def __init__(self, url: str, token: str, worker: str):
+        self.url = url.rstrip('/')
+        self.worker = worker
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def _post(self, path: str, **kwargs) -> dict | None:
+        resp = self.session.post(f'{self.url}/api/lease/{path}', timeout=300, **kwargs)
+        result = resp.json()
+        if result.get('code') != 0:
+            raise RuntimeError(result.get('message'))
+        return result.get('data')
+
+    def claim(self) -> dict | None:
+        """:return: {"uid", "lease", "task", "ttl"}，没有任务时为 None"""
+        return self._post('claim', json={'worker': self.worker})
+
+    def heartbeat(self, lease: dict, progress: dict):
+        self._post('heartbeat', json={'uid': lease['uid'], 'lease': lease['lease'], 'progress': progress})
+
+    def complete(self, lease: dict):
+        uid = lease['uid']
+        with open(f'data/user/{uid}/post.db', 'rb') as post_db, \
+                open(f'data/user/{uid}/task.json', 'rb') as task_json:
+            self._post('complete', data={'uid': uid, 'lease': lease['lease']},
+                       files={'post_db': post_db, 'task_json': task_json})
+
+
+def keep_alive(coordinator: Coordinator, lease: dict, stop: threading.Event, lost: threading.Event):
+    """每 ttl/3 秒续期一次，直到 stop；续期被拒绝时设置 lost，网络错误时下次再试"""
+    while not stop.wait(lease['ttl'] / 3):
+        try:
+            coordinator.heartbeat(lease, dict(main.progress_state))
+        except RuntimeError as e:
+            print(f'[{time.asctime()}] 租约失效: {e}')
+            lost.set()
+            return
+        except (requests.RequestException, ValueError) as e:
+            print(f'[{time.asctime()}] 心跳失败: {e}')
+
+
+def run(coordinator: Coordinator, once: bool = False, keep: bool = False):
+    while True:
+        try:
+            lease = coordinator.claim()
+        except (requests.RequestException, ValueError, RuntimeError) as e:
+            print(f'[{time.asctime()}] 领取任务失败: {e}')
+            lease = None
+        if lease is None:
+            if once:
+                return
+            print(f'[{time.asctime()}] 无事', end='\r')
+            time.sleep(15)
+            continue
+        uid = lease['uid']
+        task = lease['task']
+        # 本机没有上次的数据，重试任务也完整获取
+        task.pop('retry', None)
+        stop, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=keep_alive, args=(coordinator, lease, stop, lost), daemon=True)
+        heartbeat.start()
+        try:
+            main.process_task(task, report=False)
+        finally:
+            stop.set()
+            heartbeat.join()
+        if lost.is_set():
+            print(f'[{time.asctime()}] 丢弃 {uid} 的结果')
+        else:
+            try:
+                coordinator.complete(lease)
+                print(f'[{time.asctime()}] \033[32;1m已上传: {uid}\033[m')
+            except (requests.RequestException, ValueError, RuntimeError) as e:
+                # 租约到期后由协调端放回队列
+                print(f'[{time.asctime()}] 上传 {uid} 失败: {e}')
+        if not keep:
+            shutil.rmtree(f'data/user/{uid}', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='远程爬虫节点')
+    parser.add_argument('--coordinator', default=getattr(config, 'coordinator_url', None),
+                        help='协调端地址，例如 https://example.com/AnnualReport（默认取 config.py 的 coordinator_url）')
+    parser.add_argument('--token', default=getattr(config, 'lease_token', None),
+                        help='与协调端 config.py 中相同的 lease_token')
+    parser.add_argument('--worker', default=f'{socket.gethostname()}-{os.getpid()}', help='节点名')
+    parser.add_argument('--once', action='store_true', help='队列为空时退出')
+    parser.add_argument('--keep', action='store_true', help='上传后保留本机的 data/user/{uid}')
+    args = parser.parse_args()
+    if not args.coordinator or not args.token:
+        parser.error('需要 --coordinator 与 --token')
+    if db.STORE != 'user':
+        sys.exit('远程节点需使用 post_store = "user"，以便上传单个 post.db')
+    main.init()
+    run(Coordinator(args.coordinator, args.token, args.worker), args.once, args.keep)
@@ -0,0 +1,60 @@
+"""
+离线回放一个任务的录制文件，用于确定性地复现和测量爬虫与报告生成的性能
+
+录制：运行 main.py 前设置 QSHP_CASSETTE=record，每个任务会生成 data/user/{uid}/cassette.jsonl.gz
+回放：
+    python replay_task.py data/user/287813/cassette.jsonl.gz --speed 0 --workers 10 --repeat 3
+
+在临时目录中运行完整的 main.py 流程（QSHP_CASSETTE=replay），不访问网络，打印每次的耗时与各阶段统计
+"""
+import os
+import sys
+import json
+import time
+import gzip
+import shutil
+import argparse
+import tempfile
+import bench_crawl
+
+
+def replay(cassette_path: str, speed: float, workers: int, timeout: float, keep: bool = False) -> dict:
+    with gzip.open(cassette_path, 'rt', encoding='utf-8') as f:
+        meta = json.loads(f.readline()).get('meta', {})
+    uid = meta['uid']
+    workdir = tempfile.mkdtemp(prefix=f'qshp_replay_{uid}_')
+    try:
+        bench_crawl.prepare_workdir(workdir, None, meta['year'], workers)
+        user_dir = os.path.join(workdir, 'data', 'user', str(uid))
+        os.makedirs(user_dir, exist_ok=True)
+        shutil.copy(cassette_path, os.path.join(user_dir, 'cassette.jsonl.gz'))
+        # 多年任务需以相同的年份范围回放，否则列表会提前终止
+        run = bench_crawl.run_pipeline(workdir, [uid], timeout,
+                                       {'QSHP_CASSETTE': 'replay', 'QSHP_REPLAY_SPEED': str(speed)},
+                                       {'years': meta['years']} if 'years' in meta else None)
+        task = {}
+        task_path = os.path.join(user_dir, 'task.json')
+        if os.path.exists(task_path):
+            with open(task_path, encoding='utf-8') as f:
+                task = json.load(f)
+        posts = bench_crawl.count_posts(workdir, [uid])
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return run | {'uid': uid, 'posts': posts, 'stages': task.get('stages', {}), 'workdir': workdir if keep else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线回放任务录制文件')
+    parser.add_argument('cassette', help='cassette.jsonl.gz 路径')
+    parser.add_argument('--speed', type=float, default=0, help='回放速度倍数，1 为录制时的速度，0 为不等待')
+    parser.add_argument('--workers', type=int, default=10, help='main.py 各阶段的线程数')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=3600)
+    parser.add_argument('--keep', action='store_true', help='保留临时目录以便检查')
+    args = parser.parse_args()
+    results = []
+    for i in range(args.repeat):
+        print(f'[{time.asctime()}] 回放第 {i + 1} 次', file=sys.stderr)
+        results.append(replay(args.cassette, args.speed, args.workers, args.timeout, args.keep))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
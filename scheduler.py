@@ -0,0 +1,59 @@
+"""
+队列调度：估计每个排队用户的获取开销（请求数），按最高响应比优先（HRRN）排序
+
+    响应比 = (已等待时间 + 预计耗时) / 预计耗时
+
+轻量用户的预计耗时短，响应比增长快，会先被处理；重量用户的响应比也随等待时间线性增长，不会一直被插队（老化）。
+与先来先服务相比，平均等待时间大幅降低。util.get_next_task 与 web.py 的队列排名使用同一个排序。
+
+policy 为 fifo 时退化为按修改时间排序。
+"""
+import math
+import time
+
+LIST_PAGE_SIZE = 20
+# 尚未估计开销的任务按此请求数计算
+DEFAULT_COST = 200
+
+
+def estimate_cost(user_info: dict, previous_task: dict = None) -> int:
+    """
+    估计获取一个用户所需的请求数 ≈ 列表页 + find_point 调用 + 帖子页
+
+    若该用户之前生成过报告，直接使用上次 task.json 中各阶段的实际请求数
+
+    :param user_info: api.get_user_info(uid, True) 的返回值，摘要中含主题数与回复数（全部年份，因此偏大）
+    :param previous_task: 上次的 task.json 内容
+    """
+    stages = (previous_task or {}).get('stages') or {}
+    measured = sum(s.get('requests', 0) for s in stages.values())
+    if measured:
+        return measured
+    summary = user_info.get('user_summary') or {}
+    threads = int(summary.get('threads') or 0)
+    replies = int(summary.get('replies') or 0)
+    listing = math.ceil(threads / LIST_PAGE_SIZE) + math.ceil(replies / LIST_PAGE_SIZE) + 2
+    # 回复分散在不同主题的不同页中，约七成各占一个帖子页
+    thread_pages = threads + math.ceil(replies * 0.7)
+    return 1 + listing + replies + thread_pages
+
+
+def priority(mtime: float, cost: int | None, now: float, request_seconds: float) -> float:
+    """响应比，越大越先处理"""
+    service = max(cost if cost is not None else DEFAULT_COST, 1) * request_seconds
+    return (max(now - mtime, 0) + service) / service
+
+
+def order(entries: dict[int, tuple[float, int | None]], policy: str = 'hrrn', request_seconds: float = 0.02,
+          now: float = None) -> list[int]:
+    """
+    :param entries: {uid: (mtime, cost)}，cost 为 None 表示尚未估计
+    :param policy: hrrn 或 fifo
+    :param request_seconds: 平均每个请求的耗时（已考虑线程数），用于把请求数换算为预计耗时
+    :return:
+        按处理顺序排列的 uid
+    """
+    if policy == 'fifo':
+        return [uid for uid, _ in sorted(entries.items(), key=lambda x: x[1][0])]
+    now = time.time() if now is None else now
+    return sorted(entries, key=lambda uid: (-priority(*entries[uid], now, request_seconds), entries[uid][0]))
@@ -0,0 +1,172 @@
+"""
+在一个用户的全部帖子中搜索（web.py 的 /AnnualReport/api/search）
+
+    python search.py --build-index    为 data/user 中没有全文索引的 post.db 建立索引
+
+搜索只读取数据库（db.get_readonly_conn），不建立索引：main.py 获取数据时由 db.init_db 建立，之前创建的库用 --build-index 离线建立。
+空白分隔的多个关键词之间为 AND。至少三个字符的关键词用全文索引 posts_fts 匹配（见 db.init_fts，trigram 分词器的最短长度为三个字符）；
+更短的关键词，以及没有全文索引的库（尚未建立索引、共享存储、不支持 FTS5 的 SQLite）用 LIKE 逐行匹配。
+结果按时间倒序（pid 递减）排列：FTS5 按 rowid 顺序产生结果，取一页时无需对全部命中排序（按 bm25 排序时常见词要对数万条命中打分）。
+命中数只统计到 MAX_TOTAL 条，同样是为了常见词也只需读取有限的结果。结果中的 snippet 是 HTML 转义后的片段，命中处以 <mark> 标出。
+"""
+import os
+import re
+import sys
+import html
+import time
+import sqlite3
+import argparse
+import db
+import util
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+MAX_QUERY_LENGTH = 100
+MAX_TERMS = 8
+# 命中数的统计上限
+MAX_TOTAL = 1000
+# FTS5 snippet() 的片段长度（trigram 分词器中约为字符数）
+SNIPPET_TOKENS = 32
+# LIKE 匹配时片段中命中处前后的字符数
+SNIPPET_CONTEXT = 24
+
+# 片段中命中处的临时标记，HTML 转义后再换成 <mark>
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+
+def parse_query(text: str) -> list[str]:
+    """拆分关键词，去重并保持顺序"""
+    return list(dict.fromkeys(text.split()))[:MAX_TERMS]
+
+
+def _fts_phrase(term: str) -> str:
+    """作为 FTS5 短语，关键词中的运算符与引号不生效"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_pattern(term: str) -> str:
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _mark(text: str) -> str:
+    return html.escape(text).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _like_snippet(text: str, terms: list[str]) -> str:
+    """由正文生成片段：取第一个命中处前后各 SNIPPET_CONTEXT 个字符，并标出其中所有关键词"""
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    match = pattern.search(text)
+    if match is None:
+        start, end = 0, SNIPPET_CONTEXT * 2
+    else:
+        start, end = max(0, match.start() - SNIPPET_CONTEXT), match.end() + SNIPPET_CONTEXT
+    window = pattern.sub(lambda m: f'{_MARK_START}{m.group(0)}{_MARK_END}', text[start:end])
+    return ('…' if start > 0 else '') + _mark(window) + ('…' if end < len(text) else '')
+
+
+def search(conn: sqlite3.Connection, query: str, year: int = None, page: int = 1, page_size: int = PAGE_SIZE) -> dict:
+    """
+    :param year: 只搜索这一年（东八区）的帖子，None 为全部
+    :return:
+        {
+            "total": int,     # 命中的帖子数，至多 MAX_TOTAL
+            "more": bool,     # 命中数超过 MAX_TOTAL
+            "indexed": bool,  # 是否使用了全文索引
+            "page": int,
+            "page_size": int,
+            "results": [{"pid", "tid", "fid", "forum", "subject", "dateline", "snippet"}, ...]
+        }
+    """
+    page = max(1, page)
+    page_size = min(max(1, page_size), MAX_PAGE_SIZE)
+    fts = db.has_fts(conn)
+    result = {'total': 0, 'more': False, 'indexed': fts, 'page': page, 'page_size': page_size, 'results': []}
+    terms = parse_query(query)
+    if not terms:
+        return result
+    fts_terms = [term for term in terms if fts and len(term) >= 3]
+    like_terms = [term for term in terms if term not in fts_terms]
+
+    conditions, params = [], []
+    if fts_terms:
+        source = 'posts_fts JOIN posts p ON p.pid = posts_fts.rowid'
+        conditions.append('posts_fts MATCH ?')
+        params.append(' AND '.join(_fts_phrase(term) for term in fts_terms))
+        # 片段由 FTS5 生成，无需读取正文
+        columns = f"snippet(posts_fts, -1, '{_MARK_START}', '{_MARK_END}', '…', {SNIPPET_TOKENS}), NULL"
+        order = 'posts_fts.rowid DESC'
+    else:
+        source = 'posts p'
+        columns = 'NULL, p.message'
+        order = 'p.pid DESC'
+    for term in like_terms:
+        conditions.append("(p.subject LIKE ? ESCAPE '\\' OR p.message LIKE ? ESCAPE '\\')")
+        params += [_like_pattern(term)] * 2
+    if year:
+        conditions.append('p.dateline >= ? AND p.dateline < ?')
+        params += util.year_range(year)
+    where = ' AND '.join(conditions)
+
+    cursor = conn.cursor()
+    total = cursor.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM {source} WHERE {where} LIMIT {MAX_TOTAL + 1})',
+                           params).fetchone()[0]
+    result['total'], result['more'] = min(total, MAX_TOTAL), total > MAX_TOTAL
+    if result['total'] <= (page - 1) * page_size:
+        return result
+    cursor.execute(f'SELECT p.pid, p.tid, p.fid, p.subject, p.dateline, {columns} FROM {source} '
+                   f'WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?',
+                   params + [page_size, (page - 1) * page_size])
+    for pid, tid, fid, subject, dateline, fts_snippet, message in cursor.fetchall():
+        result['results'].append({
+            'pid': pid,
+            'tid': tid,
+            'fid': fid,
+            'forum': util.get_fid_name(fid),
+            'subject': subject,
+            'dateline': dateline,
+            'snippet': _mark(fts_snippet) if fts_snippet is not None else _like_snippet(message or '', terms)
+        })
+    return result
+
+
+def build_indexes(user_dir: str = 'data/user') -> int:
+    """为没有全文索引的 post.db 建立索引，跳过已归档与正在处理的用户（见 util.user_lock），返回建立的个数"""
+    count = 0
+    if not os.path.isdir(user_dir):
+        return count
+    for entry in os.scandir(user_dir):
+        path = os.path.join(entry.path, 'post.db')
+        if not entry.name.isdigit() or not os.path.exists(path):
+            continue
+        uid = int(entry.name)
+        with util.user_lock(uid, blocking=False) as locked:
+            if not locked:
+                continue
+            try:
+                conn = sqlite3.connect(path)
+                try:
+                    if db.has_fts(conn):
+                        continue
+                    start = time.perf_counter()
+                    db.init_fts(conn)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f'[{time.asctime()}] 建立 {uid} 的全文索引失败: {e}')
+                continue
+        count += 1
+        print(f'[{time.asctime()}] 已建立 {uid} 的全文索引，耗时 {time.perf_counter() - start:.1f}s')
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='帖子搜索')
+    parser.add_argument('--build-index', action='store_true', help='为没有全文索引的 post.db 建立索引')
+    args = parser.parse_args()
+
+    if not args.build_index:
+        parser.print_help()
+        sys.exit()
+    if db.STORE != 'user':
+        sys.exit('共享存储没有全文索引')
+    print(f'[{time.asctime()}] 共建立 {build_indexes()} 个全文索引')
@@ -0,0 +1,209 @@
+"""
+全站汇总：每个指标保存所有用户取值的有序数组，以及每个用户当前计入的取值
+
+generate_report.py 写入报告前调用 peek，在报告中写入 "超过了 X% 的用户"（按计入该用户之后计算）：在有序数组中二分查找，
+O(log n)，无需读取其他用户的 report.json；报告写入后再调用 record 更新本年的汇总（重新生成同一用户时替换其旧值），
+生成失败的报告不会被计入。有序数组随文件保存，加载时无需重新排序，更新时用 bisect.insort 插入。
+web.py 读取同一文件提供实时排名与全站统计。
+
+文件位于 data/site_stats/{year}.json，多个 main.py 实例同时生成报告时用文件锁串行更新。
+已有报告可用 python site_stats.py --rebuild 重建。
+"""
+import os
+import json
+import time
+import bisect
+import argparse
+import util
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STATS_DIR = 'data/site_stats'
+
+# 指标名 -> 从报告中取值
+METRICS = {
+    'all': lambda r: r['summary']['all'],
+    'thread': lambda r: r['summary']['thread'],
+    'reply': lambda r: r['summary']['reply'],
+    'post_days': lambda r: r['summary']['post_days'],
+    'sofa_count': lambda r: r['summary']['sofa_count'] or 0,
+    'total_support': lambda r: r['support_and_oppose']['total_support'] or 0,
+    'total_oppose': lambda r: r['support_and_oppose']['total_oppose'] or 0,
+}
+
+
+def extract(report: dict) -> dict[str, int]:
+    return {name: get(report) for name, get in METRICS.items()}
+
+
+class SiteStats:
+
+    def __init__(self, year: int, users: dict[int, dict] = None, values: dict[str, list[int]] = None,
+                 sums: dict[str, int] = None):
+        """values、sums 为已保存的有序数组与合计，不提供时由 users 计算"""
+        self.year = year
+        self.users: dict[int, dict[str, int]] = users or {}
+        if values is None or set(values) != set(METRICS):
+            values = {name: sorted(v[name] for v in self.users.values() if name in v) for name in METRICS}
+            sums = None
+        self.values: dict[str, list[int]] = values
+        self.sums: dict[str, int] = sums or {name: sum(values) for name, values in self.values.items()}
+
+    @classmethod
+    def load(cls, year: int) -> 'SiteStats':
+        try:
+            with open(f'{STATS_DIR}/{year}.json', 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls(year)
+        return cls(year, {int(uid): values for uid, values in data['users'].items()},
+                   data.get('values'), data.get('sums'))
+
+    def save(self):
+        os.makedirs(STATS_DIR, exist_ok=True)
+        data = {'year': self.year, 'updated': int(time.time()), 'users': self.users,
+                'values': self.values, 'sums': self.sums}
+        util.write_atomic(f'{STATS_DIR}/{self.year}.json',
+                          json.dumps(data, separators=(',', ':')).encode())
+
+    def update(self, uid: int, metrics: dict[str, int]):
+        """计入或替换一个用户的取值"""
+        old = self.users.get(uid, {})
+        for name in METRICS:
+            values = self.values[name]
+            if name in old:
+                values.pop(bisect.bisect_left(values, old[name]))
+                self.sums[name] -= old[name]
+            if name in metrics:
+                bisect.insort(values, metrics[name])
+                self.sums[name] += metrics[name]
+        self.users[uid] = {name: metrics[name] for name in METRICS if name in metrics}
+
+    def percentile(self, name: str, value: int) -> float | None:
+        """取值严格小于 value 的用户所占百分比"""
+        values = self.values[name]
+        if not values:
+            return None
+        return round(bisect.bisect_left(values, value) * 100 / len(values), 1)
+
+    def percentiles(self, metrics: dict[str, int]) -> dict[str, float]:
+        return {name: self.percentile(name, value) for name, value in metrics.items() if name in self.values}
+
+    def percentiles_with(self, uid: int, metrics: dict[str, int]) -> tuple[int, dict[str, float]]:
+        """不修改汇总，返回计入（或替换）uid 的取值之后的 (用户数, 各指标超过的用户百分比)"""
+        old = self.users.get(uid, {})
+        result = {}
+        for name, value in metrics.items():
+            if name not in self.values:
+                continue
+            values = self.values[name]
+            below = bisect.bisect_left(values, value) - (name in old and old[name] < value)
+            result[name] = round(below * 100 / (len(values) - (name in old) + 1), 1)
+        return len(self.users) + (uid not in self.users), result
+
+    def summary(self) -> dict:
+        """全站统计：用户数，各指标的合计、平均、中位数、90 分位与最大值"""
+        result = {'users': len(self.users)}
+        for name, values in self.values.items():
+            if values:
+                result[name] = {
+                    'sum': self.sums[name],
+                    'mean': round(self.sums[name] / len(values), 2),
+                    'median': values[len(values) // 2],
+                    'p90': values[min(len(values) * 9 // 10, len(values) - 1)],
+                    'max': values[-1]
+                }
+        return result
+
+
+class Locked:
+    """持有 data/site_stats/{year}.lock 的排他锁期间加载，退出时保存"""
+
+    def __init__(self, year: int):
+        self.year = year
+        self.lock_file = None
+        self.stats: SiteStats | None = None
+
+    def __enter__(self) -> SiteStats:
+        os.makedirs(STATS_DIR, exist_ok=True)
+        self.lock_file = open(f'{STATS_DIR}/{self.year}.lock', 'a')
+        if fcntl:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.stats = SiteStats.load(self.year)
+        return self.stats
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.stats.save()
+        finally:
+            self.lock_file.close()
+
+
+def peek(uid: int, report: dict) -> dict:
+    """
+    报告计入本年的全站汇总之后的排名，不修改汇总（报告写入后再调用 record）
+
+    :return:
+        {"users": 计入的用户数, "percentile": {指标: 超过的用户百分比}}
+    """
+    users, percentile = SiteStats.load(report['year']).percentiles_with(uid, extract(report))
+    return {'users': users, 'percentile': percentile}
+
+
+def record(uid: int, report: dict):
+    """将已写入的报告计入本年的全站汇总"""
+    with Locked(report['year']) as stats:
+        stats.update(uid, extract(report))
+
+
+class Cache:
+    """web.py 使用：文件修改后才重新加载"""
+
+    def __init__(self, year: int):
+        self.year = year
+        self.mtime = None
+        self.stats = SiteStats(year)
+
+    def get(self) -> SiteStats:
+        try:
+            mtime = os.stat(f'{STATS_DIR}/{self.year}.json').st_mtime
+        except OSError:
+            return self.stats
+        if mtime != self.mtime:
+            self.stats = SiteStats.load(self.year)
+            self.mtime = mtime
+        return self.stats
+
+
+def rebuild(year: int, user_dir: str = 'data/user') -> SiteStats:
+    """从已有的 report.json 重建汇总"""
+    users = {}
+    for entry in os.scandir(user_dir):
+        path = os.path.join(entry.path, 'report.json')
+        if entry.name.isdigit() and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    report = json.load(f)
+                if report.get('year') == year:
+                    users[int(entry.name)] = extract(report)
+            except (OSError, ValueError, KeyError):
+                continue
+    lock = Locked(year)
+    with lock:
+        lock.stats = SiteStats(year, users)
+    return lock.stats
+
+
+if __name__ == '__main__':
+    import config
+    parser = argparse.ArgumentParser(description='查看或重建全站汇总')
+    parser.add_argument('--year', type=int, default=config.year)
+    parser.add_argument('--rebuild', action='store_true', help='从 data/user 中已有的 report.json 重建')
+    args = parser.parse_args()
+    site = rebuild(args.year) if args.rebuild else SiteStats.load(args.year)
+    print(json.dumps(site.summary(), ensure_ascii=False, indent=2))
+    print(f'[{time.asctime()}] {args.year} 年共 {len(site.users)} 个用户')
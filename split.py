@@ -0,0 +1,79 @@
+"""
+将一个用户的获取拆分到多个进程
+
+config.py 中 split_processes > 1 时，预计开销（scheduler.estimate_cost 的请求数）不少于 split_min_cost 的任务
+由 main.run_units 把各类单元按块分给子进程：
+  - 列表页：每批的页范围平均分给各进程（每批页数随进程数增加，见 main.list_batch_size）
+  - find_point：待定位的 pid，每块至多 split_chunk_size 个
+  - 帖子页：请求计划中的 (tid, page)，每块至多 split_chunk_size 个
+子进程只负责请求与解析 JSON，结果返回主进程；过滤、请求计划、写入 post.db 仍在主进程，主进程是唯一的写入者。
+每个子进程各自登录，配置了 accounts 时第 i 个进程只使用 accounts[i::n]，各进程的请求来自不同账号。
+"""
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import config
+
+PROCESSES = getattr(config, 'split_processes', 0)
+MIN_COST = getattr(config, 'split_min_cost', 5000)
+CHUNK_SIZE = getattr(config, 'split_chunk_size', 200)
+
+
+def _init_worker(indexes):
+    # 子进程中才导入 main（main 导入了本模块）
+    import main
+    main.init(worker=(indexes.get(), PROCESSES))
+
+
+def _run_chunk(kind: str, units: list, uid: int) -> tuple[list, int, int]:
+    """子进程：执行一块单元，返回 ([(单元, 结果, 错误), ...], 请求数, 响应字节数)"""
+    import main
+    requests_before, bytes_before = main.api.request_count, main.api.response_bytes
+    results = list(main.run_units(kind, units, uid))
+    return results, main.api.request_count - requests_before, main.api.response_bytes - bytes_before
+
+
+class SplitPool:
+    """一个任务的子进程池，request_count、response_bytes 为子进程的累计请求数与字节数（与 WebAPI 相同，供 profiler.TaskStats 使用）"""
+
+    def __init__(self, processes: int, chunk_size: int = CHUNK_SIZE):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.request_count = 0
+        self.response_bytes = 0
+        # spawn：不继承主进程的连接池与线程
+        context = multiprocessing.get_context('spawn')
+        indexes = context.Queue()
+        for i in range(processes):
+            indexes.put(i)
+        self.executor = ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker,
+                                            initargs=(indexes,))
+
+    @classmethod
+    def for_task(cls, task: dict) -> 'SplitPool | None':
+        """预计开销足够大时返回新的进程池，否则返回 None"""
+        if PROCESSES > 1 and (task.get('cost') or 0) >= MIN_COST:
+            return cls(PROCESSES)
+        return None
+
+    def run(self, kind: str, units: list, uid: int):
+        """
+        同 main.run_units，按块完成的顺序产生 (单元, 结果, 错误)
+
+        每块不超过 chunk_size，且单元较少时平均分给各进程；子进程异常退出时该块的单元均记为失败
+        """
+        size = max(1, min(self.chunk_size, math.ceil(len(units) / self.processes)))
+        futures = {self.executor.submit(_run_chunk, kind, units[i:i + size], uid): units[i:i + size]
+                   for i in range(0, len(units), size)}
+        for future in as_completed(futures):
+            try:
+                results, requests, response_bytes = future.result()
+            except Exception as e:
+                yield from ((unit, None, repr(e)) for unit in futures[future])
+                continue
+            self.request_count += requests
+            self.response_bytes += response_bytes
+            yield from results
+
+    def close(self):
+        self.executor.shutdown()
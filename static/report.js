@@ -23,6 +23,9 @@ function renderGreenWall(year, dataDict) {
     console.error('Element #green_wall not found');
     return { downloadSVG: () => {} };
   }
+  // static_report.py 生成的静态页面中 SVG 已渲染好
+  const rendered = container.querySelector('svg');
+  if (rendered) return svgDownloader(rendered, year);
 
   // === 配置 ===
   const CELL_SIZE = 11;
@@ -196,6 +199,10 @@ function renderGreenWall(year, dataDict) {
   container.innerHTML = '';
   container.appendChild(svg);
 
+  return svgDownloader(svg, year);
+}
+
+function svgDownloader(svg, year) {
   // === 9. 生成 SVG 字符串（用于下载）===
   // 注意：必须序列化当前 DOM 中的 svg，确保与显示一致
   const svgString = new XMLSerializer().serializeToString(svg);
@@ -229,6 +236,38 @@ function set_element(element_id, str){
     if (element) element.textContent = str;
 }
 
+// 多年任务：列出各年份报告的链接
+function show_years(years, current, uid){
+    const container = document.getElementById('report_years');
+    if (!container || !years) return;
+    container.replaceChildren();
+    for (let y = years[0]; y <= years[1]; y++){
+        const item = document.createElement(y === current ? 'strong' : 'a');
+        item.textContent = `${y}年`;
+        if (y !== current) item.href = `?uid=${encodeURIComponent(uid)}&year=${y}`;
+        container.append(item, ' ');
+    }
+    container.style.display = 'block';
+}
+
+// 多年任务：与上一年相比的变化
+function show_delta(delta){
+    const message = document.getElementById('delta_message');
+    if (!message || !delta) return;
+    const signed = v => (v > 0 ? '+' : '') + v;
+    set_element('delta_year', delta.year);
+    for (const name of ['all', 'post_days', 'total_support']) set_element('delta_' + name, signed(delta.values[name]));
+    message.style.display = 'block';
+}
+
+// 全站汇总中的用户数较少时百分比没有意义，不显示
+function show_percentile(site, name){
+    if (!site || site.users < 20 || site.percentile[name] == null) return;
+    set_element('percentile_' + name, site.percentile[name]);
+    const message = document.getElementById('percentile_' + name + '_message');
+    if (message) message.style.display = 'inline';
+}
+
 function set_link(element_id, str, link){
     const element = document.getElementById(element_id);
     if (element) {
@@ -269,7 +308,10 @@ function generate_report(data){
     l = set_link;
 
     // 填入数据
-    document.title = `${user.username} - 清水河畔2025年度报告`;
+    document.title = `${user.username} - 清水河畔${year}年度报告`;
+    for (const element of document.getElementsByClassName('report_year')) element.textContent = year;
+    s('days_in_year', getDaysInYear(year));
+    show_years(data.years, year, user.uid);
 
     // 元数据
     s('report_apply_time', new Date(task.create_time * 1000).toLocaleString());
@@ -297,6 +339,9 @@ function generate_report(data){
     s('summary_all', summary.all);
     s('sofa_count', summary.sofa_count);
     s('summary_post_days', summary.post_days);
+    show_percentile(data.site, 'all');
+    show_percentile(data.site, 'total_support');
+    show_delta(data.delta);
     if (getDaysInYear(year) - summary.post_days < 90){
         const summary_reward_message = document.getElementById('summary_reward_message');
         if (summary_reward_message) summary_reward_message.style.display = 'inline';
@@ -306,10 +351,10 @@ function generate_report(data){
         else s('summary_reward', '水水奖');
     }
     s('post_most_days', summary.post_most_days.map(item => item.d).join('，'));
-    s('summary_post_days_max', summary.post_most_days[0].c);
+    s('summary_post_days_max', summary.post_most_days.length ? summary.post_most_days[0].c : 0);
     const { downloadSVG } = renderGreenWall(year, summary.post_count_per_day);
     const download_btn = document.getElementById('download_green_wall');
-    download_btn.onclick = () => {downloadSVG(`${encodeURIComponent(user.username)}的河畔2025年发帖图.svg`);};
+    download_btn.onclick = () => {downloadSVG(`${encodeURIComponent(user.username)}的河畔${year}年发帖图.svg`);};
 
     // 第一个与最后一个
     if (first_and_last.first_thread)
@@ -510,7 +555,46 @@ function generate_report(data){
         }
         s('reply_user_most_count', personal_favorite.reply_user_most[0][1]);
     }
-    // 排行榜
+    // 排行榜：分段加载时 data 中没有 rank，展开任一排行时再获取
+    if (rank) generate_rank(rank);
+    else load_rank_on_open();
+
+    // 将所有链接设为新标签打开
+    document.querySelectorAll('a').forEach(link => {
+        link.target="_blank";
+    })
+
+    // 将数据设为可见
+    let search_report_div = document.getElementById('search_report');
+    if (search_report_div) search_report.style.display = 'none';
+    let report_main_div = document.getElementById('report_main');
+    if (report_main_div) report_main.style.display = 'block';
+    if (data.preview) show_preview(user.uid);
+}
+
+// 预览报告（见 preview.py）：隐藏 .full_only 部分，完整报告生成后刷新页面
+function show_preview(uid){
+    const report_main_div = document.getElementById('report_main');
+    if (report_main_div) report_main_div.classList.add('preview');
+    const notice = document.getElementById('preview_notice');
+    if (notice) notice.style.display = 'block';
+    const timer = setInterval(async () => {
+        try {
+            const response = await fetch(`/AnnualReport/api/user_status?uid=${encodeURIComponent(uid)}`);
+            const status = await response.json();
+            if (status.status === '完成') {
+                clearInterval(timer);
+                window.location.reload();
+            }
+        } catch (e) {
+            // 网络错误时下次再试
+        }
+    }, 15000);
+}
+
+// 排行榜
+function generate_rank(rank){
+    let list;
     let thread_support_rank = document.getElementById('thread_support_rank');
     if (thread_support_rank && rank.thread_support[0]) {
         list = rank.thread_support;
@@ -525,6 +609,7 @@ function generate_report(data){
             a.href = get_thread_link(list[i][0]);
             a.textContent = list[i][2];
             cell3.appendChild(a);
+            add_excerpt(cell3, list[i][3], list[i][1]);
             const cell4 = newRow.insertCell(3);
             cell4.textContent = list[i][5];
         }
@@ -543,6 +628,7 @@ function generate_report(data){
             a.href = get_thread_link(list[i][0]);
             a.textContent = list[i][2];
             cell3.appendChild(a);
+            add_excerpt(cell3, list[i][3], list[i][1]);
             const cell4 = newRow.insertCell(3);
             cell4.textContent = list[i][5];
         }
@@ -561,6 +647,7 @@ function generate_report(data){
             a.href = get_thread_link(list[i][0]);
             a.textContent = list[i][3];
             cell3.appendChild(a);
+            add_excerpt(cell3, list[i][4], list[i][1]);
             const cell4 = newRow.insertCell(3);
             a = document.createElement('a');
             a.href = get_post_link(list[i][1]);
@@ -584,6 +671,7 @@ function generate_report(data){
             a.href = get_thread_link(list[i][0]);
             a.textContent = list[i][3];
             cell3.appendChild(a);
+            add_excerpt(cell3, list[i][4], list[i][1]);
             const cell4 = newRow.insertCell(3);
             a = document.createElement('a');
             a.href = get_post_link(list[i][1]);
@@ -661,16 +749,83 @@ function generate_report(data){
         }
     }
 
-    // 将所有链接设为新标签打开
-    document.querySelectorAll('a').forEach(link => {
+    const report_rank = document.getElementById('report_rank');
+    if (report_rank) report_rank.querySelectorAll('a').forEach(link => {
         link.target="_blank";
     })
+}
 
-    // 将数据设为可见
-    let search_report_div = document.getElementById('search_report');
-    if (search_report_div) search_report.style.display = 'none';
-    let report_main_div = document.getElementById('report_main');
-    if (report_main_div) report_main.style.display = 'block';
+// 展开任一排行时获取排行（/api/get_report?part=rank），失败时下次展开再试
+function load_rank_on_open(){
+    const report_rank = document.getElementById('report_rank');
+    if (!report_rank) return;
+    let loading = null;
+    for (const details of report_rank.getElementsByTagName('details')) {
+        details.addEventListener('toggle', () => {
+            if (!details.open || loading) return;
+            set_element('rank_status', '正在加载排行榜…');
+            loading = fetch_api(`/AnnualReport/api/get_report?${report_query}&part=rank`)
+                .then(data => {
+                    generate_rank(data.rank);
+                    set_element('rank_status', '');
+                })
+                .catch(error => {
+                    loading = null;
+                    set_element('rank_status', `排行榜加载失败: ${error.message}`);
+                });
+        });
+    }
+}
+
+// 排行中的正文摘要，点击后获取全文（/api/get_post）
+function add_excerpt(cell, text, pid){
+    if (!text) return;
+    const div = document.createElement('div');
+    div.className = 'excerpt';
+    div.textContent = text;
+    div.title = '点击查看全文';
+    div.addEventListener('click', async () => {
+        if (div.classList.contains('excerpt_full')) return;
+        try {
+            const data = await fetch_api(`/AnnualReport/api/get_post?${report_query}&pid=${encodeURIComponent(pid)}`);
+            div.textContent = data.message;
+            div.classList.add('excerpt_full');
+            div.title = '';
+        } catch (error) {
+            div.title = `获取全文失败: ${error.message}`;
+        }
+    });
+    cell.appendChild(div);
+}
+
+// 当前报告的查询参数（uid 与 year），获取排行与全文时使用
+let report_query = '';
+
+// 请求 API，返回 data，失败时抛出带错误信息的 Error
+async function fetch_api(url){
+    const response = await fetch(url);
+    let result;
+    try {
+        result = await response.json();
+    } catch (e) {
+        // JSON 解析失败
+        if (!response.ok) {
+            throw new Error(`错误: ${response.status} ${response.statusText}`);
+        } else {
+            throw new Error('服务器返回了非 JSON 内容');
+        }
+    }
+    if (typeof result === 'object' && result !== null && 'code' in result) {
+        if (result.code === 0) {
+            // 成功
+            if (!result.data) {
+                throw new Error('API 返回成功，但缺少 data 字段');
+            }
+            return result.data;
+        }
+        throw new Error(result.message || '未知 API 错误');
+    }
+    throw new Error('API 返回的数据格式无效');
 }
 
 // 获取数据
@@ -691,37 +846,16 @@ document.addEventListener('DOMContentLoaded', async () => {
         if (!Number.isInteger(uid) || uid <= 0) {
             throw new Error('UID 必须为正整数');
         }
-        // api 请求
-        const response = await fetch(`/AnnualReport/api/get_report?uid=${encodeURIComponent(uid)}`);
-        let result;
-        let parsedJson = false;
-        try {
-            result = await response.json();
-            parsedJson = true;
-        } catch (e) {
-            // JSON 解析失败
-            if (!response.ok) {
-                throw new Error(`错误: ${response.status} ${response.statusText}`);
-            } else {
-                throw new Error('服务器返回了非 JSON 内容');
-            }
+        const year = params.get('year');
+        report_query = `uid=${encodeURIComponent(uid)}` + (year ? `&year=${encodeURIComponent(year)}` : '');
+        // 静态页面（static_report.py）中已内联报告数据
+        const inline = document.getElementById('report_data');
+        if (inline) {
+            generate_report(JSON.parse(inline.textContent));
+            return;
         }
-        if (parsedJson && typeof result === 'object' && result !== null) {
-            if ('code' in result) {
-                if (result.code === 0) {
-                    // 成功
-                    if (!result.data) {
-                        throw new Error('API 返回成功，但缺少 data 字段');
-                    }
-                    generate_report(result.data);
-                    return; // 正常结束
-                } else {
-                    throw new Error(result.message || '未知 API 错误');
-                }
-            }
-        }
-        throw new Error('API 返回的数据格式无效');
-
+        // api 请求：先获取首屏内容（part=core），排行在展开时获取
+        generate_report(await fetch_api(`/AnnualReport/api/get_report?${report_query}&part=core`));
     } catch (error) {
         // 统一错误展示
         container.innerHTML = `<h1 style="color: #ff2121; margin: 1em 0;">错误: ${error.message}</h1>`;
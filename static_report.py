@@ -0,0 +1,110 @@
+"""
+静态报告页面
+
+config.py 中设置 static_report_dir 时，generate_report.py 为每个用户写入 {static_report_dir}/{uid}/index.html
+（多年任务的各年份另写 {year}.html）及其预压缩版本 .gz、.br：
+  - 以 static/report.html 为模板，精简报告（含排行）内联在 <script type="application/json" id="report_data"> 中
+  - 发帖热力图的 SVG 已渲染在 #green_wall 中（与 report.js 的 renderGreenWall 输出相同）
+report.js 检测到内联数据时直接渲染，不再请求 /api/get_report，nginx 可直接发送这些文件（配置见 README）。
+"""
+import os
+import json
+import html
+import datetime
+import config
+import util
+
+STATIC_REPORT_DIR = getattr(config, 'static_report_dir', None)
+TEMPLATE_PATH = 'static/report.html'
+
+CELL_SIZE = 11
+CELL_SPACING = 3
+MONTH_LABELS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+WEEKDAY_SHORT = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+# (上限, 颜色)，超过最后一个上限为黑色
+COLOR_STEPS = [(0, "#ebedf0"), (10, "#9be9a8"), (20, "#40c463"), (30, "#30904e"), (50, "#216e39"),
+               (100, "#ffd700"), (150, "#daa520"), (200, "#b8860b"),
+               (300, "#ff0000"), (500, "#cd0000"), (1000, "#8b0000")]
+
+
+def get_color(value: int) -> str:
+    for limit, color in COLOR_STEPS:
+        if value <= limit:
+            return color
+    return '#000000'
+
+
+def green_wall_svg(year: int, post_count_per_day: dict[str, int]) -> str:
+    """发帖热力图的 SVG，post_count_per_day 的键为 MM-DD"""
+    first = datetime.date(year, 1, 1)
+    days = (datetime.date(year + 1, 1, 1) - first).days
+    # 周日为 0，与 JS 的 getUTCDay 相同
+    padding = (first.weekday() + 1) % 7
+    cells = [None] * padding + [first + datetime.timedelta(days=i) for i in range(days)]
+    cells += [None] * (-len(cells) % 7)
+    weeks = [cells[i:i + 7] for i in range(0, len(cells), 7)]
+
+    left_margin, top_margin = 32, 20
+    step = CELL_SIZE + CELL_SPACING
+    width = len(weeks) * step + left_margin + 10
+    height = 7 * step + top_margin + 10
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}" style="font-family: -apple-system, BlinkMacSystemFont, '
+             f'\'Segoe UI\', Helvetica, Arial, sans-serif;">']
+    for col, week in enumerate(weeks):
+        for row, day in enumerate(week):
+            value = post_count_per_day.get(day.strftime('%m-%d'), 0) if day else 0
+            rect = (f'<rect x="{col * step + left_margin}" y="{row * step + top_margin}" width="{CELL_SIZE}" '
+                    f'height="{CELL_SIZE}" fill="{get_color(value)}" shape-rendering="crispEdges"')
+            # 悬停提示（仅真实数据）
+            parts.append(f'{rect}><title>{day.isoformat()}: {value} posts</title></rect>' if day else f'{rect}/>')
+    # 月份标签（顶部）
+    last_month = None
+    for col, week in enumerate(weeks):
+        day = next((d for d in week if d), None)
+        if day and day.month != last_month:
+            parts.append(f'<text x="{col * step + left_margin}" y="12" font-size="10" fill="#666">'
+                         f'{MONTH_LABELS[day.month - 1]}</text>')
+            last_month = day.month
+    # 星期标签（左侧）
+    for row, label in enumerate(WEEKDAY_SHORT):
+        y = row * step + top_margin + CELL_SIZE / 2 + 3
+        parts.append(f'<text x="{left_margin - 6}" y="{y:g}" font-size="9" fill="#666" text-anchor="end">'
+                     f'{label}</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def render(compact: dict, template: str) -> bytes:
+    """
+    :param compact: generate_report.compact_report 的结果（task 可只含 report.js 用到的字段）
+    :param template: static/report.html 的内容
+    """
+    title = f'{compact["user"]["username"]} - 清水河畔{compact["year"]}年度报告'
+    # 内联的 JSON 中不能出现 </script>，转义所有 <
+    data = json.dumps(compact, ensure_ascii=False, separators=(',', ':')).replace('<', '\\u003c')
+    page = template.replace('<title>清水河畔2025年度报告</title>', f'<title>{html.escape(title)}</title>', 1)
+    page = page.replace('<div id="green_wall"></div>',
+                        f'<div id="green_wall">{green_wall_svg(compact["year"], compact["summary"]["post_count_per_day"])}'
+                        f'</div>', 1)
+    page = page.replace('<script src="/AnnualReport/static/report.js"',
+                        f'<script type="application/json" id="report_data">{data}</script>\n'
+                        f'<script src="/AnnualReport/static/report.js"', 1)
+    return page.encode()
+
+
+def write(uid: int, name: str, compact: dict) -> dict[str, int]:
+    """
+    写入 {STATIC_REPORT_DIR}/{uid}/{name}.html 及其预压缩版本，未设置 static_report_dir 时不写入
+
+    :return:
+        文件名对字节数的dict，同 util.write_precompressed
+    """
+    if not STATIC_REPORT_DIR:
+        return {}
+    with open(TEMPLATE_PATH, 'r', encoding='utf-8') as f:
+        template = f.read()
+    user_dir = os.path.join(STATIC_REPORT_DIR, str(uid))
+    os.makedirs(user_dir, exist_ok=True)
+    sizes = util.write_precompressed(os.path.join(user_dir, f'{name}.html'), render(compact, template))
+    return {f'static/{k}': v for k, v in sizes.items()}
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+import db
+import util
+import scheduler
+import preview
+
+
+class UserStatusIndex:
+    """
+    用户状态的内存索引，供 web.py 的 user_status_api / get_user_total_api 使用
+
+    启动时扫描一次 data/user 与 data/queue，之后由 notify 事件（见 handle）保持更新，
+    并定期完整重扫一次，修正可能丢失的 UDP 事件。查询时不访问磁盘。
+
+    单个用户的记录格式：
+        {
+            "report": bool,   # report.json 是否存在
+            "preview": bool,  # 预览报告是否存在（见 preview.py）
+            "db": bool,       # post.db 或其归档 post.db.gz 是否存在（共享存储时为用户目录是否存在）
+            "size": int,      # post.db（已归档时为 post.db.gz）字节数
+            "task": dict,     # task.json 内容（报告已生成时）
+            "failed": bool    # 报告生成失败
+        }
+    """
+
+    def __init__(self, user_dir: str = 'data/user', queue_dir: str = 'data/queue', reconcile_interval: int = 120,
+                 policy: str = 'hrrn', request_seconds: float = 0.02):
+        self.user_dir = Path(user_dir)
+        self.queue_dir = Path(queue_dir)
+        self.reconcile_interval = reconcile_interval
+        # 与 main.py 使用相同的排序（见 scheduler.py）
+        self.policy = policy
+        self.request_seconds = request_seconds
+        self.lock = threading.Lock()
+        self.users: dict[int, dict] = {}
+        self.queue: dict[int, tuple[float, int | None]] = {}  # uid -> (mtime, 预计开销)
+        self.rank: dict[int, int] = {}  # uid -> 队列排名（从 1 开始）
+        self.order: list[int] = []  # 按处理顺序排列的 uid
+        self.running: dict[int, dict] = {}  # uid -> {"cost": 预计开销, "started": 开始时间}，用于 ETA
+
+    def start(self):
+        """扫描磁盘，然后启动定期重扫线程；事件需由调用者通过 notify.listen 转交给 handle"""
+        self.seed()
+        threading.Thread(target=self._reconcile_loop, name='status-reconcile', daemon=True).start()
+
+    def _read_user(self, uid: int) -> dict:
+        user_path = self.user_dir / str(uid)
+        db_path = user_path / 'post.db'
+        if not db_path.exists() and (user_path / 'post.db.gz').exists():
+            # 已被 compact.py 归档
+            db_path = user_path / 'post.db.gz'
+        entry = {
+            'report': (user_path / 'report.json').exists(),
+            'preview': (user_path / preview.PREVIEW_NAME).exists(),
+            'db': db_path.exists() or db.STORE == 'shared' and user_path.is_dir(),
+            'size': 0,
+            'task': {}
+        }
+        if entry['db']:
+            try:
+                entry['size'] = db_path.stat().st_size
+            except OSError:
+                pass
+        task = {}
+        if entry['report'] or entry['db']:
+            try:
+                with open(user_path / 'task.json', 'r', encoding='utf-8') as f:
+                    task = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                pass
+        if entry['report']:
+            entry['task'] = task
+        # generate_report.py 异常退出（见 util.mark_report_failed）
+        entry['failed'] = not entry['report'] and 'report_error' in task
+        return entry
+
+    def _scan_queue(self) -> dict[int, tuple[float, int | None]]:
+        queue = {}
+        if self.queue_dir.exists():
+            for f in self.queue_dir.iterdir():
+                if f.name.isdigit():
+                    try:
+                        queue[int(f.name)] = (f.stat().st_mtime, util.get_queue_cost(f))
+                    except OSError:
+                        continue
+        return queue
+
+    def _update_rank(self):
+        """按调度顺序重新计算排名（调用者需持有锁）"""
+        self.order = scheduler.order(self.queue, self.policy, self.request_seconds)
+        self.rank = {uid: idx for idx, uid in enumerate(self.order, start=1)}
+
+    def seed(self):
+        """完整扫描磁盘，重建索引"""
+        users = {}
+        if self.user_dir.exists():
+            for entry in os.scandir(self.user_dir):
+                if entry.is_dir() and entry.name.isdigit():
+                    uid = int(entry.name)
+                    users[uid] = self._read_user(uid)
+        queue = self._scan_queue()
+        with self.lock:
+            self.users = users
+            self.queue = queue
+            # 超过 6 小时仍未完成的任务视为已中断
+            self.running = {uid: r for uid, r in self.running.items() if time.time() - r['started'] < 6 * 3600}
+            self._update_rank()
+
+    def _reconcile_loop(self):
+        while True:
+            time.sleep(self.reconcile_interval)
+            try:
+                self.seed()
+            except Exception as e:
+                print(f'[{time.asctime()}] 状态索引重扫失败: {e}')
+
+    def handle(self, event: dict):
+        """处理一条 notify 事件"""
+        uid = event['uid']
+        match event.get('event'):
+            case 'enqueue':
+                # 远程节点的租约过期后任务会放回队列（见 lease.py），此时不再是正在处理
+                entry = self._read_user(uid) if uid in self.running else None
+                with self.lock:
+                    self.queue[uid] = (event.get('mtime', time.time()), event.get('cost'))
+                    self._update_rank()
+                    if entry is not None:
+                        self.running.pop(uid, None)
+                        self.users[uid] = entry
+            case 'estimate':
+                with self.lock:
+                    if uid in self.queue:
+                        self.queue[uid] = (self.queue[uid][0], event.get('cost'))
+                        self._update_rank()
+            case 'start':
+                with self.lock:
+                    _, cost = self.queue.pop(uid, (None, None))
+                    self.running[uid] = {'cost': event.get('cost') or cost, 'started': time.time()}
+                    self._update_rank()
+                    old = self.users.get(uid)
+                    self.users[uid] = old | {'db': True, 'failed': False} if old else {
+                        'report': False, 'preview': False, 'db': True, 'size': 0, 'task': {}, 'failed': False}
+            case 'preview':
+                with self.lock:
+                    if uid in self.users:
+                        self.users[uid] = self.users[uid] | {'preview': True}
+            case 'data_done' | 'report_done' | 'report_failed':
+                entry = self._read_user(uid)
+                with self.lock:
+                    self.users[uid] = entry
+                    if event['event'] != 'data_done':
+                        self.running.pop(uid, None)
+
+    def get(self, uid: int) -> tuple[dict | None, int | None]:
+        """
+        :return:
+            (用户记录或None, 队列排名或None)
+        """
+        with self.lock:
+            return self.users.get(uid), self.rank.get(uid)
+
+    def ahead(self, uid: int) -> tuple[dict[int, dict], list[int | None], int | None]:
+        """
+        :return:
+            (正在处理的任务 {uid: {"cost", "started"}}, 队列中排在 uid 之前的任务的预计开销, uid 自己的预计开销)
+        """
+        with self.lock:
+            rank = self.rank.get(uid)
+            queued = [self.queue[u][1] for u in self.order[:rank - 1]] if rank else []
+            cost = self.queue[uid][1] if uid in self.queue else None
+            return dict(self.running), queued, cost
+
+    def running_info(self, uid: int) -> dict | None:
+        with self.lock:
+            return self.running.get(uid)
+
+    def finished_tasks(self) -> list[dict]:
+        """已生成报告的用户的 task.json，供 eta.EtaModel.fit 使用"""
+        with self.lock:
+            return [entry['task'] for entry in self.users.values() if entry['task']]
+
+    def user_count(self) -> int:
+        return len(self.users)
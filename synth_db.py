@@ -0,0 +1,184 @@
+"""
+生成合成的 post.db，用于在不访问论坛的情况下测试 generate_report.py 的性能
+
+数据分布尽量接近真实用户：
+  - 约 8% 为主题帖，其余为回复；回复集中在少数主题中（Zipf 分布）
+  - 版块取自 util.get_fid_name 中的 fid，同样按 Zipf 分布偏向少数常去的版块
+  - 发帖时间有季节性（寒暑假少、学期中多）、周末与作息差异，约 85% 落在目标年份内
+  - 约 40% 的回复带有引用，正文为 format 0（Discuz 代码）或 format 2（Markdown）的引用格式，
+    reply_pid 与 reply_user 由 util.get_reply_pid_and_username 解析得到，与 main.py 一致
+  - 点赞、点踩、浏览、回复、收藏数为长尾分布
+
+用法：
+    python synth_db.py data/user/1000001/post.db --posts 100000 --year 2025
+"""
+import os
+import json
+import math
+import random
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+import db
+import util
+
+FIDS = [int(fid) for fid in util.FID_NAMES]
+
+# 每月的相对活跃度（1、2、7、8 月为寒暑假）
+MONTH_WEIGHTS = [0.6, 0.5, 1.2, 1.2, 1.1, 1.0, 0.6, 0.5, 1.3, 1.2, 1.1, 1.0]
+# 每小时的相对活跃度
+HOUR_WEIGHTS = [0.6, 0.4, 0.2, 0.1, 0.05, 0.05, 0.1, 0.3, 0.6, 0.8, 1.0, 1.0,
+                1.1, 0.9, 0.9, 1.0, 1.0, 1.0, 0.9, 1.0, 1.2, 1.3, 1.3, 1.0]
+
+THREAD_RATIO = 0.08
+IN_YEAR_RATIO = 0.85
+QUOTE_RATIO = 0.4
+BATCH_SIZE = 10000
+
+
+def zipf_weights(n: int, s: float = 1.1) -> list[float]:
+    return [1 / (i + 1) ** s for i in range(n)]
+
+
+def long_tail(rng: random.Random, mean: float) -> int:
+    """大部分为 0 的长尾分布"""
+    if rng.random() < 0.7:
+        return 0
+    return int(rng.paretovariate(1.5) * mean)
+
+
+class Calendar:
+    """按季节、星期与作息加权的时间戳采样"""
+
+    def __init__(self, rng: random.Random, year: int):
+        self.rng = rng
+        self.year = year
+        start = datetime(year, 1, 1)
+        self.days = [start + timedelta(days=i) for i in range((datetime(year + 1, 1, 1) - start).days)]
+        self.day_weights = [MONTH_WEIGHTS[d.month - 1] * (0.8 if d.weekday() >= 5 else 1.0) for d in self.days]
+        self.cum_days = self._cumulative(self.day_weights)
+        self.cum_hours = self._cumulative(HOUR_WEIGHTS)
+
+    @staticmethod
+    def _cumulative(weights: list[float]) -> list[float]:
+        total, result = 0, []
+        for w in weights:
+            total += w
+            result.append(total)
+        return result
+
+    def sample(self) -> int:
+        rng = self.rng
+        if rng.random() < IN_YEAR_RATIO:
+            day = rng.choices(self.days, cum_weights=self.cum_days)[0]
+        else:
+            # 目标年份之外（往年或次年初）
+            if rng.random() < 0.8:
+                day = self.days[0] - timedelta(days=rng.randint(1, 365 * 3))
+            else:
+                day = self.days[-1] + timedelta(days=rng.randint(1, 60))
+        hour = rng.choices(range(24), cum_weights=self.cum_hours)[0]
+        return int(day.timestamp()) + hour * 3600 + rng.randint(0, 3599)
+
+
+def quote_message(rng: random.Random, reply_pid: int, username: str, dateline: int, body: str) -> tuple[str, int]:
+    """生成带引用的回复正文，返回 (message, format)"""
+    t = datetime.fromtimestamp(dateline - rng.randint(60, 86400))
+    if rng.random() < 0.5:
+        message = (f'[quote][size=2][url=forum.php?mod=redirect&goto=findpost&pid={reply_pid}&ptid=0]'
+                   f'[color=#999999]{username} 发表于 {t:%Y-%m-%d %H:%M}[/color][/url][/size]\n'
+                   f'被引用的内容[/quote]{body}')
+        return message, 0
+    message = f'> {username} 发表于 [{t:%Y-%m-%d %H:%M}](/goto/{reply_pid})\n> 被引用的内容\n\n{body}'
+    return message, 2
+
+
+def generate(path: str, uid: int, n_posts: int, year: int, seed: int = 0) -> dict:
+    """
+    生成一个包含 n_posts 条帖子的 post.db（会覆盖已有文件）
+
+    :return:
+        {"posts": 帖子数, "threads": 主题数, "replies": 回复数, "bytes": 文件大小}
+    """
+    rng = random.Random(seed)
+    calendar = Calendar(rng, year)
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path)
+    db.init_db(conn)
+    user_info = {
+        'uid': uid, 'register_time': int(datetime(year - 3, 9, 1).timestamp()),
+        'user_summary': {'username': f'synth{uid}', 'group_title': '合成用户', 'group_subtitle': None}
+    }
+    db.insert_user_info(conn, uid, json.dumps(user_info, ensure_ascii=False, separators=(',', ':')))
+
+    n_threads = max(1, int(n_posts * THREAD_RATIO))
+    n_replies = n_posts - n_threads
+    cum_fids = Calendar._cumulative(zipf_weights(len(FIDS)))
+    fids = FIDS[:]
+    rng.shuffle(fids)
+    # 被回复的主题：用户自己的主题加上其他人的主题，回复数量按 Zipf 分布集中
+    other_threads = max(1, int(math.sqrt(n_replies) * 8))
+    other_users = [f'user{i}' for i in range(max(10, int(math.sqrt(n_posts) * 3)))]
+    user_weights = zipf_weights(len(other_users))
+
+    next_pid = uid * 10 ** 7
+    thread_rows = []
+    batch = []
+    for i in range(n_threads):
+        next_pid += 1
+        tid = uid * 10 ** 6 + i
+        fid = rng.choices(fids, cum_weights=cum_fids)[0]
+        thread_rows.append((tid, fid, f'主题 {tid}'))
+        batch.append({
+            'thread_id': tid, 'post_id': next_pid, 'forum_id': fid, 'position': 1, 'subject': f'主题 {tid}',
+            'message': f'主题 {tid} 的正文。' * rng.randint(1, 20), 'dateline': calendar.sample(),
+            'views': long_tail(rng, 300) + rng.randint(10, 100), 'replies': long_tail(rng, 20),
+            'support': long_tail(rng, 3), 'oppose': long_tail(rng, 1), 'favorite': long_tail(rng, 2)
+        })
+    db.insert_posts(conn, batch)
+
+    for i in range(other_threads):
+        tid = (uid + 1) * 10 ** 6 + i
+        thread_rows.append((tid, rng.choices(fids, cum_weights=cum_fids)[0], f'他人的主题 {tid}'))
+    rng.shuffle(thread_rows)
+    thread_weights = zipf_weights(len(thread_rows), 1.0)
+    cum_threads = Calendar._cumulative(thread_weights)
+    cum_users = Calendar._cumulative(user_weights)
+
+    batch = []
+    for i in range(n_replies):
+        next_pid += 1
+        tid, fid, subject = rng.choices(thread_rows, cum_weights=cum_threads)[0]
+        dateline = calendar.sample()
+        body = f'回复 {next_pid}。' * rng.randint(1, 8)
+        post = {
+            'thread_id': tid, 'post_id': next_pid, 'forum_id': fid, 'subject': subject, 'dateline': dateline,
+            'position': 2 if rng.random() < 0.05 else rng.randint(3, 2000),
+            'support': long_tail(rng, 2), 'oppose': long_tail(rng, 1), 'format': 0, 'message': body
+        }
+        if rng.random() < QUOTE_RATIO:
+            username = rng.choices(other_users, cum_weights=cum_users)[0]
+            quoted_pid = next_pid - rng.randint(1, 10000)
+            post['message'], post['format'] = quote_message(rng, quoted_pid, username, dateline, body)
+        parsed = util.get_reply_pid_and_username(post)
+        post['reply_pid'], post['reply_user'] = (tid, f'author{tid % 997}') if parsed is None else parsed
+        batch.append(post)
+        if len(batch) >= BATCH_SIZE:
+            db.insert_posts(conn, batch)
+            batch = []
+    db.insert_posts(conn, batch)
+    conn.close()
+    return {'posts': n_posts, 'threads': n_threads, 'replies': n_replies, 'bytes': os.path.getsize(path)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成合成的 post.db')
+    parser.add_argument('path', help='输出文件路径')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--year', type=int, default=datetime.now().year)
+    parser.add_argument('--uid', type=int, default=1000001)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(generate(args.path, args.uid, args.posts, args.year, args.seed), ensure_ascii=False))
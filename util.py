@@ -1,7 +1,21 @@
 import os
 import json
+import gzip
+import time
+import datetime
+from contextlib import contextmanager
 from pathlib import Path
-import shutil
+import scheduler
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 def init_folder():
@@ -11,21 +25,47 @@ def init_folder():
     os.makedirs('data/read', exist_ok=True)
 
 
-def get_next_task() -> dict | None:
+def year_range(year: int) -> tuple[int, int]:
+    """某一年（东八区）的时间戳范围 [当年 1 月 1 日 0 时, 次年 1 月 1 日 0 时)"""
+    tz_utc8 = datetime.timezone(datetime.timedelta(hours=8))
+    return (int(datetime.datetime(year, 1, 1, tzinfo=tz_utc8).timestamp()),
+            int(datetime.datetime(year + 1, 1, 1, tzinfo=tz_utc8).timestamp()))
+
+
+def parse_years(text: str) -> list[int]:
+    """将 2023-2025 或 2024 解析为 [起始年, 结束年]"""
+    first, _, last = text.partition('-')
+    first, last = int(first), int(last or first)
+    if first > last:
+        raise ValueError(f'起始年大于结束年: {text}')
+    return [first, last]
+
+
+def get_queue_cost(path) -> int | None:
+    """读取队列文件中 main.py 写入的预计开销（请求数），尚未估计或无法读取时返回 None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cost = json.load(f).get('cost')
+        return cost if isinstance(cost, int) else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_next_task(policy: str = 'hrrn', request_seconds: float = 0.02, claim_dir: str = 'data/read') -> dict | None:
     """获取下一个任务
 
     从 'data/queue' 目录中：
       - 找到所有纯数字命名的文件（无后缀）
-      - 按 **修改时间（mtime）从早到晚** 排序
-      - 取最早的一个，解析为 JSON
-      - 将该文件移入 'data/read'（无论成功与否）
-      - 返回解析结果
+      - 按 scheduler.order 排序（默认按预计开销与等待时间的响应比；policy 为 fifo 时按修改时间从早到晚）
+      - 用 os.rename 将第一个文件移入 claim_dir（默认 'data/read'）：rename 是原子的，多个消费者
+        （多个 main.py、web.py 的租约接口）同时取同一个文件时只有一个成功，失败者改取下一个
+      - 解析为 JSON，返回解析结果
 
     异常处理：
       - 若目录不存在或为空 → 返回 None
       - 若文件名非纯数字 → 跳过（不处理）
-      - 若 JSON 解析失败 → 移动文件到 read，返回 None
-      - 若解析结果不是 dict[str, int] → 移动文件到 read，返回 None
+      - 若 JSON 解析失败 → 文件移入 read，返回 None
+      - 若解析结果不是 dict[str, int | list[int]] → 移动文件到 read，返回 None
     """
     queue_dir = Path("data/queue")
     read_dir = Path("data/read")
@@ -37,13 +77,13 @@ def get_next_task() -> dict | None:
         return None
 
     # 收集所有“纯数字命名”的文件
-    numeric_files = []
+    numeric_files = {}
     for f in queue_dir.iterdir():
         if f.is_file() and f.name.isdigit():
             try:
-                # 获取修改时间（用于排序）
+                # 获取修改时间（即加入队列的时间，用于排序）
                 mtime = f.stat().st_mtime
-                numeric_files.append((f, mtime))
+                numeric_files[int(f.name)] = (mtime, get_queue_cost(f) if policy != 'fifo' else None)
             except OSError:
                 # 如果无法获取 stat（如文件被删除），跳过
                 continue
@@ -51,35 +91,43 @@ def get_next_task() -> dict | None:
     if not numeric_files:
         return None
 
-    # 按修改时间升序排序（最早的时间在前）
-    numeric_files.sort(key=lambda x: x[1])
-    first_file = numeric_files[0][0]
-    target_path = read_dir / first_file.name
+    claim_dir = Path(claim_dir)
+    claim_dir.mkdir(parents=True, exist_ok=True)
+    for uid in scheduler.order(numeric_files, policy, request_seconds):
+        target_path = claim_dir / str(uid)
+        try:
+            os.rename(queue_dir / str(uid), target_path)
+            break
+        except OSError:
+            # 已被其他消费者取走
+            continue
+    else:
+        return None
 
     try:
         # 读取并解析 JSON
-        with open(first_file, 'r', encoding='utf-8') as f:
+        with open(target_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
 
-        # 验证类型：必须是 dict[str, int]
+        # 验证类型：必须是 dict[str, int | list[int]]
         if isinstance(data, dict):
             for k, v in data.items():
-                if not (isinstance(k, str) and isinstance(v, int)):
-                    raise ValueError("Not dict[str, int]")
+                # 值为整数，或整数列表（years）
+                if not (isinstance(k, str) and (isinstance(v, int) or
+                                                isinstance(v, list) and all(isinstance(i, int) for i in v))):
+                    raise ValueError("Not dict[str, int | list[int]]")
         else:
             raise ValueError("Not a dict")
 
-        # 成功解析后，移动文件到 read
-        shutil.move(str(first_file), str(target_path))
         return data
 
     except (json.JSONDecodeError, ValueError, OSError, UnicodeDecodeError) as e:
-        # 任何错误都移动坏文件到 read（避免重复处理）
-        try:
-            shutil.move(str(first_file), str(target_path))
-        except (OSError, shutil.Error):
-            # 如果移动失败（如目标已存在），尝试删除原文件
-            first_file.unlink(missing_ok=True)
+        # 任何错误都将坏文件留在 read（避免重复处理）
+        if claim_dir != read_dir:
+            try:
+                os.replace(target_path, read_dir / target_path.name)
+            except OSError:
+                target_path.unlink(missing_ok=True)
         return None
 
 
@@ -112,8 +160,78 @@ def get_reply_pid_and_username(post: dict):
 
 
 def save_task_metadata(uid: int, task: dict):
-    with open(f'data/user/{uid}/task.json', 'w', encoding='utf-8') as f:
-        json.dump(task, f, ensure_ascii=False, separators=(',', ':'))
+    write_atomic(f'data/user/{uid}/task.json', json.dumps(task, ensure_ascii=False, separators=(',', ':')).encode())
+
+
+@contextmanager
+def user_lock(uid: int, blocking: bool = True):
+    """
+    持有 data/user/{uid}/task.lock 的排他锁：main.process_task 在整个任务期间持有，compact.py 据此跳过正在处理的用户
+
+    :param blocking: 为 False 时不等待，锁被占用时产生 False
+    :return: 上下文中产生是否已获得锁（没有 fcntl 的系统上总为 True）
+    """
+    os.makedirs(f'data/user/{uid}', exist_ok=True)
+    with open(f'data/user/{uid}/task.lock', 'a') as lock_file:
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+
+
+def mark_report_failed(uid: int, task: dict, returncode: int):
+    """generate_report.py 异常退出：记入 task.json 的 report_error，状态页显示失败而不是一直“正在获取数据”"""
+    # notify 依赖 config，仅在此处导入
+    import notify
+    task['report_error'] = returncode
+    save_task_metadata(uid, task)
+    notify.send('report_failed', uid, code=returncode)
+    print(f'[{time.asctime()}] \033[31;1m报告生成失败: {uid}，返回值 {returncode}\033[m')
+
+
+def write_atomic(path: str, data: bytes):
+    """
+    原子写入文件：先写入同目录下的临时文件，再 rename 覆盖目标
+
+    读者（web.py / nginx）要么看到旧文件，要么看到完整的新文件，不会读到写了一半的内容
+    """
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def write_precompressed(path: str, data: bytes) -> dict[str, int]:
+    """
+    写入 path 以及预压缩的 path.gz、path.br（未安装 brotli 时跳过 .br）
+
+    供 nginx 的 gzip_static/brotli_static 或 web.py 直接发送，请求时无需再压缩
+
+    :return:
+        文件名对字节数的dict，例如 {'report.min.json': 1024, 'report.min.json.gz': 300}
+    """
+    name = os.path.basename(path)
+    sizes = {}
+    write_atomic(path, data)
+    sizes[name] = len(data)
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    write_atomic(f'{path}.gz', gz)
+    sizes[f'{name}.gz'] = len(gz)
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        write_atomic(f'{path}.br', br)
+        sizes[f'{name}.br'] = len(br)
+    else:
+        # 避免残留上一次生成的 .br 与新内容不一致
+        Path(f'{path}.br').unlink(missing_ok=True)
+    return sizes
 
 
 def set_page(tid_position_dict: dict[int, list[int]], page_size: int = 20) -> dict[int, dict[int, list[int]]]:
@@ -152,95 +270,97 @@ def set_page(tid_position_dict: dict[int, list[int]], page_size: int = 20) -> di
     return result
 
 
+FID_NAMES = {
+    "1": "站务管理",
+    "2": "站务公告",
+    "17": "同城同乡",
+    "20": "学术交流",
+    "25": "水手之家",
+    "42": "经典图吧",
+    "44": "时政要闻",
+    "45": "情感专区",
+    "46": "站务综合",
+    "55": "视觉艺术",
+    "61": "二手专区",
+    "66": "电子数码",
+    "70": "程序员之家",
+    "74": "音乐空间",
+    "95": "科技学术",
+    "109": "成电轨迹",
+    "111": "店铺专区",
+    "114": "文人墨客",
+    "115": "军事国防",
+    "118": "体坛风云",
+    "121": "IC电设",
+    "134": "外语学习",
+    "140": "动漫时代",
+    "146": "清水书院",
+    "149": "影视天地",
+    "156": "篮球部落",
+    "157": "天下足球",
+    "159": "版主申请",
+    "162": "古典文字",
+    "174": "就业创业",
+    "183": "兼职信息发布栏",
+    "199": "保研考研",
+    "201": "生活信息",
+    "203": "休闲娱乐",
+    "207": "原创翻唱",
+    "208": "社团交流中心",
+    "214": "招聘信息发布栏",
+    "216": "家族专区",
+    "219": "出国留学",
+    "222": "评优专区",
+    "225": "交通出行",
+    "236": "校园热点",
+    "237": "毕业感言",
+    "244": "成电骑迹",
+    "248": "论坛周年庆活动专版",
+    "255": "房屋租赁",
+    "256": "Matlab技术交流",
+    "259": "海外成电",
+    "260": "交换学习\\u0026CSC",
+    "261": "资源汇总",
+    "262": "飞跃阁",
+    "263": "职场交流",
+    "267": "非技术岗位",
+    "273": "成电校园",
+    "305": "失物招领",
+    "308": "LaTeX技术交流",
+    "309": "成电锐评",
+    "312": "跑步家园",
+    "313": "鹊桥",
+    "316": "自然科学",
+    "326": "新生专区",
+    "334": "情系舞缘",
+    "370": "吃喝玩乐",
+    "371": "密语",
+    "378": "晾晒专栏",
+    "382": "考试专区",
+    "383": "驾校考试",
+    "387": "招生信息",
+    "388": "抢楼活动版块",
+    "389": "实习信息发布栏",
+    "391": "拼车同行",
+    "395": "藏经阁",
+    "403": "部门直通车",
+    "405": "电子科技大学医院",
+    "410": "研究生院",
+    "415": "后勤保障部",
+    "420": "党委保卫部",
+    "423": "党委学生工作部",
+    "427": "前程似锦",
+    "430": "公考选调",
+    "433": "校团委（创新创业学院）",
+    "434": "信息中心",
+    "435": "大学生文化素质教育中心",
+    "436": "体育部",
+    "888": "投资理财",
+    "889": "合作发展部",
+    "891": "沙河校区管理办公室",
+    "1024": "开发者专区"
+}
+
+
 def get_fid_name(fid: int) -> str:
-    mapping = {
-        "1": "站务管理",
-        "2": "站务公告",
-        "17": "同城同乡",
-        "20": "学术交流",
-        "25": "水手之家",
-        "42": "经典图吧",
-        "44": "时政要闻",
-        "45": "情感专区",
-        "46": "站务综合",
-        "55": "视觉艺术",
-        "61": "二手专区",
-        "66": "电子数码",
-        "70": "程序员之家",
-        "74": "音乐空间",
-        "95": "科技学术",
-        "109": "成电轨迹",
-        "111": "店铺专区",
-        "114": "文人墨客",
-        "115": "军事国防",
-        "118": "体坛风云",
-        "121": "IC电设",
-        "134": "外语学习",
-        "140": "动漫时代",
-        "146": "清水书院",
-        "149": "影视天地",
-        "156": "篮球部落",
-        "157": "天下足球",
-        "159": "版主申请",
-        "162": "古典文字",
-        "174": "就业创业",
-        "183": "兼职信息发布栏",
-        "199": "保研考研",
-        "201": "生活信息",
-        "203": "休闲娱乐",
-        "207": "原创翻唱",
-        "208": "社团交流中心",
-        "214": "招聘信息发布栏",
-        "216": "家族专区",
-        "219": "出国留学",
-        "222": "评优专区",
-        "225": "交通出行",
-        "236": "校园热点",
-        "237": "毕业感言",
-        "244": "成电骑迹",
-        "248": "论坛周年庆活动专版",
-        "255": "房屋租赁",
-        "256": "Matlab技术交流",
-        "259": "海外成电",
-        "260": "交换学习\\u0026CSC",
-        "261": "资源汇总",
-        "262": "飞跃阁",
-        "263": "职场交流",
-        "267": "非技术岗位",
-        "273": "成电校园",
-        "305": "失物招领",
-        "308": "LaTeX技术交流",
-        "309": "成电锐评",
-        "312": "跑步家园",
-        "313": "鹊桥",
-        "316": "自然科学",
-        "326": "新生专区",
-        "334": "情系舞缘",
-        "370": "吃喝玩乐",
-        "371": "密语",
-        "378": "晾晒专栏",
-        "382": "考试专区",
-        "383": "驾校考试",
-        "387": "招生信息",
-        "388": "抢楼活动版块",
-        "389": "实习信息发布栏",
-        "391": "拼车同行",
-        "395": "藏经阁",
-        "403": "部门直通车",
-        "405": "电子科技大学医院",
-        "410": "研究生院",
-        "415": "后勤保障部",
-        "420": "党委保卫部",
-        "423": "党委学生工作部",
-        "427": "前程似锦",
-        "430": "公考选调",
-        "433": "校团委（创新创业学院）",
-        "434": "信息中心",
-        "435": "大学生文化素质教育中心",
-        "436": "体育部",
-        "888": "投资理财",
-        "889": "合作发展部",
-        "891": "沙河校区管理办公室",
-        "1024": "开发者专区"
-    }
-    return mapping.get(str(fid), f"未知({fid})")
+    return FID_NAMES.get(str(fid), f"未知({fid})")
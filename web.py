@@ -1,13 +1,88 @@
 from pathlib import Path
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, Response
 import os
 import json
+import atexit
+import sqlite3
 import config
 import mobcentAPI
 import time
 import shutil
+import hmac
+from status_index import UserStatusIndex
+from progress_hub import ProgressHub
+import notify
+import metrics
+import cassette
+import eta
+import site_stats
+import preview
+import lease
+import db
+import search
+
+WEB_SECONDS = metrics.Histogram('qshp_web_request_seconds', 'web.py 各接口耗时', ('endpoint', 'status'),
+                                buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
 
 app = Flask(__name__, static_folder='static', static_url_path='/AnnualReport/static')
+status_index = UserStatusIndex(policy=getattr(config, 'queue_policy', 'hrrn'),
+                                request_seconds=getattr(config, 'queue_request_seconds', 0.02))
+site_cache = site_stats.Cache(config.year)
+eta_model = eta.EtaModel()
+# 远程爬虫节点的租约，见 lease.py；未配置 lease_token 时不启用
+LEASE_TOKEN = getattr(config, 'lease_token', None)
+lease_manager = lease.LeaseManager(getattr(config, 'lease_ttl', 300), getattr(config, 'queue_policy', 'hrrn'),
+                                   getattr(config, 'queue_request_seconds', 0.02))
+eta_fitted = 0
+
+
+def get_eta_model() -> eta.EtaModel:
+    """每隔 5 分钟用已完成任务的 task.json 重新拟合一次"""
+    global eta_model, eta_fitted
+    if time.time() - eta_fitted > 300:
+        eta_fitted = time.time()
+        eta_model = eta.EtaModel.fit(status_index.finished_tasks())
+    return eta_model
+
+
+def get_eta(uid: int) -> dict:
+    """
+    预计开始与完成时间（时间戳）
+
+    排队中：正在处理的任务的剩余时间 + 排在前面的任务的预计耗时，同时处理多个任务时按并行数平分
+    正在获取：按进度事件中已发出的请求数估计剩余时间
+    """
+    model = get_eta_model()
+    now = time.time()
+
+    def remaining(u: int, info: dict) -> float:
+        done = (progress_hub.latest.get(u) or {}).get('requests')
+        return model.remaining_seconds(info['cost'], done, now - info['started'])
+
+    info = status_index.running_info(uid)
+    if info:
+        return {"finish": int(now + remaining(uid, info))}
+    running, ahead, cost = status_index.ahead(uid)
+    busy = sum(remaining(u, r) for u, r in running.items()) + sum(model.task_seconds(c) for c in ahead)
+    start = now + busy / max(len(running), 1)
+    return {"start": int(start), "finish": int(start + model.task_seconds(cost))}
+
+
+progress_hub = ProgressHub(status_index, get_eta)
+SSE_CONNECTIONS = metrics.Gauge('qshp_sse_connections', '当前 SSE 进度连接数',
+                                func=lambda: sum(len(subs) for subs in list(progress_hub.subscribers.values())))
+
+
+@app.before_request
+def start_timer():
+    request.start_time = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    WEB_SECONDS.observe(time.perf_counter() - request.start_time, endpoint=request.endpoint or 'unknown',
+                        status=response.status_code)
+    return response
 
 
 @app.route('/AnnualReport/')
@@ -25,6 +100,61 @@ def report():
     return app.send_static_file('report.html')
 
 
+def get_user_status(uid: int) -> dict:
+    """从内存索引中获取用户状态，返回 user_status_api 的响应体"""
+    entry, rank = status_index.get(uid)
+    size = entry['size'] if entry else 0
+
+    # 1. 已完成？
+    if entry and entry['report']:
+        return {
+            "code": 0,
+            "message": "年度报告已生成完成",
+            "status": "完成",
+            "size": size,
+            "task": entry['task']
+        }
+
+    # 2. 报告生成失败？（重新申请后在队列中时按排队显示）
+    if entry and entry.get('failed') and rank is None:
+        return {
+            "code": 0,
+            "message": "年度报告生成失败，请联系管理员",
+            "status": "失败",
+            "size": size
+        }
+
+    # 3. 正在获取数据？
+    if entry and entry['db']:
+        return {
+            "code": 0,
+            "message": "正在获取用户数据，请稍候",
+            "status": "正在获取数据",
+            "size": size,
+            "preview": entry.get('preview', False),
+            "eta": get_eta(uid)
+        }
+
+    # 4. 在队列中？
+    if rank is not None:
+        return {
+            "code": 0,
+            "message": "用户已在生成队列中",
+            "status": "队列",
+            "size": 0,
+            "queue": rank,
+            "eta": get_eta(uid)
+        }
+
+    # 5. 未生成
+    return {
+        "code": 0,
+        "message": "用户年度报告尚未生成",
+        "status": "未生成",
+        "size": 0
+    }
+
+
 @app.route('/AnnualReport/api/user_status')
 def user_status_api():
     uid = request.args.get('uid')
@@ -38,7 +168,6 @@ def user_status_api():
 
     try:
         uid_int = int(uid)
-        uid_str = str(uid_int)
     except (ValueError, TypeError):
         return jsonify({
             "code": 1,
@@ -46,81 +175,42 @@ def user_status_api():
             "status": "错误"
         }), 400
 
-    user_dir = os.path.join('data', 'user', uid_str)
-    post_db_path = os.path.join(user_dir, 'post.db')
-    report_json_path = os.path.join(user_dir, 'report.json')
-    task_json_path = os.path.join(user_dir, 'task.json')
-    queue_file_path = os.path.join('data', 'queue', uid_str)
+    return jsonify(get_user_status(uid_int))
 
-    # 获取 post.db 的大小（如果存在），否则为 0
-    size = os.path.getsize(post_db_path) if os.path.exists(post_db_path) else 0
 
-    # 1. 已完成？
-    if os.path.exists(report_json_path):
-        task_data = {}
-        if os.path.exists(task_json_path):
-            try:
-                with open(task_json_path, 'r', encoding='utf-8') as f:
-                    task_data = json.load(f)
-            except (json.JSONDecodeError, OSError):
-                task_data = {}
+@app.route('/AnnualReport/api/progress')
+def progress_api():
+    """
+    Server-Sent Events 推送任务进度，替代客户端轮询 user_status
 
+    首条消息与 user_status 返回相同，之后转发 worker 的进度事件，报告生成完成后关闭连接
+    """
+    try:
+        uid = int(request.args.get('uid'))
+    except (ValueError, TypeError):
         return jsonify({
-            "code": 0,
-            "message": "年度报告已生成完成",
-            "status": "完成",
-            "size": size,
-            "task": task_data
-        })
+            "code": 1,
+            "message": "uid 必须为整数"
+        }), 400
 
-    # 2. 正在获取数据？
-    if os.path.exists(post_db_path):
-        return jsonify({
-            "code": 0,
-            "message": "正在获取用户数据，请稍候",
-            "status": "正在获取数据",
-            "size": size
-        })
+    status = get_user_status(uid)
+    follow = status['status'] in ('队列', '正在获取数据')
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(progress_hub.stream(uid, status, follow), mimetype='text/event-stream', headers=headers)
 
-    # 3. 在队列中？
-    queue_dir = Path("data/queue")
-    if os.path.isfile(queue_file_path):
-        if queue_dir.exists() and queue_file_path.startswith(str(queue_dir)):
-            # 收集所有纯数字命名的文件，并按 mtime 排序
-            queue_files = []
-            for f in queue_dir.iterdir():
-                if f.is_file() and f.name.isdigit():
-                    try:
-                        mtime = f.stat().st_mtime
-                        queue_files.append((f.name, mtime))
-                    except OSError:
-                        continue  # 跳过无法访问的文件
-
-            # 按修改时间升序排序
-            queue_files.sort(key=lambda x: x[1])
-
-            # 查找当前 uid 的排名（从 1 开始）
-            rank = None
-            for idx, (fname, _) in enumerate(queue_files, start=1):
-                if fname == uid_str:
-                    rank = idx
-                    break
 
-            return jsonify({
-                "code": 0,
-                "message": "用户已在生成队列中",
-                "status": "队列",
-                "size": 0,
-                "queue": rank
-            })
-
-    # 4. 未生成
-    return jsonify({
-        "code": 0,
-        "message": "用户年度报告尚未生成",
-        "status": "未生成",
-        "size": 0
-    })
+def send_precompressed(path: str) -> Response:
+    """按 Accept-Encoding 发送 path 或其预压缩的 .br/.gz（见 util.write_precompressed）"""
+    accept = request.headers.get('Accept-Encoding', '')
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in accept and os.path.exists(path + suffix):
+            response = send_file(path + suffix, mimetype='application/json')
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_file(path, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 
 @app.route('/AnnualReport/api/get_report')
@@ -141,7 +231,38 @@ def get_report_api():
             "message": "uid 必须为整数"
         }), 400
 
-    report_path = os.path.join('data', 'user', str(uid), 'report.json')
+    # 多年任务的其他年份写在 report.{year}.json 中
+    name = 'report'
+    if request.args.get('year'):
+        try:
+            name = f'report.{int(request.args["year"])}'
+        except ValueError:
+            return jsonify({
+                "code": 1,
+                "message": "year 必须为整数"
+            }), 400
+
+    # part=core 只返回首屏内容（不含排行），part=rank 返回排行，见 generate_report.report_parts
+    part = request.args.get('part')
+    if part not in (None, 'core', 'rank'):
+        return jsonify({
+            "code": 1,
+            "message": "part 必须为 core 或 rank"
+        }), 400
+
+    report_path = os.path.join('data', 'user', str(uid), f'{name}.json')
+    min_path = os.path.join('data', 'user', str(uid), f'{name}.min.json')
+    part_path = os.path.join('data', 'user', str(uid), f'{name}.{part}.min.json')
+
+    # 优先发送生成时写好的精简/预压缩响应体，无需读取解析 report.json
+    # 之前生成的报告没有分段文件，此时返回完整的精简报告（report.js 据 data.rank 是否存在判断）
+    paths = [part_path, min_path] if part else [min_path]
+    if name == 'report' and not os.path.exists(report_path):
+        # 完整报告生成前发送列表阶段写入的预览（data.preview 为 true，见 preview.py），不分段
+        paths.append(os.path.join('data', 'user', str(uid), preview.PREVIEW_NAME))
+    for path in paths:
+        if os.path.exists(path):
+            return send_precompressed(path)
 
     if not os.path.exists(report_path):
         return jsonify({
@@ -164,6 +285,101 @@ def get_report_api():
         }), 500
 
 
+@app.route('/AnnualReport/api/get_post')
+def get_post_api():
+    """报告中某个帖子的全文（报告中只有摘要），只能获取出现在该用户报告中的帖子"""
+    try:
+        uid = int(request.args.get('uid'))
+        pid = int(request.args.get('pid'))
+        year = request.args.get('year')
+        name = f'report.{int(year)}' if year else 'report'
+    except (ValueError, TypeError):
+        return jsonify({
+            "code": 1,
+            "message": "uid、pid、year 必须为整数"
+        }), 400
+
+    messages_path = os.path.join('data', 'user', str(uid), f'{name}.messages.json')
+    try:
+        with open(messages_path, 'r', encoding='utf-8') as f:
+            message = json.load(f).get(str(pid))
+    except FileNotFoundError:
+        message = None
+    except (json.JSONDecodeError, OSError) as e:
+        return jsonify({
+            "code": 3,
+            "message": f"读取报告文件失败: {str(e)}"
+        }), 500
+    if message is None:
+        return jsonify({
+            "code": 2,
+            "message": "帖子不在年度报告中"
+        }), 404
+    response = jsonify({
+        "code": 0,
+        "message": "成功",
+        "data": {"pid": pid, "message": message}
+    })
+    # 报告生成后帖子全文不再变化
+    response.headers['Cache-Control'] = 'max-age=3600'
+    return response
+
+
+@app.route('/AnnualReport/api/search')
+def search_api():
+    """在用户的全部帖子中搜索（报告生成后可用）：q 为空白分隔的关键词，page 从 1 开始，year 可选，见 search.py"""
+    try:
+        uid = int(request.args.get('uid'))
+        page = int(request.args.get('page', 1))
+        year = request.args.get('year')
+        year = int(year) if year else None
+    except (ValueError, TypeError):
+        return jsonify({
+            "code": 1,
+            "message": "uid、page、year 必须为整数"
+        }), 400
+    query = (request.args.get('q') or '').strip()
+    if not query or len(query) > search.MAX_QUERY_LENGTH:
+        return jsonify({
+            "code": 1,
+            "message": f"q 不能为空，且不超过 {search.MAX_QUERY_LENGTH} 个字符"
+        }), 400
+
+    # 只搜索已生成报告的用户：此时数据已获取完，也不会为不存在的用户创建目录
+    entry, _ = status_index.get(uid)
+    if not entry or not entry['report']:
+        return jsonify({
+            "code": 2,
+            "message": "年度报告尚未生成或不存在"
+        }), 404
+    # 只读打开，不还原 compact.py 归档的库
+    conn = db.get_readonly_conn(uid)
+    if conn is None and os.path.exists(f'data/user/{uid}/post.db.gz'):
+        return jsonify({
+            "code": 6,
+            "message": "该用户的数据已归档，暂不支持搜索"
+        }), 404
+    if conn is None:
+        return jsonify({
+            "code": 2,
+            "message": "帖子数据不存在"
+        }), 404
+    try:
+        result = search.search(conn, query, year, page)
+    except sqlite3.Error as e:
+        return jsonify({
+            "code": 3,
+            "message": f"搜索失败: {str(e)}"
+        }), 500
+    finally:
+        conn.close()
+    return jsonify({
+        "code": 0,
+        "message": "成功",
+        "data": result
+    })
+
+
 @app.route('/AnnualReport/api/new_task', methods=['POST'])
 def new_task_api():
     # 1. 检查请求是否为 JSON
@@ -202,9 +418,8 @@ def new_task_api():
 
     auth = auth.strip()
 
-    # 3. 验证私信认证
-    d = {uid: auth}
-    success, result = m_api.check_pm(d, time_limit=600)
+    # 3. 验证私信认证（合并查询或本地索引，见 mobcentAPI.PmBatcher / PmInbox）
+    success, result = pm_checker.check(uid, auth)
 
     if not success:
         return jsonify({
@@ -212,7 +427,7 @@ def new_task_api():
             "message": result or "私信验证失败"
         }), 400
 
-    if not result.get(uid, False):
+    if not result:
         return jsonify({
             "code": 5,
             "message": "未在最近 600 秒内收到包含指定认证字符串的私信"
@@ -266,6 +481,8 @@ def new_task_api():
             "message": f"移动任务文件到队列失败: {e}"
         }), 500
 
+    on_event({"event": "enqueue", "uid": uid, "mtime": final_file.stat().st_mtime})
+
     # 8. 成功
     return jsonify({
         "code": 0,
@@ -274,12 +491,151 @@ def new_task_api():
     })
 
 
+def check_lease_token() -> tuple[Response, int] | None:
+    """校验远程节点的 Authorization: Bearer {lease_token}，未配置 lease_token 时租约接口不可用"""
+    if not LEASE_TOKEN:
+        return jsonify({
+            "code": 1,
+            "message": "未启用远程节点"
+        }), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {LEASE_TOKEN}'):
+        return jsonify({
+            "code": 1,
+            "message": "认证失败"
+        }), 403
+    return None
+
+
+def lease_args(data) -> tuple[int, str]:
+    """从请求中取出 uid 与租约 id，格式错误时抛出 ValueError"""
+    uid = int(data.get('uid'))
+    lease_id = data.get('lease')
+    if not isinstance(lease_id, str):
+        raise ValueError
+    return uid, lease_id
+
+
+@app.route('/AnnualReport/api/lease/claim', methods=['POST'])
+def lease_claim_api():
+    """远程节点领取一个任务（见 lease.py、remote_worker.py），没有任务时 data 为 null"""
+    if error := check_lease_token():
+        return error
+    data = request.get_json(silent=True) or {}
+    lease = lease_manager.claim(str(data.get('worker') or request.remote_addr))
+    return jsonify({
+        "code": 0,
+        "message": "成功",
+        "data": lease and {"uid": lease['uid'], "lease": lease['id'], "task": lease['task'],
+                           "ttl": lease_manager.ttl}
+    })
+
+
+@app.route('/AnnualReport/api/lease/heartbeat', methods=['POST'])
+def lease_heartbeat_api():
+    """续期租约，可附带进度 {"stage", "requests", ...}"""
+    if error := check_lease_token():
+        return error
+    data = request.get_json(silent=True) or {}
+    try:
+        uid, lease_id = lease_args(data)
+    except (ValueError, TypeError):
+        return jsonify({
+            "code": 1,
+            "message": "缺少 uid 或 lease 参数"
+        }), 400
+    progress = data.get('progress')
+    try:
+        expires = lease_manager.heartbeat(uid, lease_id, progress if isinstance(progress, dict) else None)
+    except lease.LeaseError as e:
+        return jsonify({
+            "code": 2,
+            "message": str(e)
+        }), 409
+    return jsonify({
+        "code": 0,
+        "message": "成功",
+        "data": {"expires": expires}
+    })
+
+
+@app.route('/AnnualReport/api/lease/complete', methods=['POST'])
+def lease_complete_api():
+    """上传 post.db 与 task.json（multipart 的 post_db、task_json 字段），之后由本机生成报告"""
+    if error := check_lease_token():
+        return error
+    try:
+        uid, lease_id = lease_args(request.form)
+        post_db = request.files['post_db']
+        task_json = request.files['task_json'].read()
+    except (ValueError, TypeError, KeyError):
+        return jsonify({
+            "code": 1,
+            "message": "缺少 uid、lease、post_db 或 task_json"
+        }), 400
+    try:
+        lease_manager.complete(uid, lease_id, post_db, task_json)
+    except (lease.LeaseError, ValueError) as e:
+        return jsonify({
+            "code": 2,
+            "message": str(e)
+        }), 409
+    return jsonify({
+        "code": 0,
+        "message": "成功"
+    })
+
+
 @app.route('/AnnualReport/api/get_user_total/')
 def get_user_total_api():
-    user_count = len([f for f in os.listdir('data/user') if os.path.isdir(os.path.join('data/user', f))])
-    return jsonify({"year": config.year, "user_count": user_count})
+    return jsonify({"year": config.year, "user_count": status_index.user_count(),
+                    "site": site_cache.get().summary()})
+
+
+@app.route('/AnnualReport/api/site_rank')
+def site_rank_api():
+    """用户各指标当前超过的用户百分比（报告中的 site 为生成时的值）"""
+    try:
+        uid = int(request.args.get('uid'))
+    except (ValueError, TypeError):
+        return jsonify({
+            "code": 1,
+            "message": "uid 必须为整数"
+        }), 400
+
+    stats = site_cache.get()
+    values = stats.users.get(uid)
+    if values is None:
+        return jsonify({
+            "code": 2,
+            "message": "年度报告尚未生成或不存在"
+        }), 404
+    return jsonify({
+        "code": 0,
+        "message": "成功",
+        "data": {"users": len(stats.users), "percentile": stats.percentiles(values)}
+    })
+
+
+def on_event(event: dict):
+    """notify 事件先更新状态索引，再推送给 SSE 订阅者（推送时需要用到新的队列排名）"""
+    status_index.handle(event)
+    progress_hub.publish(event)
 
 
 if __name__ == '__main__':
     m_api = mobcentAPI.MobcentAPI(config.username, config.password)
-    app.run('127.0.0.1', 9595, debug=False)
+    if os.environ.get('QSHP_CASSETTE') == 'record':
+        # 录制私信查询的请求，供离线分析
+        atexit.register(cassette.install(m_api, 'data/mobcent.cassette.jsonl.gz', 'record', {'client': 'mobcent'}).close)
+    if getattr(config, 'pm_poll_interval', 0):
+        # 后台轮询收到的私信，验证在本地完成
+        pm_checker = mobcentAPI.PmInbox(m_api, config.pm_poll_interval, retention=600)
+    else:
+        pm_checker = mobcentAPI.PmBatcher(m_api, getattr(config, 'pm_batch_window', 0.2),
+                                          getattr(config, 'pm_batch_size', 50), time_limit=600)
+    status_index.start()
+    if LEASE_TOKEN:
+        lease_manager.start()
+    metrics.serve(getattr(config, 'web_metrics_port', 9598))
+    notify.listen(on_event)
+    app.run('127.0.0.1', 9595, debug=False, threaded=True)